@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración del índice aproximado
+# ==============================
+ANN_HABILITADO = os.getenv("ANN_HABILITADO", "false").lower() in ("1", "true", "si", "sí")
+# Por debajo de este número de chunks se usa la búsqueda exacta
+ANN_UMBRAL = int(os.getenv("ANN_UMBRAL", 20000))
+# Listas (celdas) que se revisan por consulta; más listas = más recall y más latencia
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", 8))
+# 0 = sqrt(número de chunks)
+ANN_LISTAS = int(os.getenv("ANN_LISTAS", 0))
+# Máximo de vectores usados para entrenar los centroides
+ANN_MUESTRA_ENTRENAMIENTO = int(os.getenv("ANN_MUESTRA_ENTRENAMIENTO", 50000))
+
+
+class IndiceIVF:
+    """
+    Índice IVF (inverted file) sobre vectores ya normalizados:
+    k-means esférico como cuantizador grueso y una lista de posiciones por centroide.
+    Una consulta solo calcula similitudes contra las `nprobe` listas más cercanas.
+    """
+
+    def __init__(self, matriz, n_listas=None, iteraciones=10, semilla=0):
+        self.matriz = matriz
+        total = len(matriz)
+        n_listas = n_listas or ANN_LISTAS or int(np.sqrt(total))
+        self.n_listas = max(1, min(n_listas, total))
+
+        rng = np.random.default_rng(semilla)
+        if total > ANN_MUESTRA_ENTRENAMIENTO:
+            muestra = matriz[rng.choice(total, ANN_MUESTRA_ENTRENAMIENTO, replace=False)]
+        else:
+            muestra = matriz
+
+        self.centroides = self._entrenar(muestra, iteraciones, rng)
+        asignacion = self._asignar(matriz)
+        orden = np.argsort(asignacion, kind="stable")
+        limites = np.searchsorted(asignacion[orden], np.arange(self.n_listas + 1))
+        self.listas = [orden[limites[c]:limites[c + 1]] for c in range(self.n_listas)]
+
+    def _asignar(self, vectores, bloque=8192):
+        asignacion = np.empty(len(vectores), dtype=np.int64)
+        for i in range(0, len(vectores), bloque):
+            asignacion[i:i + bloque] = np.argmax(vectores[i:i + bloque] @ self.centroides.T, axis=1)
+        return asignacion
+
+    def _entrenar(self, muestra, iteraciones, rng):
+        centroides = muestra[rng.choice(len(muestra), self.n_listas, replace=False)].copy()
+        for _ in range(iteraciones):
+            self.centroides = centroides
+            asignacion = self._asignar(muestra)
+            sumas = np.zeros_like(centroides)
+            np.add.at(sumas, asignacion, muestra)
+            normas = np.linalg.norm(sumas, axis=1, keepdims=True)
+            vacios = normas[:, 0] == 0
+            # Un centroide sin puntos se reinicia con un vector al azar de la muestra
+            if vacios.any():
+                sumas[vacios] = muestra[rng.choice(len(muestra), int(vacios.sum()))]
+                normas[vacios] = np.linalg.norm(sumas[vacios], axis=1, keepdims=True)
+            normas[normas == 0] = 1.0
+            centroides = (sumas / normas).astype(np.float32)
+        return centroides
+
+    def candidatos(self, consulta, nprobe=None):
+        """Posiciones de los chunks en las `nprobe` listas más cercanas a la consulta."""
+        nprobe = max(1, min(nprobe or ANN_NPROBE, self.n_listas))
+        cercanas = np.argpartition(-(self.centroides @ consulta), nprobe - 1)[:nprobe]
+        return np.concatenate([self.listas[c] for c in cercanas])
+
+    def buscar(self, consulta, k=5, nprobe=None):
+        """Top-k aproximado de una consulta normalizada: [(posición, similitud)]."""
+        from app.indice import top_k
+
+        posiciones = self.candidatos(consulta, nprobe)
+        similitudes = self.matriz[posiciones] @ consulta
+        return [(int(posiciones[i]), s) for i, s in top_k(similitudes, k)]
+
+
+def construir_si_aplica(matriz):
+    """Construye el IVF solo si está habilitado y el (topic, channel) supera ANN_UMBRAL."""
+    if not ANN_HABILITADO or len(matriz) < ANN_UMBRAL:
+        return None
+    inicio = time.time()
+    ivf = IndiceIVF(matriz)
+    logger.info(f"IVF construido: {len(matriz)} chunks, {ivf.n_listas} listas en {time.time() - inicio:.2f}s")
+    return ivf
+
+
+def normalizar_filas(matriz):
+    """Copia float32 contigua con cada fila de norma 1; las filas en 0 se quedan en 0."""
+    matriz = np.array(matriz, dtype=np.float32, order="C")
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    matriz /= normas
+    return matriz
+
+
+# =========================================================
+# Reporte recall vs latencia
+# =========================================================
+def reporte_recall(matriz, consultas, k=5, nprobes=(1, 2, 4, 8, 16, 32), n_listas=None):
+    """
+    Compara el IVF contra el ranking exacto (coseno) para varias `nprobe`.
+    `matriz` y `consultas` deben venir normalizadas. Regresa una lista de dicts
+    con recall@k y latencias p50/p99 en milisegundos; la primera fila es la búsqueda exacta.
+    """
+    from app.indice import top_k
+
+    def percentiles(tiempos):
+        return round(float(np.percentile(tiempos, 50)) * 1000, 3), round(float(np.percentile(tiempos, 99)) * 1000, 3)
+
+    exactos = []
+    tiempos = []
+    for consulta in consultas:
+        inicio = time.perf_counter()
+        top = top_k(matriz @ consulta, k)
+        tiempos.append(time.perf_counter() - inicio)
+        exactos.append({posicion for posicion, _ in top})
+    p50, p99 = percentiles(tiempos)
+    filas = [{"modo": "exacto", "nprobe": None, "recall": 1.0, "p50_ms": p50, "p99_ms": p99}]
+
+    inicio = time.time()
+    ivf = IndiceIVF(matriz, n_listas=n_listas)
+    construccion = round(time.time() - inicio, 3)
+
+    for nprobe in nprobes:
+        if nprobe > ivf.n_listas:
+            continue
+        aciertos = 0
+        tiempos = []
+        for consulta, esperado in zip(consultas, exactos):
+            inicio = time.perf_counter()
+            top = ivf.buscar(consulta, k, nprobe)
+            tiempos.append(time.perf_counter() - inicio)
+            aciertos += len(esperado & {posicion for posicion, _ in top})
+        p50, p99 = percentiles(tiempos)
+        filas.append({
+            "modo": "ivf",
+            "nprobe": nprobe,
+            "listas": ivf.n_listas,
+            "construccion_s": construccion,
+            "recall": round(aciertos / (len(consultas) * min(k, len(matriz))), 4),
+            "p50_ms": p50,
+            "p99_ms": p99,
+        })
+    return filas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall vs latencia del índice IVF contra el ranking exacto")
+    origen = parser.add_mutually_exclusive_group(required=True)
+    origen.add_argument("--npy", help="Matriz de embeddings guardada con np.save")
+    origen.add_argument("--topic", help="Cargar los embeddings del topic desde BigQuery (requiere --channel)")
+    parser.add_argument("--channel")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--listas", type=int, default=None)
+    parser.add_argument("--ruido", type=float, default=0.05, help="Ruido gaussiano sobre los chunks usados como consulta")
+    args = parser.parse_args(argv)
+
+    if args.npy:
+        matriz = np.load(args.npy)
+    else:
+        from app.main import cargar_filas_indice
+
+        matriz = np.array([fila["embedding"] for fila in cargar_filas_indice(args.topic, args.channel)])
+    matriz = normalizar_filas(matriz)
+
+    # Consultas: chunks reales con un poco de ruido, para parecerse a preguntas del mismo dominio
+    rng = np.random.default_rng(0)
+    elegidos = rng.choice(len(matriz), min(args.consultas, len(matriz)), replace=False)
+    consultas = normalizar_filas(matriz[elegidos] + rng.normal(0, args.ruido, (len(elegidos), matriz.shape[1])))
+
+    filas = reporte_recall(matriz, consultas, k=args.k, n_listas=args.listas)
+    print(json.dumps({"chunks": len(matriz), "dimension": matriz.shape[1], "resultados": filas}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,10 +2,18 @@ from google.cloud import bigquery
 import os
 import logging
 import uuid
+import io
+import json
+import hashlib
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
-from vertexai.language_models import TextEmbeddingModel
-import vertexai
+from app.clientes import obtener_bq_client
+from app.modelos import EMBEDDING_MODELO_LEGADO, ModeloIncompatible, modelo_activo
+from app.embeddings import generar_embeddings_con_cache
+from app.cache_embeddings import obtener_cache_embeddings
+from app.metricas import ETAPA_BIGQUERY_INSERCION, span
+from app.migraciones import COLUMNAS_MODELO
 
 # ==============================
 # Configurar logging
@@ -22,14 +30,37 @@ PROJECT_ID = os.getenv("PROJECT_ID")
 DATASET_ID = os.getenv("DATASET_ID")
 TABLE_ID = os.getenv("TABLE_ID")
 TABLE_ID_BETA = os.getenv("TABLE_ID_BETA")
+# "streaming" (insert_rows_json), "load" (load job NDJSON por documento)
+# o "incremental" (solo escribe los chunks nuevos, modificados o eliminados)
+BQ_MODO_ESCRITURA = os.getenv("BQ_MODO_ESCRITURA", "streaming")
 
 # ==============================
-# Inicializar Vertex AI y BigQuery
+# Vertex AI y BigQuery (clientes perezosos en app/clientes.py)
 # ==============================
-vertexai.init(project=PROJECT_ID, location="us-central1")
+# El modelo y la dimensión de los embeddings vienen del registro compartido con la búsqueda (app/modelos.py)
 
-bq_client = bigquery.Client()
-embedding_model = TextEmbeddingModel.from_pretrained("gemini-embedding-001")
+# Tablas a las que ya se les verificaron las columnas embedding_model / embedding_dimension
+_tablas_con_columnas_modelo = set()
+_columnas_modelo_lock = threading.Lock()
+
+
+def verificar_columnas_modelo(table_ref):
+    """
+    Revisa (hasta encontrarlas, una vez por proceso y tabla) que la tabla tenga las columnas con el
+    modelo y la dimensión de cada embedding. No las agrega: es una migración que se corre al desplegar
+    (python -m app.migraciones), porque escribir justo después de alterar la tabla puede fallar.
+    """
+    with _columnas_modelo_lock:
+        if table_ref in _tablas_con_columnas_modelo:
+            return
+    existentes = {campo.name for campo in obtener_bq_client().get_table(table_ref).schema}
+    faltantes = [columna for columna in COLUMNAS_MODELO if columna not in existentes]
+    if faltantes:
+        raise Exception(
+            f"A la tabla {table_ref} le faltan las columnas {faltantes}; ejecuta `python -m app.migraciones` antes de ingestar"
+        )
+    with _columnas_modelo_lock:
+        _tablas_con_columnas_modelo.add(table_ref)
 
 # ==============================
 # Helper: batches de 50
@@ -38,12 +69,317 @@ def batch_rows(rows, batch_size=50):
     for i in range(0, len(rows), batch_size):
         yield rows[i:i + batch_size]
 
+# ==============================
+# Helper: escritura con load job
+# ==============================
+def filas_a_ndjson(rows):
+    """Serializa las filas como newline-delimited JSON en un buffer en memoria."""
+    buffer = io.BytesIO()
+    for row in rows:
+        buffer.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        buffer.write(b"\n")
+    buffer.seek(0)
+    return buffer
+
+
+def cargar_filas_con_load_job(table_ref, rows, write_disposition=bigquery.WriteDisposition.WRITE_APPEND, schema=None):
+    """
+    Escribe todas las filas con un solo load job (sin streaming buffer, así los DML
+    posteriores pueden tocarlas de inmediato). Regresa el número de filas cargadas.
+    """
+    if not rows:
+        return 0
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition=write_disposition,
+    )
+    if schema is not None:
+        job_config.schema = schema
+
+    logger.info(f"Cargando {len(rows)} filas a {table_ref} con load job...")
+    with span(ETAPA_BIGQUERY_INSERCION):
+        load_job = obtener_bq_client().load_table_from_file(filas_a_ndjson(rows), table_ref, job_config=job_config)
+        load_job.result()  # Esperar a que termine; lanza excepción si falla
+    if load_job.errors:
+        raise Exception(f"Error cargando en BigQuery ({table_ref}): {load_job.errors}")
+    logger.info(f"Load job completado: {load_job.output_rows} filas")
+    return load_job.output_rows or len(rows)
+
+
+def reemplazar_con_staging(table_ref, rows, topic, channel):
+    """
+    Carga las filas a una tabla staging con el esquema del destino y reemplaza el
+    topic/channel en una transacción (DELETE + INSERT): un lector ve todo lo viejo o todo lo nuevo.
+    """
+    staging_ref = f"{table_ref}_staging_{uuid.uuid4().hex[:12]}"
+    schema = obtener_bq_client().get_table(table_ref).schema
+    try:
+        cargar_filas_con_load_job(
+            staging_ref, rows, bigquery.WriteDisposition.WRITE_TRUNCATE, schema=schema
+        )
+        columnas = ", ".join(f"`{campo.name}`" for campo in schema)
+        script = f"""
+        BEGIN TRANSACTION;
+        DELETE FROM `{table_ref}`
+        WHERE LOWER(knowledge_domain) = @topic
+          AND LOWER(channel) = @channel;
+        INSERT INTO `{table_ref}` ({columnas})
+        SELECT {columnas} FROM `{staging_ref}`;
+        COMMIT TRANSACTION;
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("topic", "STRING", topic.lower().strip()),
+                bigquery.ScalarQueryParameter("channel", "STRING", channel.lower().strip()),
+            ]
+        )
+        logger.info(f"Reemplazando topic={topic.lower().strip()}, channel={channel.lower().strip()} desde {staging_ref}")
+        with span(ETAPA_BIGQUERY_INSERCION):
+            obtener_bq_client().query(script, job_config=job_config).result()
+    finally:
+        obtener_bq_client().delete_table(staging_ref, not_found_ok=True)
+    return len(rows)
+
+# ==============================
+# Helper: embeddings en lotes
+# ==============================
+def generar_embeddings_parrafos(parrafos_con_intenciones):
+    """
+    Genera los embeddings de todos los párrafos en lotes concurrentes, en el orden original.
+    Los párrafos que ya están en la caché por contenido no se mandan a Vertex.
+    Regresa (embeddings, {"hits", "misses"}).
+    """
+    modelo = modelo_activo()
+    resultados, estadisticas_cache = generar_embeddings_con_cache(
+        modelo,
+        [parrafo["texto"] for parrafo in parrafos_con_intenciones],
+        obtener_cache_embeddings(),
+        nombre_modelo=modelo.nombre,
+        dimension=modelo.dimension_reducida,
+    )
+
+    fallidos = [r for r in resultados if not r.ok]
+    if fallidos:
+        for r in fallidos:
+            logger.error(f"Error generando embedding para párrafo {r.posicion}: {r.error}")
+        detalle = "; ".join(f"párrafo {r.posicion}: {r.error}" for r in fallidos)
+        raise Exception(f"Error generando embeddings ({len(fallidos)} párrafos): {detalle}")
+
+    return [r.values for r in resultados], estadisticas_cache
+
+# Intents cuyo texto se repite entre documentos; se guardan con is_repeat = 'S'
+INTENTS_REPETIDOS = {
+    "aportacionesobreropatronales",
+    "aportacionespatronales",
+    "aportacionesentucuentaindividual",
+    "continuacionmodalidadcuarenta",
+    "requisitosmodalidadcuarenta",
+    "beneficiosdelamodalidadcuarenta",
+    "pagomodalidadcuarenta",
+    "inscripcionmodalidadcuarenta",
+    "consideracionesdelamodalidadcuarenta",
+}
+
+# =========================================================
+# Re-ingesta incremental
+# =========================================================
+# Columna extra de la tabla staging que indica si la fila se inserta o actualiza una guardada
+COLUMNA_OPERACION = "operacion_incremental"
+OPERACION_INSERTAR = "insertar"
+OPERACION_ACTUALIZAR = "actualizar"
+
+def huella_chunk(intent, texto):
+    """Huella de contenido de un chunk: intent + texto, tal como se guardan."""
+    return hashlib.sha256(f"{intent}\x1f{texto}".encode("utf-8")).hexdigest()
+
+
+def _con_ordinal(filas):
+    """
+    Llave estable por chunk: (intent, ordinal), donde ordinal es la ocurrencia del intent
+    dentro del documento. Insertar una sección no cambia la llave de las demás.
+    """
+    vistos = {}
+    for fila in filas:
+        ordinal = vistos.get(fila["intent"], 0)
+        vistos[fila["intent"]] = ordinal + 1
+        yield (fila["intent"], ordinal), fila
+
+
+def calcular_cambios(existentes, rows):
+    """
+    Compara las filas guardadas (id, intent, chunk_id, text, embedding_model, embedding_dimension) contra las nuevas.
+    Regresa un dict con:
+    - nuevos: filas nuevas (sin llave equivalente guardada)
+    - modificados: filas nuevas con el id de la guardada cuyo texto cambió
+      o cuyo embedding es de otro modelo o dimensión (se vuelve a embeber)
+    - movidos: filas con el mismo contenido pero otro chunk_id (no requieren embedding)
+    - eliminados: ids guardados que ya no existen o que son copias duplicadas
+    - sin_cambios: número de chunks que no se tocan
+    """
+    existentes = sorted(existentes, key=lambda f: (int(f["chunk_id"]), f["id"]))
+    unicos = []
+    duplicados = []
+    vistos = set()
+    for fila in existentes:
+        # Las versiones viejas del modo append dejaron copias con el mismo chunk_id y contenido
+        llave = (str(fila["chunk_id"]), huella_chunk(fila["intent"], fila["text"]))
+        if llave in vistos:
+            duplicados.append(fila["id"])
+        else:
+            vistos.add(llave)
+            unicos.append(fila)
+
+    guardados = dict(_con_ordinal(unicos))
+    cambios = {"nuevos": [], "modificados": [], "movidos": [], "eliminados": duplicados, "sin_cambios": 0}
+    for llave, row in _con_ordinal(rows):
+        guardado = guardados.pop(llave, None)
+        if guardado is None:
+            cambios["nuevos"].append(row)
+        elif guardado["text"] != row["text"] or not _embedding_del_modelo_activo(guardado):
+            cambios["modificados"].append({**row, "id": guardado["id"]})
+        elif str(guardado["chunk_id"]) != str(row["chunk_id"]):
+            cambios["movidos"].append({**row, "id": guardado["id"]})
+        else:
+            cambios["sin_cambios"] += 1
+    cambios["eliminados"] += [fila["id"] for fila in guardados.values()]
+    return cambios
+
+
+def _embedding_del_modelo_activo(guardado):
+    try:
+        modelo_activo().verificar(guardado.get("embedding_model"), guardado.get("embedding_dimension"))
+    except ModeloIncompatible:
+        return False
+    return True
+
+
+def leer_chunks_existentes(table_ref, filtros):
+    """
+    Filas guardadas (sin embeddings) que cumplen `filtros` {columna: valor}, con el modelo
+    y la dimensión de su embedding (las filas previas a esas columnas cuentan como EMBEDDING_MODELO_LEGADO).
+    """
+    condiciones = " AND ".join(f"`{columna}` = @{columna}" for columna in filtros)
+    query = f"""
+        SELECT id, intent, chunk_id, text,
+            COALESCE(embedding_model, @modelo_legado) AS embedding_model,
+            COALESCE(embedding_dimension, ARRAY_LENGTH(embedding)) AS embedding_dimension
+        FROM `{table_ref}`
+        WHERE {condiciones}
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter(c, "STRING", v) for c, v in filtros.items()]
+        + [bigquery.ScalarQueryParameter("modelo_legado", "STRING", EMBEDDING_MODELO_LEGADO)]
+    )
+    return [dict(fila) for fila in obtener_bq_client().query(query, job_config=job_config).result()]
+
+
+def sincronizar_incremental(table_ref, rows, filtros, embeddings_precalculados=None):
+    """
+    Re-ingesta por diferencias: solo se generan embeddings de los chunks nuevos o modificados
+    y solo se escriben esas filas, más el DELETE de las que desaparecieron.
+    Los nuevos, modificados y movidos se cargan a una tabla staging con load job y se aplican
+    en una transacción (DELETE + UPDATE + INSERT), así un lector ve el documento completo viejo
+    o nuevo. Las filas de la llave no pueden estar en el streaming buffer (los DML las rechazan);
+    por eso este modo escribe siempre con load jobs.
+    Regresa {"total_insertados", "embedding_cache", "cambios": {nuevos, modificados, movidos, eliminados, sin_cambios}}.
+    """
+    cambios = calcular_cambios(leer_chunks_existentes(table_ref, filtros), rows)
+    por_embeber = cambios["nuevos"] + cambios["modificados"]
+
+    estadisticas_cache = {"hits": 0, "misses": 0}
+    if por_embeber:
+        if embeddings_precalculados is not None:
+            embeddings = embeddings_precalculados[0]
+            estadisticas_cache = embeddings_precalculados[1]
+            for row in por_embeber:
+                row["embedding"] = embeddings[int(row["chunk_id"])]
+        else:
+            embeddings, estadisticas_cache = generar_embeddings_parrafos(
+                [{"texto": row["text"]} for row in por_embeber]
+            )
+            for row, embedding in zip(por_embeber, embeddings):
+                row["embedding"] = embedding
+    for row in cambios["movidos"]:
+        # Un arreglo vacío en staging significa "conservar el embedding guardado"
+        row["embedding"] = []
+
+    resumen = {
+        "nuevos": len(cambios["nuevos"]),
+        "modificados": len(cambios["modificados"]),
+        "movidos": len(cambios["movidos"]),
+        "eliminados": len(cambios["eliminados"]),
+        "sin_cambios": cambios["sin_cambios"],
+    }
+    logger.info(f"Re-ingesta incremental en {table_ref} {filtros}: {resumen}")
+
+    por_escribir = [{**row, COLUMNA_OPERACION: OPERACION_INSERTAR} for row in cambios["nuevos"]] + [
+        {**row, COLUMNA_OPERACION: OPERACION_ACTUALIZAR} for row in cambios["modificados"] + cambios["movidos"]
+    ]
+    if por_escribir or cambios["eliminados"]:
+        aplicar_cambios(table_ref, por_escribir, cambios["eliminados"])
+
+    return {"total_insertados": len(por_embeber), "embedding_cache": estadisticas_cache, "cambios": resumen}
+
+
+def aplicar_cambios(table_ref, por_escribir, ids_eliminados):
+    """
+    Aplica en una transacción los cambios calculados por sincronizar_incremental.
+    Cada fila de `por_escribir` trae COLUMNA_OPERACION: las de OPERACION_ACTUALIZAR reescriben la
+    fila guardada con su id y las de OPERACION_INSERTAR se agregan (su id es nuevo, no de una guardada).
+    """
+    parametros = [bigquery.ArrayQueryParameter("eliminados", "STRING", ids_eliminados)]
+    sentencias = []
+    if ids_eliminados:
+        sentencias.append(f"DELETE FROM `{table_ref}` WHERE id IN UNNEST(@eliminados);")
+
+    staging_ref = None
+    try:
+        if por_escribir:
+            staging_ref = f"{table_ref}_staging_{uuid.uuid4().hex[:12]}"
+            schema = obtener_bq_client().get_table(table_ref).schema
+            cargar_filas_con_load_job(
+                staging_ref,
+                por_escribir,
+                bigquery.WriteDisposition.WRITE_TRUNCATE,
+                schema=list(schema) + [bigquery.SchemaField(COLUMNA_OPERACION, "STRING")],
+            )
+            columnas = [campo.name for campo in schema]
+            asignaciones = ", ".join(
+                f"`{c}` = s.`{c}`" for c in columnas if c not in ("id", "embedding")
+            )
+            sentencias.append(f"""
+            UPDATE `{table_ref}` t
+            SET {asignaciones},
+                embedding = IF(ARRAY_LENGTH(s.embedding) = 0, t.embedding, s.embedding)
+            FROM `{staging_ref}` s
+            WHERE t.id = s.id AND s.{COLUMNA_OPERACION} = '{OPERACION_ACTUALIZAR}';""")
+            lista = ", ".join(f"`{c}`" for c in columnas)
+            sentencias.append(f"""
+            INSERT INTO `{table_ref}` ({lista})
+            SELECT {lista} FROM `{staging_ref}` WHERE {COLUMNA_OPERACION} = '{OPERACION_INSERTAR}';""")
+
+        script = "BEGIN TRANSACTION;\n" + "\n".join(sentencias) + "\nCOMMIT TRANSACTION;"
+        with span(ETAPA_BIGQUERY_INSERCION):
+            obtener_bq_client().query(script, job_config=bigquery.QueryJobConfig(query_parameters=parametros)).result()
+    finally:
+        if staging_ref is not None:
+            obtener_bq_client().delete_table(staging_ref, not_found_ok=True)
+
 # =========================================================
 # Inserción normal
 # =========================================================
-def insertar_chunks_en_bigquery(parrafos_con_intenciones, documento, topic, channel):
-    """Inserta los chunks extraídos en BigQuery, generando el embedding para cada uno."""
+def insertar_chunks_en_bigquery(parrafos_con_intenciones, documento, topic, channel, embeddings_precalculados=None, modo_escritura=None):
+    """
+    Inserta los chunks extraídos en BigQuery, generando el embedding para cada uno.
+    Si se pasa `embeddings_precalculados` (la salida de generar_embeddings_parrafos) no se vuelve a llamar a Vertex.
+    modo_escritura: "streaming" (insert_rows_json en batches de 50), "load" (un solo load job)
+    o "incremental" (compara contra lo guardado del mismo documento; ver sincronizar_incremental); default BQ_MODO_ESCRITURA.
+    Regresa {"total_insertados", "embedding_cache": {"hits", "misses"}} y, en modo incremental, "cambios".
+    """
     table_ref = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
+    modo_escritura = modo_escritura or BQ_MODO_ESCRITURA
+    modelo = modelo_activo()
+    verificar_columnas_modelo(table_ref)
     
     # Generar un identificador único para esta ejecución
     execution_id = datetime.now().strftime("%Y%m%d%H%M%S") + "_" + str(uuid.uuid4())[:8]
@@ -54,25 +390,7 @@ def insertar_chunks_en_bigquery(parrafos_con_intenciones, documento, topic, chan
     logger.info(f"Topic: {topic}, Channel: {channel}, Documento: {documento}")
 
     rows = []
-    intents_repeated = {
-        "aportacionesobreropatronales",
-        "aportacionespatronales",
-        "aportacionesentucuentaindividual",
-        "continuacionmodalidadcuarenta",
-        "requisitosmodalidadcuarenta",
-        "beneficiosdelamodalidadcuarenta",
-        "pagomodalidadcuarenta",
-        "inscripcionmodalidadcuarenta",
-        "consideracionesdelamodalidadcuarenta",
-    }
-
     for i, parrafo in enumerate(parrafos_con_intenciones):
-        try:
-            embedding = embedding_model.get_embeddings([parrafo["texto"]])[0].values
-        except Exception as e:
-            logger.error(f"Error generando embedding para párrafo {i}: {e}")
-            raise Exception(f"Error generando embedding para párrafo {i}: {e}")
-
         # ID único usando execution_id para evitar colisiones
         unique_id = f"{topic}_{parrafo['intent']}_chunk_{i}_{execution_id}"
         
@@ -85,19 +403,38 @@ def insertar_chunks_en_bigquery(parrafos_con_intenciones, documento, topic, chan
             "topic": topic.lower().strip(),
             "intent": parrafo["intent"].lower().strip(),
             "is_transactional": "N",
-            "embedding": embedding,
-            "is_repeat": "S" if parrafo["intent"].lower() in intents_repeated else "N",
+            "embedding": None,
+            "embedding_model": modelo.nombre,
+            "embedding_dimension": modelo.dimension,
+            "is_repeat": "S" if parrafo["intent"].lower() in INTENTS_REPETIDOS else "N",
         })
 
     logger.info(f"Total de filas preparadas: {len(rows)}")
 
+    if modo_escritura == "incremental":
+        # Un re-upload del mismo documento reemplaza su versión anterior en vez de duplicarla
+        filtros = {"topic": topic.lower().strip(), "channel": channel.lower().strip(), "name_document": documento.strip()}
+        return sincronizar_incremental(table_ref, rows, filtros, embeddings_precalculados)
+
+    embeddings, estadisticas_cache = embeddings_precalculados or generar_embeddings_parrafos(parrafos_con_intenciones)
+    for row, embedding in zip(rows, embeddings):
+        row["embedding"] = embedding
+
+    if modo_escritura == "load":
+        # Un solo load job con todas las filas del documento
+        total_insertados = cargar_filas_con_load_job(table_ref, rows)
+        logger.info(f"=== FIN INSERCIÓN ===")
+        logger.info(f"Total registros insertados: {total_insertados}")
+        return {"total_insertados": total_insertados, "embedding_cache": estadisticas_cache}
+
     # Insertar en BigQuery en batches de 50
     total_insertados = 0
     total_batches = (len(rows) + 49) // 50  # Calcular número total de batches
     
     for idx, rows_batch in enumerate(batch_rows(rows, 50), start=1):
-        logger.info(f"Insertando batch {idx}/{total_batches} con {len(rows_batch)} registros...")
-        errors = bq_client.insert_rows_json(table_ref, rows_batch)
+        logger.debug(f"Insertando batch {idx}/{total_batches} con {len(rows_batch)} registros...")
+        with span(ETAPA_BIGQUERY_INSERCION):
+            errors = obtener_bq_client().insert_rows_json(table_ref, rows_batch)
         
         if errors:
             logger.error(f"Error en batch {idx}: {errors}")
@@ -107,78 +444,55 @@ def insertar_chunks_en_bigquery(parrafos_con_intenciones, documento, topic, chan
             raise Exception(f"Error insertando en BigQuery (batch {idx}): {errors}")
         else:
             total_insertados += len(rows_batch)
-            logger.info(f"Batch {idx} insertado exitosamente. Total acumulado: {total_insertados}/{len(rows)}")
+            logger.debug(f"Batch {idx} insertado exitosamente. Total acumulado: {total_insertados}/{len(rows)}")
     
     logger.info(f"=== FIN INSERCIÓN ===")
     logger.info(f"Total registros insertados: {total_insertados}")
     
-    return total_insertados
+    return {"total_insertados": total_insertados, "embedding_cache": estadisticas_cache}
 
 # =========================================================
 # Inserción BETA (con borrado previo) - Usando LOAD en lugar de streaming
 # =========================================================
-def insertar_chunks_en_bigquery_beta(parrafos_con_intenciones, documento, topic, channel):
-    """Inserta los chunks extraídos en BigQuery beta usando load job (más confiable que streaming)."""
-    table_ref = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID_BETA}"
-    
-    logger.info(f"=== INICIO INSERCIÓN BETA ===")
-    logger.info(f"Total de párrafos a insertar: {len(parrafos_con_intenciones)}")
-    logger.info(f"Topic: {topic}, Channel: {channel}, Documento: {documento}")
-
-    # -----------------------------
-    # 1️⃣ Eliminar registros existentes
-    # -----------------------------
-    delete_query = f"""
-    DELETE FROM `{table_ref}`
-    WHERE LOWER(knowledge_domain) = @topic
-      AND LOWER(channel) = @channel
+def insertar_chunks_en_bigquery_beta(parrafos_con_intenciones, documento, topic, channel, embeddings_precalculados=None, modo_escritura=None):
     """
+    Inserta los chunks extraídos en BigQuery beta usando load job (más confiable que streaming).
+    Si se pasa `embeddings_precalculados` (la salida de generar_embeddings_parrafos) no se vuelve a llamar a Vertex.
+    Con modo_escritura="load" las filas se cargan a una tabla staging y el reemplazo
+    del topic/channel se hace en una sola transacción (DELETE + INSERT).
+    Con modo_escritura="incremental" solo se tocan los chunks del topic/channel que cambiaron.
+    Regresa {"total_insertados", "embedding_cache": {"hits", "misses"}} y, en modo incremental, "cambios".
+    """
+    table_ref = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID_BETA}"
+    modo_escritura = modo_escritura or BQ_MODO_ESCRITURA
+    modelo = modelo_activo()
+    verificar_columnas_modelo(table_ref)
 
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("topic", "STRING", topic.lower().strip()),
-            bigquery.ScalarQueryParameter("channel", "STRING", channel.lower().strip()),
-        ]
-    )
+    # Igual que en la inserción normal: con la re-ingesta incremental conviven filas de varias
+    # ejecuciones, y un id armado solo con la posición chocaría con el de una fila guardada
+    execution_id = datetime.now().strftime("%Y%m%d%H%M%S") + "_" + str(uuid.uuid4())[:8]
 
-    logger.info(f"Ejecutando DELETE para topic={topic.lower().strip()}, channel={channel.lower().strip()}")
-    delete_job = bq_client.query(delete_query, job_config=job_config)
-    delete_job.result()  # Esperar a que termine
-    logger.info(f"DELETE completado. Registros eliminados: {delete_job.num_dml_affected_rows}")
+    logger.info(f"=== INICIO INSERCIÓN BETA ===")
+    logger.info(f"Execution ID: {execution_id}")
+    logger.info(f"Total de párrafos a insertar: {len(parrafos_con_intenciones)}")
+    logger.info(f"Topic: {topic}, Channel: {channel}, Documento: {documento}, Modo: {modo_escritura}")
 
     # -----------------------------
-    # 2️⃣ Construir filas
+    # 1️⃣ Construir filas
     # -----------------------------
     rows = []
-    intents_repeated = {
-        "aportacionesobreropatronales",
-        "aportacionespatronales",
-        "aportacionesentucuentaindividual",
-        "continuacionmodalidadcuarenta",
-        "requisitosmodalidadcuarenta",
-        "beneficiosdelamodalidadcuarenta",
-        "pagomodalidadcuarenta",
-        "inscripcionmodalidadcuarenta",
-        "consideracionesdelamodalidadcuarenta",
-    }
 
     logger.info(">>> VERSIÓN CÓDIGO: 2025-01-29-v2 con chunk_id STRING <<<")
     
     for i, parrafo in enumerate(parrafos_con_intenciones):
-        try:
-            embedding = embedding_model.get_embeddings([parrafo["texto"]])[0].values
-        except Exception as e:
-            logger.error(f"Error generando embedding para párrafo {i}: {e}")
-            raise Exception(f"Error generando embedding para párrafo {i}: {e}")
-
         chunk_id_value = str(i)
         
         # Log para verificar tipos de datos
         if i == 0:
-            logger.info(f">>> DEBUG: chunk_id_value = '{chunk_id_value}', type = {type(chunk_id_value)}")
+            logger.debug(f">>> DEBUG: chunk_id_value = '{chunk_id_value}', type = {type(chunk_id_value)}")
         
         rows.append({
-            "id": f"{topic}_{parrafo['intent']}_chunk_{i}",
+            "id": f"{topic}_{parrafo['intent']}_chunk_{i}_{execution_id}",
             "channel": channel.lower().strip(),
             "name_document": documento.strip(),
             "chunk_id": chunk_id_value,
@@ -187,12 +501,54 @@ def insertar_chunks_en_bigquery_beta(parrafos_con_intenciones, documento, topic,
             "intent": parrafo["intent"].lower().strip(),
             "intent_document": parrafo["intent"].strip(),
             "is_transactional": "N",
-            "embedding": embedding,
-            "is_repeat": "S" if parrafo["intent"].lower() in intents_repeated else "N",
+            "embedding": None,
+            "embedding_model": modelo.nombre,
+            "embedding_dimension": modelo.dimension,
+            "is_repeat": "S" if parrafo["intent"].lower() in INTENTS_REPETIDOS else "N",
         })
 
     logger.info(f"Total de filas preparadas: {len(rows)}")
 
+    if modo_escritura == "incremental":
+        filtros = {"knowledge_domain": topic.lower().strip(), "channel": channel.lower().strip()}
+        return sincronizar_incremental(table_ref, rows, filtros, embeddings_precalculados)
+
+    # Los embeddings se generan antes del DELETE para no dejar vacío el topic si Vertex falla
+    embeddings, estadisticas_cache = embeddings_precalculados or generar_embeddings_parrafos(parrafos_con_intenciones)
+    for row, embedding in zip(rows, embeddings):
+        row["embedding"] = embedding
+
+    if modo_escritura == "load":
+        # -----------------------------
+        # 2️⃣ Load job a staging + reemplazo atómico
+        # -----------------------------
+        total_insertados = reemplazar_con_staging(table_ref, rows, topic, channel)
+        logger.info(f"=== FIN INSERCIÓN BETA ===")
+        logger.info(f"Total registros insertados: {total_insertados}")
+        return {"total_insertados": total_insertados, "embedding_cache": estadisticas_cache}
+
+    # -----------------------------
+    # 2️⃣ Eliminar registros existentes
+    # -----------------------------
+    delete_query = f"""
+    DELETE FROM `{table_ref}`
+    WHERE LOWER(knowledge_domain) = @topic
+      AND LOWER(channel) = @channel
+    """
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("topic", "STRING", topic.lower().strip()),
+            bigquery.ScalarQueryParameter("channel", "STRING", channel.lower().strip()),
+        ]
+    )
+
+    logger.info(f"Ejecutando DELETE para topic={topic.lower().strip()}, channel={channel.lower().strip()}")
+    with span(ETAPA_BIGQUERY_INSERCION):
+        delete_job = obtener_bq_client().query(delete_query, job_config=job_config)
+        delete_job.result()  # Esperar a que termine
+    logger.info(f"DELETE completado. Registros eliminados: {delete_job.num_dml_affected_rows}")
+
     # -----------------------------
     # 3️⃣ Insertar en batches usando insert_rows_json
     # -----------------------------
@@ -200,9 +556,10 @@ def insertar_chunks_en_bigquery_beta(parrafos_con_intenciones, documento, topic,
     total_batches = (len(rows) + 49) // 50
     
     for idx, rows_batch in enumerate(batch_rows(rows, 50), start=1):
-        logger.info(f"Insertando batch {idx}/{total_batches} con {len(rows_batch)} registros...")
+        logger.debug(f"Insertando batch {idx}/{total_batches} con {len(rows_batch)} registros...")
         
-        errors = bq_client.insert_rows_json(table_ref, rows_batch)
+        with span(ETAPA_BIGQUERY_INSERCION):
+            errors = obtener_bq_client().insert_rows_json(table_ref, rows_batch)
         
         if errors:
             logger.error(f"Error en batch {idx}:")
@@ -211,9 +568,9 @@ def insertar_chunks_en_bigquery_beta(parrafos_con_intenciones, documento, topic,
             raise Exception(f"Error insertando en BigQuery BETA (batch {idx}): {errors}")
         
         total_insertados += len(rows_batch)
-        logger.info(f"Batch {idx} completado. Acumulado: {total_insertados}/{len(rows)}")
+        logger.debug(f"Batch {idx} completado. Acumulado: {total_insertados}/{len(rows)}")
     
     logger.info(f"=== FIN INSERCIÓN BETA ===")
     logger.info(f"Total registros insertados: {total_insertados}")
     
-    return total_insertados
+    return {"total_insertados": total_insertados, "embedding_cache": estadisticas_cache}
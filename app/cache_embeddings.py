@@ -0,0 +1,132 @@
+import os
+import re
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración
+# ==============================
+# EMBEDDING_CACHE_BACKEND: "sqlite" (default), "redis" o "none"
+EMBEDDING_CACHE_BACKEND = os.getenv("EMBEDDING_CACHE_BACKEND", "sqlite").lower()
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite")
+# Solo si la caché de embeddings debe vivir en otro Redis; si no, usa el cliente compartido (REDIS_HOST)
+EMBEDDING_CACHE_REDIS_URL = os.getenv("EMBEDDING_CACHE_REDIS_URL")
+EMBEDDING_CACHE_PREFIJO = "emb:"
+
+
+def normalizar_texto(texto: str) -> str:
+    """Normalización para la llave: Unicode NFC y espacios colapsados (no cambia mayúsculas)."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", texto)).strip()
+
+
+def llave_cache(nombre_modelo: str, dimension, texto: str) -> str:
+    """Llave por contenido: (modelo, dimensión de salida, hash del texto normalizado)."""
+    contenido = f"{nombre_modelo}\x1f{dimension or 'full'}\x1f{normalizar_texto(texto)}"
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+def _a_bytes(vector) -> bytes:
+    return np.asarray(vector, dtype=np.float64).tobytes()
+
+
+def _de_bytes(datos: bytes) -> list:
+    return np.frombuffer(datos, dtype=np.float64).tolist()
+
+
+# =========================================================
+# Backends
+# =========================================================
+class CacheEmbeddingsSQLite:
+    """Caché en disco local con SQLite; una sola tabla llave -> vector float64."""
+
+    def __init__(self, ruta: str):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (llave TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._conexion.commit()
+
+    def obtener_varios(self, llaves):
+        encontrados = {}
+        unicas = list(dict.fromkeys(llaves))
+        with self._lock:
+            # SQLite limita el número de parámetros por sentencia
+            for i in range(0, len(unicas), 500):
+                bloque = unicas[i:i + 500]
+                marcas = ",".join("?" * len(bloque))
+                for llave, vector in self._conexion.execute(
+                    f"SELECT llave, vector FROM embeddings WHERE llave IN ({marcas})", bloque
+                ):
+                    encontrados[llave] = _de_bytes(vector)
+        return encontrados
+
+    def guardar_varios(self, vectores: dict):
+        if not vectores:
+            return
+        with self._lock:
+            self._conexion.executemany(
+                "INSERT OR REPLACE INTO embeddings (llave, vector) VALUES (?, ?)",
+                [(llave, _a_bytes(vector)) for llave, vector in vectores.items()],
+            )
+            self._conexion.commit()
+
+
+class CacheEmbeddingsRedis:
+    """Caché compartida entre instancias en Redis."""
+
+    def __init__(self, cliente):
+        self._cliente = cliente
+
+    def obtener_varios(self, llaves):
+        unicas = list(dict.fromkeys(llaves))
+        if not unicas:
+            return {}
+        valores = self._cliente.mget([EMBEDDING_CACHE_PREFIJO + llave for llave in unicas])
+        return {llave: _de_bytes(valor) for llave, valor in zip(unicas, valores) if valor is not None}
+
+    def guardar_varios(self, vectores: dict):
+        if not vectores:
+            return
+        pipe = self._cliente.pipeline(transaction=False)
+        for llave, vector in vectores.items():
+            pipe.set(EMBEDDING_CACHE_PREFIJO + llave, _a_bytes(vector))
+        pipe.execute()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache_embeddings():
+    """Regresa el backend configurado (una sola instancia por proceso) o None si está deshabilitado."""
+    global _cache
+    if EMBEDDING_CACHE_BACKEND == "none":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            if EMBEDDING_CACHE_BACKEND == "redis" and EMBEDDING_CACHE_REDIS_URL:
+                import redis
+
+                _cache = CacheEmbeddingsRedis(redis.Redis.from_url(EMBEDDING_CACHE_REDIS_URL))
+            elif EMBEDDING_CACHE_BACKEND == "redis":
+                from app.clientes import obtener_redis
+
+                # El mismo pool que las demás cachés (o RedisEnMemoria sin REDIS_HOST)
+                _cache = CacheEmbeddingsRedis(obtener_redis())
+            else:
+                _cache = CacheEmbeddingsSQLite(EMBEDDING_CACHE_PATH)
+            logger.info(f"Caché de embeddings: {type(_cache).__name__}")
+    return _cache
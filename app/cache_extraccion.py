@@ -0,0 +1,75 @@
+import os
+import json
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración
+# ==============================
+# EXTRACCION_CACHE_BACKEND: "sqlite" (default) o "none"
+EXTRACCION_CACHE_BACKEND = os.getenv("EXTRACCION_CACHE_BACKEND", "sqlite").lower()
+EXTRACCION_CACHE_PATH = os.getenv("EXTRACCION_CACHE_PATH", ".cache/extracciones.sqlite")
+
+
+def llave_extraccion(bucket, nombre, generacion, md5, version, detector):
+    """
+    Llave por versión exacta del objeto: (bucket, nombre, generation, md5, versión del extractor, detector).
+    Regresa None si GCS no dio ni generation ni md5, porque entonces no hay forma de saber si cambió.
+    """
+    if not generacion and not md5:
+        return None
+    contenido = "\x1f".join(str(parte or "") for parte in (bucket, nombre, generacion, md5, version, detector))
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+class CacheExtraccionSQLite:
+    """Secciones ya extraídas por llave, como JSON comprimido en una tabla SQLite."""
+
+    def __init__(self, ruta: str):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS extracciones (llave TEXT PRIMARY KEY, secciones BLOB NOT NULL)"
+            )
+            self._conexion.commit()
+
+    def obtener(self, llave):
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT secciones FROM extracciones WHERE llave = ?", (llave,)
+            ).fetchone()
+        return None if fila is None else json.loads(zlib.decompress(fila[0]))
+
+    def guardar(self, llave, secciones):
+        datos = zlib.compress(json.dumps(secciones, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO extracciones (llave, secciones) VALUES (?, ?)", (llave, datos)
+            )
+            self._conexion.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache_extraccion():
+    """Regresa la caché de extracciones (una sola instancia por proceso) o None si está deshabilitada."""
+    global _cache
+    if EXTRACCION_CACHE_BACKEND == "none":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = CacheExtraccionSQLite(EXTRACCION_CACHE_PATH)
+            logger.info(f"Caché de extracciones: {EXTRACCION_CACHE_PATH}")
+    return _cache
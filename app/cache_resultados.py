@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import threading
+
+from app.cache_embeddings import normalizar_texto
+from app.concurrencia import ejecutar
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración
+# ==============================
+RESULTADOS_CACHE_HABILITADA = os.getenv("RESULTADOS_CACHE_HABILITADA", "true").lower() == "true"
+# Segundos que vive una respuesta de /buscar/ en la caché
+RESULTADOS_CACHE_TTL = int(os.getenv("RESULTADOS_CACHE_TTL", 300))
+# Vida máxima del candado de una consulta en vuelo (por si la instancia que la calcula muere)
+RESULTADOS_LOCK_TTL_MS = int(os.getenv("RESULTADOS_LOCK_TTL_MS", 30000))
+# Cuánto espera una instancia el resultado que está calculando otra antes de calcularlo ella misma
+RESULTADOS_ESPERA_SEGUNDOS = float(os.getenv("RESULTADOS_ESPERA_SEGUNDOS", 10))
+RESULTADOS_SONDEO_SEGUNDOS = 0.05
+
+PREFIJO = "buscar:"
+
+
+class RedisEnMemoria:
+    """
+    Sustituto en proceso del subconjunto de Redis que usan las cachés (get/set con ex, px y nx,
+    incr, delete, expire, ping, mget y pipeline para la caché de embeddings, y zincrby/zrevrange,
+    hsetnx/hmget para las respuestas precalculadas).
+    Se usa cuando no hay REDIS_HOST y en pruebas; no se comparte entre instancias.
+    """
+
+    def __init__(self):
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def _vigente(self, nombre):
+        valor, expira = self._datos.get(nombre, (None, None))
+        if expira is not None and expira <= time.monotonic():
+            del self._datos[nombre]
+            return None
+        return valor
+
+    def ping(self):
+        return True
+
+    def get(self, nombre):
+        with self._lock:
+            return self._vigente(nombre)
+
+    def set(self, nombre, valor, ex=None, px=None, nx=False):
+        with self._lock:
+            if nx and self._vigente(nombre) is not None:
+                return None
+            expira = None
+            if ex is not None:
+                expira = time.monotonic() + ex
+            elif px is not None:
+                expira = time.monotonic() + px / 1000
+            if isinstance(valor, str):
+                valor = valor.encode("utf-8")
+            self._datos[nombre] = (valor, expira)
+            return True
+
+    def mget(self, nombres):
+        with self._lock:
+            return [self._vigente(nombre) for nombre in nombres]
+
+    def pipeline(self, transaction=True):
+        return _PipelineEnMemoria(self)
+
+    def incr(self, nombre):
+        with self._lock:
+            valor = int(self._vigente(nombre) or 0) + 1
+            self._datos[nombre] = (str(valor).encode("utf-8"), None)
+            return valor
+
+    def delete(self, *nombres):
+        with self._lock:
+            return sum(self._datos.pop(nombre, None) is not None for nombre in nombres)
+
+    def expire(self, nombre, segundos):
+        with self._lock:
+            valor = self._vigente(nombre)
+            if valor is None:
+                return False
+            self._datos[nombre] = (valor, time.monotonic() + segundos)
+            return True
+
+    def _coleccion(self, nombre):
+        """Diccionario de un sorted set o hash; se crea vacío si no existe."""
+        valor = self._vigente(nombre)
+        if valor is None:
+            valor = {}
+            self._datos[nombre] = (valor, None)
+        return valor
+
+    def zincrby(self, nombre, cantidad, miembro):
+        with self._lock:
+            miembros = self._coleccion(nombre)
+            miembro = _bytes(miembro)
+            miembros[miembro] = miembros.get(miembro, 0.0) + float(cantidad)
+            return miembros[miembro]
+
+    def zrevrange(self, nombre, inicio, fin, withscores=False):
+        with self._lock:
+            miembros = sorted((self._vigente(nombre) or {}).items(), key=lambda par: (-par[1], par[0]))
+        seleccion = miembros[inicio:None if fin == -1 else fin + 1]
+        return seleccion if withscores else [miembro for miembro, _ in seleccion]
+
+    def hsetnx(self, nombre, campo, valor):
+        with self._lock:
+            campos = self._coleccion(nombre)
+            if _bytes(campo) in campos:
+                return False
+            campos[_bytes(campo)] = _bytes(valor)
+            return True
+
+    def hmget(self, nombre, campos):
+        with self._lock:
+            valores = self._vigente(nombre) or {}
+            return [valores.get(_bytes(campo)) for campo in campos]
+
+
+class _PipelineEnMemoria:
+    """Acumula comandos y los ejecuta en orden con execute(), como un pipeline de redis-py."""
+
+    def __init__(self, cliente):
+        self._cliente = cliente
+        self._comandos = []
+
+    def __getattr__(self, nombre):
+        def encolar(*args, **kwargs):
+            self._comandos.append((getattr(self._cliente, nombre), args, kwargs))
+            return self
+
+        return encolar
+
+    def execute(self):
+        comandos, self._comandos = self._comandos, []
+        return [comando(*args, **kwargs) for comando, args, kwargs in comandos]
+
+
+def _bytes(valor):
+    return valor.encode("utf-8") if isinstance(valor, str) else valor
+
+
+def normalizar_consulta(texto) -> str:
+    """Igual que la llave de embeddings pero sin distinguir mayúsculas."""
+    return normalizar_texto(texto or "").lower()
+
+
+class CacheResultados:
+    """
+    Caché compartida de respuestas completas de /buscar/.
+    - Llave: hash de la consulta normalizada + versión del (topic, channel).
+    - Invalidación: cada ingesta incrementa la versión de su (topic, channel);
+      las entradas viejas ya no se leen y expiran solas por TTL.
+    - Coalescencia: las consultas idénticas en vuelo en este proceso esperan la misma tarea,
+      y entre instancias solo la que obtiene el candado (SET NX) llama a Vertex/BigQuery.
+    Si Redis falla, la consulta se calcula sin caché.
+    """
+
+    def __init__(self, cliente, ttl=None):
+        self._cliente = cliente
+        self._ttl = ttl or RESULTADOS_CACHE_TTL
+        self._en_vuelo = {}
+
+    @staticmethod
+    def _llave_version(topic, channel):
+        return f"{PREFIJO}version:{normalizar_consulta(topic)}:{normalizar_consulta(channel)}"
+
+    def version(self, topic, channel) -> int:
+        return int(self._cliente.get(self._llave_version(topic, channel)) or 0)
+
+    def invalidar(self, topic, channel) -> int:
+        """Incrementa la versión del (topic, channel); se llama después de cada ingesta."""
+        version = self._cliente.incr(self._llave_version(topic, channel))
+        logger.info(f"Caché de resultados invalidada para ({topic}, {channel}): versión {version}")
+        return version
+
+    def llave(self, version, topic, channel, partes) -> str:
+        """
+        topic y channel sin distinguir mayúsculas (igual que las cachés residentes); las `partes` se
+        respetan tal cual, porque p. ej. el intent se busca distinguiendo mayúsculas. Quien quiera
+        que una parte no las distinga debe pasarla ya normalizada con normalizar_consulta.
+        """
+        contenido = "\x1f".join(
+            [normalizar_consulta(topic), normalizar_consulta(channel)]
+            + [normalizar_texto(str(p)) if p is not None else "" for p in partes]
+        )
+        return f"{PREFIJO}{version}:{hashlib.sha256(contenido.encode('utf-8')).hexdigest()}"
+
+    def _leer(self, llave):
+        valor = self._cliente.get(llave)
+        return None if valor is None else json.loads(valor)
+
+    def _guardar(self, llave, respuesta):
+        self._cliente.set(llave, json.dumps(respuesta, ensure_ascii=False, default=float), ex=self._ttl)
+
+    def _soltar_candado(self, candado, token):
+        # Solo se borra si sigue siendo nuestro (pudo expirar y tomarlo otra instancia)
+        actual = self._cliente.get(candado)
+        if actual is not None and actual.decode("utf-8") == token:
+            self._cliente.delete(candado)
+
+    async def obtener_o_calcular(self, topic, channel, partes, calcular, cacheable=lambda r: True):
+        """
+        Regresa (respuesta, origen) con origen "hit", "coalesced" o "miss".
+        `calcular(version)` es una corrutina que recibe la versión del (topic, channel) con la que se
+        guardará la respuesta (None si Redis no está disponible), para no calcularla con datos
+        más viejos; solo se guardan respuestas que cumplan `cacheable`.
+        """
+        try:
+            version = await ejecutar("redis", self.version, topic, channel)
+            llave = self.llave(version, topic, channel, partes)
+            respuesta = await ejecutar("redis", self._leer, llave)
+        except Exception as e:
+            logger.warning(f"Caché de resultados no disponible: {e}")
+            return await calcular(None), "miss"
+        if respuesta is not None:
+            return respuesta, "hit"
+
+        tarea = self._en_vuelo.get(llave)
+        if tarea is not None:
+            respuesta, _ = await asyncio.shield(tarea)
+            return respuesta, "coalesced"
+
+        tarea = asyncio.ensure_future(self._calcular_con_candado(llave, version, calcular, cacheable))
+        self._en_vuelo[llave] = tarea
+        tarea.add_done_callback(lambda _: self._en_vuelo.pop(llave, None))
+        return await asyncio.shield(tarea)
+
+    async def _calcular_con_candado(self, llave, version, calcular, cacheable):
+        candado = f"{llave}:lock"
+        token = uuid.uuid4().hex
+        try:
+            propio = await ejecutar("redis", self._cliente.set, candado, token, px=RESULTADOS_LOCK_TTL_MS, nx=True)
+        except Exception as e:
+            logger.warning(f"Caché de resultados no disponible: {e}")
+            return await calcular(version), "miss"
+
+        if not propio:
+            # Otra instancia ya la está calculando: se espera su resultado
+            limite = time.monotonic() + RESULTADOS_ESPERA_SEGUNDOS
+            while time.monotonic() < limite:
+                await asyncio.sleep(RESULTADOS_SONDEO_SEGUNDOS)
+                respuesta = await ejecutar("redis", self._leer, llave)
+                if respuesta is not None:
+                    return respuesta, "coalesced"
+                if await ejecutar("redis", self._cliente.get, candado) is None:
+                    break
+            return await calcular(version), "miss"
+
+        try:
+            respuesta = await calcular(version)
+            if cacheable(respuesta):
+                try:
+                    await ejecutar("redis", self._guardar, llave, respuesta)
+                except Exception as e:
+                    logger.warning(f"No se pudo guardar el resultado en caché: {e}")
+            return respuesta, "miss"
+        finally:
+            try:
+                await ejecutar("redis", self._soltar_candado, candado, token)
+            except Exception as e:
+                logger.warning(f"No se pudo soltar el candado {candado}: {e}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache_resultados():
+    """Instancia única por proceso sobre el cliente Redis compartido."""
+    global _cache
+    from app.clientes import obtener_redis
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = CacheResultados(obtener_redis())
+    return _cache
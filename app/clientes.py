@@ -0,0 +1,122 @@
+import os
+import time
+import logging
+import threading
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+PROJECT_ID = os.getenv("PROJECT_ID")
+VERTEX_LOCATION = os.getenv("VERTEX_LOCATION", "us-central1")
+# Sin REDIS_HOST se usa un sustituto en memoria (solo para desarrollo y pruebas)
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_MAX_CONEXIONES = int(os.getenv("REDIS_MAX_CONEXIONES", 32))
+REDIS_TIMEOUT_SEGUNDOS = float(os.getenv("REDIS_TIMEOUT_SEGUNDOS", 2))
+
+# ==============================
+# Clientes compartidos, creados la primera vez que se usan
+# ==============================
+# nombre -> segundos que tardó en crearse (imports incluidos)
+TIEMPOS_ARRANQUE = {}
+
+_instancias = {}
+# Un candado por nombre: una fábrica puede pedir otro singleton (el modelo inicializa vertexai)
+# y crear un cliente lento no detiene la creación de los demás
+_locks = {}
+_lock = threading.Lock()
+
+
+def registrar_tiempo(nombre, segundos):
+    TIEMPOS_ARRANQUE[nombre] = round(segundos, 4)
+
+
+def _singleton(nombre, fabrica):
+    instancia = _instancias.get(nombre)
+    if instancia is not None:
+        return instancia
+    with _lock:
+        lock = _locks.setdefault(nombre, threading.Lock())
+    with lock:
+        instancia = _instancias.get(nombre)
+        if instancia is None:
+            inicio = time.perf_counter()
+            instancia = fabrica()
+            registrar_tiempo(nombre, time.perf_counter() - inicio)
+            logger.info(f"Cliente {nombre} creado en {TIEMPOS_ARRANQUE[nombre]}s")
+            _instancias[nombre] = instancia
+    return instancia
+
+
+def obtener_bq_client():
+    def crear():
+        from google.cloud import bigquery
+
+        return bigquery.Client()
+
+    return _singleton("bigquery", crear)
+
+
+def obtener_storage_client():
+    def crear():
+        from google.cloud import storage
+
+        return storage.Client()
+
+    return _singleton("storage", crear)
+
+
+def _inicializar_vertex():
+    def crear():
+        import vertexai
+
+        vertexai.init(project=PROJECT_ID, location=VERTEX_LOCATION)
+        return True
+
+    return _singleton("vertexai_init", crear)
+
+
+def obtener_modelo_embeddings(nombre):
+    def crear():
+        _inicializar_vertex()
+        from vertexai.language_models import TextEmbeddingModel
+
+        return TextEmbeddingModel.from_pretrained(nombre)
+
+    return _singleton(f"modelo:{nombre}", crear)
+
+
+def obtener_redis():
+    """Un solo cliente Redis por proceso con pool de conexiones acotado."""
+    def crear():
+        if not REDIS_HOST:
+            from app.cache_resultados import RedisEnMemoria
+
+            logger.warning("REDIS_HOST no configurado: se usa Redis en memoria, no compartido entre instancias")
+            return RedisEnMemoria()
+        import redis
+
+        pool = redis.BlockingConnectionPool(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            max_connections=REDIS_MAX_CONEXIONES,
+            # Espera máxima por una conexión libre del pool
+            timeout=REDIS_TIMEOUT_SEGUNDOS,
+            socket_timeout=REDIS_TIMEOUT_SEGUNDOS,
+            socket_connect_timeout=REDIS_TIMEOUT_SEGUNDOS,
+        )
+        return redis.Redis(connection_pool=pool)
+
+    return _singleton("redis", crear)
+
+
+def calentar(modelos=()):
+    """Crea por adelantado los clientes y modelos; regresa los tiempos de arranque acumulados."""
+    obtener_bq_client()
+    obtener_storage_client()
+    for nombre in modelos:
+        obtener_modelo_embeddings(nombre)
+    return dict(TIEMPOS_ARRANQUE)
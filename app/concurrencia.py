@@ -0,0 +1,58 @@
+import os
+import asyncio
+import functools
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ==============================
+# Límites de concurrencia por servicio
+# ==============================
+# Cada servicio externo tiene su propio pool acotado, así una ráfaga contra
+# uno (p. ej. Vertex) no se queda con los hilos que necesita otro (BigQuery).
+LIMITES_CONCURRENCIA = {
+    "vertex": int(os.getenv("LIMITE_CONCURRENCIA_VERTEX", 16)),
+    "bigquery": int(os.getenv("LIMITE_CONCURRENCIA_BIGQUERY", 16)),
+    "gcs": int(os.getenv("LIMITE_CONCURRENCIA_GCS", 8)),
+    # Igual al tamaño del pool de conexiones de Redis
+    "redis": int(os.getenv("LIMITE_CONCURRENCIA_REDIS", os.getenv("REDIS_MAX_CONEXIONES", 32))),
+    "extraccion": int(os.getenv("LIMITE_CONCURRENCIA_EXTRACCION", 2)),
+    # Inserciones completas (embeddings + escritura); largas, por eso aparte de "bigquery"
+    "ingesta": int(os.getenv("LIMITE_CONCURRENCIA_INGESTA", 2)),
+    # Lecturas y escrituras cortas de la cola de trabajos (SQLite); aparte de "ingesta" para que
+    # encolar o consultar un trabajo no espere detrás de ingestas completas
+    "trabajos": int(os.getenv("LIMITE_CONCURRENCIA_TRABAJOS", 4)),
+    # Productos matriz-vector y re-rank del índice residente; numpy suelta el GIL, un hilo por CPU
+    "ranking": int(os.getenv("LIMITE_CONCURRENCIA_RANKING", os.cpu_count() or 4)),
+}
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def executor_de(servicio: str) -> ThreadPoolExecutor:
+    """Pool dedicado de un servicio; se crea la primera vez que se usa."""
+    with _lock:
+        executor = _executors.get(servicio)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=LIMITES_CONCURRENCIA[servicio],
+                thread_name_prefix=f"pool-{servicio}",
+            )
+            _executors[servicio] = executor
+        return executor
+
+
+async def ejecutar(servicio: str, fn, *args, **kwargs):
+    """Corre una llamada bloqueante del SDK en el pool del servicio sin bloquear el event loop."""
+    loop = asyncio.get_running_loop()
+    # Se copia el contexto para que las métricas del hilo se anoten en la solicitud que lo pidió
+    contexto = contextvars.copy_context()
+    return await loop.run_in_executor(executor_de(servicio), functools.partial(contexto.run, fn, *args, **kwargs))
+
+
+def cerrar_executors():
+    with _lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False)
+        _executors.clear()
@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import tempfile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración
+# ==============================
+# "float32" (sin cuantizar), "float16" o "int8" (escala por vector)
+INDICE_PRECISION = os.getenv("INDICE_PRECISION", "float32").lower()
+# Candidatos de la pasada aproximada que se re-rankean con float32 exacto
+INDICE_RERANK_CANDIDATOS = int(os.getenv("INDICE_RERANK_CANDIDATOS", 50))
+# Directorio en disco donde se guarda la copia float32 que solo se usa para el re-rank.
+# Debe ser un disco real: en tmpfs (p. ej. /tmp en Cloud Run) el archivo ocupa la misma RAM
+# que se quería ahorrar, así que ahí no se crea y el índice se sirve sin cuantizar.
+# Con SNAPSHOT_DIR el re-rank lee directo el .npy del snapshot y este directorio no se usa.
+INDICE_DIRECTORIO_TEMPORAL = os.getenv("INDICE_DIRECTORIO_TEMPORAL") or None
+
+PRECISIONES = ("float32", "float16", "int8")
+# Sistemas de archivos que viven en RAM
+_SISTEMAS_EN_MEMORIA = ("tmpfs", "ramfs")
+# Filas por bloque al convertir a float32 para el producto matriz-vector
+_BLOQUE = 16384
+
+
+class MatrizCuantizada:
+    """
+    Versión compacta de una matriz de embeddings normalizados.
+    float16: mitad de memoria. int8: una cuarta parte más una escala float32 por vector.
+    `similitudes` es una pasada aproximada; el orden final lo decide el re-rank exacto.
+    """
+
+    def __init__(self, matriz, precision):
+        if precision not in ("float16", "int8"):
+            raise ValueError(f"Precisión de índice no soportada: '{precision}'")
+        self.precision = precision
+        if precision == "float16":
+            self.datos = matriz.astype(np.float16)
+            self.escalas = None
+        else:
+            maximos = np.abs(matriz).max(axis=1)
+            maximos[maximos == 0] = 1.0
+            self.escalas = (maximos / 127.0).astype(np.float32)
+            self.datos = np.round(matriz / self.escalas[:, None]).astype(np.int8)
+
+    def __len__(self):
+        return len(self.datos)
+
+    @property
+    def nbytes(self):
+        return self.datos.nbytes + (self.escalas.nbytes if self.escalas is not None else 0)
+
+    def similitudes(self, consulta, posiciones=None):
+        """Producto aproximado contra todas las filas (o solo `posiciones`), convirtiendo por bloques."""
+        datos = self.datos if posiciones is None else self.datos[posiciones]
+        salida = np.empty(len(datos), dtype=np.float32)
+        for i in range(0, len(datos), _BLOQUE):
+            salida[i:i + _BLOQUE] = datos[i:i + _BLOQUE].astype(np.float32) @ consulta
+        if self.escalas is not None:
+            salida *= self.escalas if posiciones is None else self.escalas[posiciones]
+        return salida
+
+
+def sistema_de_archivos(ruta):
+    """Tipo de sistema de archivos (según /proc/mounts) donde vive `ruta`, o None si no se puede saber."""
+    ruta = os.path.realpath(ruta)
+    tipo, montaje = None, ""
+    try:
+        with open("/proc/mounts") as archivo:
+            for linea in archivo:
+                campos = linea.split()
+                if len(campos) < 3:
+                    continue
+                punto = campos[1].replace("\\040", " ")
+                contenido = ruta == punto or ruta.startswith(punto.rstrip("/") + "/")
+                if contenido and len(punto) >= len(montaje):
+                    tipo, montaje = campos[2], punto
+    except OSError:
+        return None
+    return tipo
+
+
+def a_memmap(matriz):
+    """
+    Copia la matriz a un archivo temporal en INDICE_DIRECTORIO_TEMPORAL y la regresa mapeada
+    en memoria (solo lectura). El archivo se borra de inmediato; el mapeo sigue válido y el kernel
+    mantiene en page cache solo las filas que se leen para el re-rank.
+    Regresa None si el directorio está en tmpfs: ahí el archivo no liberaría memoria.
+    """
+    directorio = INDICE_DIRECTORIO_TEMPORAL or tempfile.gettempdir()
+    tipo = sistema_de_archivos(directorio)
+    if tipo in _SISTEMAS_EN_MEMORIA:
+        logger.warning(
+            f"{directorio} está en {tipo}: no hay dónde mapear la copia float32 para el re-rank. "
+            "Usa INDICE_DIRECTORIO_TEMPORAL en un disco o SNAPSHOT_DIR para cuantizar el índice"
+        )
+        return None
+    with tempfile.NamedTemporaryFile(dir=directorio, suffix=".f32", delete=False) as archivo:
+        ruta = archivo.name
+    try:
+        mapa = np.memmap(ruta, dtype=np.float32, mode="w+", shape=matriz.shape)
+        mapa[:] = matriz
+        mapa.flush()
+        del mapa
+        return np.memmap(ruta, dtype=np.float32, mode="r", shape=matriz.shape)
+    finally:
+        os.unlink(ruta)
+
+
+def buscar_con_rerank(cuantizada, matriz_exacta, consulta, k, candidatos=None, posiciones=None):
+    """
+    Pasada aproximada con la matriz cuantizada, luego re-rank float32 exacto de los
+    mejores `candidatos`. Si se pasan `posiciones` (p. ej. del IVF) solo se evalúan esas.
+    """
+    from app.indice import top_k
+
+    candidatos = max(k, candidatos or INDICE_RERANK_CANDIDATOS)
+    aproximadas = cuantizada.similitudes(consulta, posiciones)
+    preseleccion = [p for p, _ in top_k(aproximadas, candidatos)]
+    if posiciones is not None:
+        preseleccion = [int(posiciones[p]) for p in preseleccion]
+    preseleccion = np.array(sorted(preseleccion), dtype=np.int64)
+
+    exactas = np.asarray(matriz_exacta[preseleccion], dtype=np.float32) @ consulta
+    return [(int(preseleccion[i]), s) for i, s in top_k(exactas, k)]
+
+
+# =========================================================
+# Reporte de memoria y concordancia del ranking
+# =========================================================
+def reporte_cuantizacion(embeddings, consultas, k=5, candidatos=None):
+    """
+    Para cada precisión reporta memoria residente de la matriz y concordancia del top-k
+    contra el ranking de referencia: similitud coseno en float64 fila por fila,
+    igual que el cálculo original de /buscar/.
+    """
+    from app.ann import normalizar_filas
+    from app.indice import top_k
+
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    normas = np.linalg.norm(embeddings, axis=1)
+    normas[normas == 0] = np.inf
+    referencia = []
+    for consulta in consultas:
+        consulta = np.asarray(consulta, dtype=np.float64)
+        similitudes = (embeddings @ consulta) / (normas * np.linalg.norm(consulta))
+        referencia.append([p for p, _ in top_k(similitudes, k)])
+
+    matriz = normalizar_filas(embeddings)
+    consultas_normalizadas = normalizar_filas(consultas)
+    filas = []
+    for precision in PRECISIONES:
+        if precision == "float32":
+            cuantizada, nbytes = None, matriz.nbytes
+        else:
+            cuantizada = MatrizCuantizada(matriz, precision)
+            nbytes = cuantizada.nbytes
+
+        aciertos = 0
+        mismo_orden = 0
+        for consulta, esperado in zip(consultas_normalizadas, referencia):
+            if cuantizada is None:
+                obtenido = [p for p, _ in top_k(matriz @ consulta, k)]
+            else:
+                obtenido = [p for p, _ in buscar_con_rerank(cuantizada, matriz, consulta, k, candidatos)]
+            aciertos += len(set(esperado) & set(obtenido))
+            mismo_orden += obtenido == esperado
+
+        filas.append({
+            "precision": precision,
+            "bytes": int(nbytes),
+            "megabytes": round(nbytes / 2**20, 2),
+            "reduccion": round(matriz.nbytes / nbytes, 2),
+            "recall_top_k": round(aciertos / (len(consultas) * min(k, len(matriz))), 4),
+            "mismo_orden_top_k": round(mismo_orden / len(consultas), 4),
+        })
+    return filas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memoria y concordancia de ranking de los índices cuantizados")
+    origen = parser.add_mutually_exclusive_group(required=True)
+    origen.add_argument("--npy", help="Matriz de embeddings guardada con np.save")
+    origen.add_argument("--topic", help="Cargar los embeddings del topic desde BigQuery (requiere --channel)")
+    parser.add_argument("--channel")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--candidatos", type=int, default=None)
+    parser.add_argument("--ruido", type=float, default=0.05, help="Ruido gaussiano sobre los chunks usados como consulta")
+    args = parser.parse_args(argv)
+
+    if args.npy:
+        embeddings = np.load(args.npy)
+    else:
+        from app.main import cargar_filas_indice
+
+        embeddings = np.array([fila["embedding"] for fila in cargar_filas_indice(args.topic, args.channel)])
+
+    rng = np.random.default_rng(0)
+    elegidos = rng.choice(len(embeddings), min(args.consultas, len(embeddings)), replace=False)
+    consultas = embeddings[elegidos] + rng.normal(0, args.ruido * np.abs(embeddings).mean(), (len(elegidos), embeddings.shape[1]))
+
+    filas = reporte_cuantizacion(embeddings, consultas, k=args.k, candidatos=args.candidatos)
+    print(json.dumps({"chunks": len(embeddings), "dimension": embeddings.shape[1], "resultados": filas}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
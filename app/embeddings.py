@@ -0,0 +1,166 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from app.cache_embeddings import llave_cache
+from app.metricas import ETAPA_EMBEDDINGS, EVENTOS, span
+from app.modelos import CATALOGO
+from app.pasarela_embeddings import PRIORIDAD_INGESTA, embeber
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Límites de los lotes
+# ==============================
+# El máximo de textos por request viene del catálogo (app/modelos.py). Algunos modelos solo
+# aceptan uno (gemini-embedding-001); para ellos el beneficio viene de la concurrencia, no del empaquetado.
+MAX_ITEMS_DEFAULT = 250
+
+EMBEDDING_BATCH_MAX_ITEMS = os.getenv("EMBEDDING_BATCH_MAX_ITEMS")
+EMBEDDING_BATCH_MAX_CARACTERES = int(os.getenv("EMBEDDING_BATCH_MAX_CARACTERES", 60000))
+EMBEDDING_BATCH_CONCURRENCIA = int(os.getenv("EMBEDDING_BATCH_CONCURRENCIA", 8))
+
+
+def limite_items(nombre_modelo: str) -> int:
+    """Máximo de textos por request; EMBEDDING_BATCH_MAX_ITEMS tiene prioridad sobre el default del modelo."""
+    if EMBEDDING_BATCH_MAX_ITEMS:
+        return max(1, int(EMBEDDING_BATCH_MAX_ITEMS))
+    especificacion = CATALOGO.get(nombre_modelo)
+    return especificacion.max_textos if especificacion is not None else MAX_ITEMS_DEFAULT
+
+
+class ResultadoEmbedding:
+    """Embedding de un texto en su posición original; `error` trae el mensaje si falló."""
+
+    __slots__ = ("posicion", "values", "error")
+
+    def __init__(self, posicion, values=None, error=None):
+        self.posicion = posicion
+        self.values = values
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def armar_lotes(textos, max_items, max_caracteres):
+    """
+    Agrupa posiciones consecutivas en lotes acotados por número de textos y por caracteres.
+    Un texto que por sí solo excede el presupuesto de caracteres va en un lote propio.
+    """
+    lotes = []
+    actual = []
+    caracteres = 0
+    for posicion, texto in enumerate(textos):
+        largo = len(texto)
+        if actual and (len(actual) >= max_items or caracteres + largo > max_caracteres):
+            lotes.append(actual)
+            actual = []
+            caracteres = 0
+        actual.append(posicion)
+        caracteres += largo
+    if actual:
+        lotes.append(actual)
+    return lotes
+
+
+def _embeber_lote(embedding_model, textos, posiciones, prioridad=PRIORIDAD_INGESTA):
+    try:
+        # La pasarela ya reintentó errores de cuota y transitorios; lo que llega aquí es definitivo
+        respuesta = embeber(embedding_model, [textos[p] for p in posiciones], prioridad=prioridad)
+        return [ResultadoEmbedding(p, e.values) for p, e in zip(posiciones, respuesta)]
+    except Exception as e:
+        if len(posiciones) == 1:
+            return [ResultadoEmbedding(posiciones[0], error=str(e))]
+        # Se reintenta uno por uno para saber exactamente qué textos fallan
+        logger.warning(f"Lote de {len(posiciones)} textos falló ({e}); reintentando individualmente")
+        resultados = []
+        for p in posiciones:
+            resultados.extend(_embeber_lote(embedding_model, textos, [p], prioridad))
+        return resultados
+
+
+def generar_embeddings_en_lotes(
+    embedding_model,
+    textos,
+    nombre_modelo="",
+    max_items=None,
+    max_caracteres=None,
+    max_concurrencia=None,
+    prioridad=PRIORIDAD_INGESTA,
+):
+    """
+    Genera los embeddings de `textos` en lotes, con a lo más `max_concurrencia` requests a la vez.
+    Todas las llamadas pasan por la pasarela compartida con la `prioridad` indicada.
+    Regresa una lista de ResultadoEmbedding en el mismo orden que `textos`.
+    """
+    max_items = max_items or limite_items(nombre_modelo)
+    max_caracteres = max_caracteres or EMBEDDING_BATCH_MAX_CARACTERES
+    max_concurrencia = max_concurrencia or EMBEDDING_BATCH_CONCURRENCIA
+
+    lotes = armar_lotes(textos, max_items, max_caracteres)
+    logger.info(
+        f"Generando {len(textos)} embeddings en {len(lotes)} lotes "
+        f"(max_items={max_items}, concurrencia={max_concurrencia})"
+    )
+
+    resultados = [None] * len(textos)
+    if not lotes:
+        return resultados
+
+    with span(ETAPA_EMBEDDINGS), ThreadPoolExecutor(max_workers=min(max_concurrencia, len(lotes))) as executor:
+        for resultados_lote in executor.map(
+            lambda posiciones: _embeber_lote(embedding_model, textos, posiciones, prioridad), lotes
+        ):
+            for resultado in resultados_lote:
+                resultados[resultado.posicion] = resultado
+
+    return resultados
+
+
+def generar_embeddings_con_cache(embedding_model, textos, cache, nombre_modelo="", dimension=None, **kwargs):
+    """
+    Igual que generar_embeddings_en_lotes, pero consulta primero la caché por contenido
+    y solo manda a Vertex los textos que no están. Regresa (resultados, {"hits", "misses"}).
+    """
+    if cache is None:
+        resultados = generar_embeddings_en_lotes(embedding_model, textos, nombre_modelo, **kwargs)
+        return resultados, {"hits": 0, "misses": len(textos)}
+
+    llaves = [llave_cache(nombre_modelo, dimension, texto) for texto in textos]
+    try:
+        encontrados = cache.obtener_varios(llaves)
+    except Exception as e:
+        # Una caché caída no debe detener la ingesta
+        logger.warning(f"No se pudo leer la caché de embeddings: {e}")
+        encontrados = {}
+
+    resultados = [None] * len(textos)
+    pendientes = []
+    for posicion, llave in enumerate(llaves):
+        if llave in encontrados:
+            resultados[posicion] = ResultadoEmbedding(posicion, encontrados[llave])
+        else:
+            pendientes.append(posicion)
+
+    nuevos = generar_embeddings_en_lotes(
+        embedding_model, [textos[p] for p in pendientes], nombre_modelo, **kwargs
+    )
+    por_guardar = {}
+    for posicion, resultado in zip(pendientes, nuevos):
+        resultado.posicion = posicion
+        resultados[posicion] = resultado
+        if resultado.ok:
+            por_guardar[llaves[posicion]] = resultado.values
+
+    try:
+        cache.guardar_varios(por_guardar)
+    except Exception as e:
+        logger.warning(f"No se pudo escribir en la caché de embeddings: {e}")
+
+    estadisticas = {"hits": len(textos) - len(pendientes), "misses": len(pendientes)}
+    EVENTOS.incrementar(estadisticas["hits"], evento="cache_embeddings_hit")
+    EVENTOS.incrementar(estadisticas["misses"], evento="cache_embeddings_miss")
+    logger.info(f"Caché de embeddings: {estadisticas['hits']} hits, {estadisticas['misses']} misses")
+    return resultados, estadisticas
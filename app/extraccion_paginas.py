@@ -0,0 +1,102 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración de la extracción paralela
+# ==============================
+# Documentos con menos páginas que este umbral se procesan en el mismo proceso
+EXTRACCION_PARALELA_MIN_PAGINAS = int(os.getenv("EXTRACCION_PARALELA_MIN_PAGINAS", 40))
+EXTRACCION_PROCESOS = int(os.getenv("EXTRACCION_PROCESOS", os.cpu_count() or 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def abrir_documento(pdf_data):
+    """Abre el PDF desde bytes en memoria o desde la ruta de un archivo descargado a disco."""
+    if isinstance(pdf_data, str):
+        return fitz.open(pdf_data, filetype="pdf")
+    return fitz.open(stream=pdf_data, filetype="pdf")
+
+
+def lineas_de_paginas(pdf_data, inicio: int, fin: int) -> list:
+    """
+    Extrae, en orden, las líneas no vacías de las páginas [inicio, fin).
+    Cada línea es (line_text, spans) con spans reducidos a text/flags/font,
+    que es todo lo que necesitan los detectores de títulos.
+    Corre dentro de los procesos del pool, por eso abre su propia copia del documento
+    (si `pdf_data` es una ruta, cada proceso lee el archivo en vez de recibir los bytes).
+    """
+    lineas = []
+    with abrir_documento(pdf_data) as doc:
+        for numero in range(inicio, fin):
+            page_dict = doc[numero].get_text("dict")
+            for block in page_dict.get("blocks", []):
+                if "lines" not in block:
+                    continue
+                for line in block["lines"]:
+                    spans = [
+                        {"text": span["text"], "flags": span.get("flags", 0), "font": span.get("font", "")}
+                        for span in line.get("spans", [])
+                    ]
+                    line_text = " ".join(span["text"].strip() for span in spans).strip()
+                    if line_text:
+                        lineas.append((line_text, spans))
+    return lineas
+
+
+def _obtener_pool() -> ProcessPoolExecutor:
+    # "spawn" para no hacer fork de un proceso que ya tiene hilos (uvicorn, pools de I/O)
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=EXTRACCION_PROCESOS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def rangos_de_paginas(total_paginas: int, partes: int) -> list:
+    """Divide [0, total_paginas) en a lo más `partes` rangos contiguos de tamaño parecido."""
+    partes = max(1, min(partes, total_paginas))
+    tamano, resto = divmod(total_paginas, partes)
+    rangos = []
+    inicio = 0
+    for i in range(partes):
+        fin = inicio + tamano + (1 if i < resto else 0)
+        rangos.append((inicio, fin))
+        inicio = fin
+    return rangos
+
+
+def extraer_lineas(pdf_data) -> list:
+    """
+    Regresa todas las líneas del documento en orden de lectura.
+    A partir de EXTRACCION_PARALELA_MIN_PAGINAS páginas reparte rangos de páginas
+    entre un pool de procesos y concatena los resultados en orden.
+    `pdf_data` son los bytes del PDF o la ruta de un archivo local.
+    """
+    with abrir_documento(pdf_data) as doc:
+        total_paginas = doc.page_count
+
+    if total_paginas < EXTRACCION_PARALELA_MIN_PAGINAS or EXTRACCION_PROCESOS <= 1:
+        return lineas_de_paginas(pdf_data, 0, total_paginas)
+
+    # Más rangos que procesos para balancear páginas de distinto costo
+    rangos = rangos_de_paginas(total_paginas, EXTRACCION_PROCESOS * 2)
+    logger.info(f"Extracción paralela: {total_paginas} páginas en {len(rangos)} rangos")
+    pool = _obtener_pool()
+    futuros = [pool.submit(lineas_de_paginas, pdf_data, inicio, fin) for inicio, fin in rangos]
+
+    lineas = []
+    for futuro in futuros:
+        lineas.extend(futuro.result())
+    return lineas
@@ -1,140 +1,250 @@
-import fitz  # PyMuPDF
-from google.cloud import storage
 import os
+import logging
+import tempfile
 from dotenv import load_dotenv
 import re
+from app.extraccion_paginas import extraer_lineas
+from app.clientes import obtener_storage_client
+from app.cache_extraccion import llave_extraccion, obtener_cache_extraccion
+from app.fragmentacion import fragmentar_secciones
+from app.metricas import (
+    ETAPA_DETECCION_TITULOS,
+    ETAPA_GCS_DESCARGA,
+    ETAPA_GCS_METADATOS,
+    ETAPA_PDF_PARSEO,
+    EVENTOS,
+    span,
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 BUCKET_NAME = os.getenv("BUCKET_NAME")
-storage_client = storage.Client()
+# PDFs de este tamaño o más se descargan a un archivo temporal en vez de quedar completos en memoria
+EXTRACCION_DESCARGA_A_DISCO_MB = float(os.getenv("EXTRACCION_DESCARGA_A_DISCO_MB", 32))
+EXTRACCION_DIRECTORIO_TEMPORAL = os.getenv("EXTRACCION_DIRECTORIO_TEMPORAL") or None
+
+# Subir cuando cambie la salida de la extracción o de los detectores: invalida la caché de extracciones
+VERSION_EXTRACTOR = "1"
+
+# Patrones precompilados de los detectores de títulos
+PATRON_CAMEL_CASE = re.compile(r"^[A-Z][a-z]+(?:[A-Z][a-z]+)*$")
+PATRON_PALABRA = re.compile(r"^[A-Za-z]+$")
+PATRON_CAMEL_CASE_SUBTITULO = re.compile(r"^[A-Z][a-z]+(?:[A-Z][a-z]+)*_[a-z0-9_]+$")
+
+
+def blob_pdf(blob_name: str):
+    return obtener_storage_client().bucket(BUCKET_NAME).blob(blob_name)
+
+
+def cargar_metadatos(blob) -> bool:
+    """Lee generation, md5 y tamaño del blob (una llamada sin descargar el contenido)."""
+    try:
+        with span(ETAPA_GCS_METADATOS):
+            blob.reload()
+        return True
+    except Exception as e:
+        logger.warning(f"No se pudieron leer los metadatos de {blob.name}: {e}")
+        return False
+
+
+def descargar_blob(blob):
+    """
+    Descarga el contenido del blob fijado a la generation leída en cargar_metadatos.
+    Regresa bytes, o la ruta de un archivo temporal si el PDF pesa EXTRACCION_DESCARGA_A_DISCO_MB o más
+    (quien lo llama debe liberarlo con liberar_descarga).
+    """
+    generacion = getattr(blob, "generation", None)
+    # Si el objeto cambió desde que se leyeron los metadatos, GCS responde 412 en vez de mezclar versiones
+    condiciones = {"if_generation_match": generacion} if generacion else {}
+    tamano = getattr(blob, "size", None) or 0
+    with span(ETAPA_GCS_DESCARGA):
+        if tamano < EXTRACCION_DESCARGA_A_DISCO_MB * 2**20:
+            return blob.download_as_bytes(**condiciones)
+        descriptor, ruta = tempfile.mkstemp(suffix=".pdf", dir=EXTRACCION_DIRECTORIO_TEMPORAL)
+        os.close(descriptor)
+        try:
+            blob.download_to_filename(ruta, **condiciones)
+        except BaseException:
+            liberar_descarga(ruta)
+            raise
+        logger.info(f"{blob.name} ({tamano / 2**20:.1f} MB) descargado a {ruta}")
+        return ruta
+
+
+def liberar_descarga(pdf_data):
+    if isinstance(pdf_data, str):
+        try:
+            os.remove(pdf_data)
+        except FileNotFoundError:
+            pass
+
+
+def consultar_cache_extraccion(blob, detector):
+    """
+    Regresa (llave, secciones). `secciones` es None si no están en caché;
+    `llave` es None si la caché está deshabilitada o el blob no tiene generation/md5.
+    Lee los metadatos del blob, que descargar_blob usa después para fijar la generation y elegir disco o memoria.
+    """
+    if not cargar_metadatos(blob):
+        return None, None
+    cache = obtener_cache_extraccion()
+    if cache is None:
+        return None, None
+    llave = llave_extraccion(
+        BUCKET_NAME, blob.name, blob.generation, blob.md5_hash, VERSION_EXTRACTOR, type(detector).__name__
+    )
+    if llave is None:
+        return None, None
+    try:
+        secciones = cache.obtener(llave)
+    except Exception as e:
+        logger.warning(f"No se pudo leer la caché de extracciones: {e}")
+        return llave, None
+    EVENTOS.incrementar(evento="cache_extraccion_hit" if secciones is not None else "cache_extraccion_miss")
+    return llave, secciones
+
+
+def guardar_en_cache_extraccion(llave, secciones):
+    if llave is None:
+        return
+    try:
+        obtener_cache_extraccion().guardar(llave, secciones)
+    except Exception as e:
+        logger.warning(f"No se pudo escribir en la caché de extracciones: {e}")
+
+
+def extraer_blob(blob_name: str, detector) -> list:
+    """
+    Secciones de un PDF de Cloud Storage. Si la misma generation ya se extrajo con esta
+    versión del extractor y este detector, se regresa de la caché sin descargar ni parsear.
+    """
+    blob = blob_pdf(blob_name)
+    llave, secciones = consultar_cache_extraccion(blob, detector)
+    if secciones is not None:
+        logger.info(f"{blob_name}: extracción servida desde la caché ({len(secciones)} secciones)")
+        return secciones
+    pdf_data = descargar_blob(blob)
+    try:
+        secciones = lineas_y_secciones(pdf_data, detector)
+    finally:
+        liberar_descarga(pdf_data)
+    guardar_en_cache_extraccion(llave, secciones)
+    return secciones
+
+
+# =========================================================
+# Detectores de títulos
+# =========================================================
+class DetectorCalibriCamelCase:
+    """
+    Título: algún span en negrita Calibri-Bold cuyo texto es CamelCase o una sola palabra.
+    Cada título abre un chunk nuevo, aunque el intent se repita.
+    """
+
+    agrupar_por_intencion = False
+
+    def contexto(self, line_text: str, spans: list):
+        es_titulo = any(
+            span.get("flags", 0) == 16  # Negrita
+            and span.get("font", "").startswith("Calibri-Bold")
+            and (
+                PATRON_CAMEL_CASE.match(span["text"].strip())
+                or PATRON_PALABRA.match(span["text"].strip())
+            )
+            for span in spans
+        )
+        return {"intent": line_text} if es_titulo else None
+
+
+class DetectorCamelCaseSubtitulo:
+    """
+    Título: línea 'CamelCase_subtitulo' en negrita Calibri-Bold.
+    Todo el texto con el mismo intent_document se junta en un solo bloque.
+    """
+
+    agrupar_por_intencion = True
+
+    def contexto(self, line_text: str, spans: list):
+        if es_titulo_valido(line_text, spans):
+            contexto = normalizar_intencion(line_text)
+            logger.debug(f"Contexto detectado: {contexto['intent_document']}")
+            return contexto
+        return None
+
+
+# =========================================================
+# Motor de extracción
+# =========================================================
+def extraer_secciones(lineas, detector) -> list:
+    """
+    Recorre las líneas una sola vez y arma las secciones según el detector.
+    El texto se acumula en listas y se une al final; cuando el detector agrupa
+    por intención, los bloques se buscan en un dict por intent_document.
+    Las líneas anteriores al primer título se descartan.
+    """
+    secciones = []  # [(contexto, partes_de_texto)]
+    por_intencion = {}
+    contexto_actual = None
+    partes_actuales = None
+
+    for line_text, spans in lineas:
+        contexto = detector.contexto(line_text, spans)
+
+        if contexto is not None:
+            contexto_actual = contexto
+            if detector.agrupar_por_intencion:
+                # El bloque se crea hasta que llega su primera línea de texto
+                partes_actuales = None
+            else:
+                partes_actuales = []
+                secciones.append((contexto_actual, partes_actuales))
+            continue
+
+        if contexto_actual is None:
+            continue
+
+        if detector.agrupar_por_intencion and partes_actuales is None:
+            llave = contexto_actual["intent_document"]
+            partes_actuales = por_intencion.get(llave)
+            if partes_actuales is None:
+                partes_actuales = []
+                por_intencion[llave] = partes_actuales
+                secciones.append((contexto_actual, partes_actuales))
+
+        partes_actuales.append(line_text)
+
+    if detector.agrupar_por_intencion:
+        return [{**contexto, "texto": " ".join(partes)} for contexto, partes in secciones]
+    return [{"intent": contexto["intent"], "texto": " ".join(partes)} for contexto, partes in secciones]
+
+
+def listar_pdfs(prefijo: str) -> list:
+    """Nombres de los PDFs del bucket que empiezan con `prefijo`"""
+    return [
+        blob.name
+        for blob in obtener_storage_client().list_blobs(BUCKET_NAME, prefix=prefijo)
+        if blob.name.lower().endswith(".pdf")
+    ]
+
+
+def lineas_y_secciones(pdf_data, detector) -> list:
+    """Parseo del PDF y detección de títulos, cada uno medido como su propia etapa."""
+    # Líneas no vacías en orden de lectura (en paralelo por páginas si el documento es grande)
+    with span(ETAPA_PDF_PARSEO):
+        lineas = extraer_lineas(pdf_data)
+    with span(ETAPA_DETECCION_TITULOS):
+        return extraer_secciones(lineas, detector)
 
 
 def extraer_texto_con_intenciones(blob_name):
-    print("Entrando en extracción de documentos")
-
-    """Descarga un PDF desde Cloud Storage, detecta títulos como intenciones y extrae párrafos"""
-    bucket = storage_client.bucket(BUCKET_NAME)
-    blob = bucket.blob(f"{blob_name}")
-    pdf_data = blob.download_as_bytes()
-
-    doc = fitz.open(stream=pdf_data, filetype="pdf")
-    # intencion_actual = None
-    # parrafos_con_intenciones = []
-
-    # for page in doc:
-    #     # Extraer el texto de la página en formato "dict"
-    #     page_dict = page.get_text("dict")
-    #     blocks = page_dict.get("blocks", [])
-
-    #     for block in blocks:
-    #         if "lines" not in block:
-    #             continue
-
-    #         for line in block["lines"]:
-    #             temp_text = " ".join(
-    #                 span["text"].strip() for span in line.get("spans", [])
-    #             ).strip()
-    #             es_titulo = any(
-    #                 span.get("flags", 0) == 16  # Negrita
-    #                 and span.get("font", "").startswith("Calibri-Bold")
-    #                 and (
-    #                     re.match(r"^[A-Z][a-z]+(?:[A-Z][a-z]+)*$", span["text"].strip())
-    #                     or re.match(r"^[A-Za-z]+$", span["text"].strip())
-    #                 )  # Palabra simple
-    #                 for span in line.get("spans", [])
-    #             )
-    #             if not intencion_actual or (temp_text != intencion_actual and not es_titulo):
-    #                 line_text = temp_text
-    #             if not line_text:
-    #                 continue
-
-    #             # Verificar si la línea es un título (negrita y fuente Calibri-Bold)
-    #             # es_titulo = any(
-    #             #     span.get("flags", 0) == 16 and  # Negrita
-    #             #     span.get("font", "").startswith("Calibri-Bold") and  # Fuente Calibri-Bold
-    #             #     re.match(r"^[A-Z_ ]+$", span["text"].strip())  # Mayúsculas, guiones bajos y espacios
-    #             #     for span in line.get("spans", [])
-    #             # )
-
-
-    #             if es_titulo:
-    #                 if intencion_actual:
-    #                     parrafos_con_intenciones.append(
-    #                         {"intencion": intencion_actual, "texto": line_text}
-    #                     )
-    #                 # Actualizamos la intención con el título detectado
-    #                 intencion_actual = temp_text
-    #             else:
-    #                 # Si ya se ha detectado una intención, guardamos la línea como párrafo asociado
-    #                 if intencion_actual:
-    #                     # Si el párrafo ya existe, añadimos la línea al texto existente
-    #                     if (
-    #                         parrafos_con_intenciones
-    #                         and parrafos_con_intenciones[-1]["intencion"]
-    #                         == intencion_actual
-    #                     ):
-    #                         # print(f"Esta texto es la prueba: {intencion_actual} y el texto asociado es {line_text}")
-    #                         parrafos_con_intenciones[-1]["texto"] += " " + line_text
-    #                     else:
-    #                         # Si no, creamos un nuevo párrafo
-    #                         parrafos_con_intenciones.append(
-    #                             {"intencion": intencion_actual, "texto": line_text}
-    #                         )
-
-    # # print(parrafos_con_intenciones)
-    # return parrafos_con_intenciones
-    parrafos_con_intenciones = []
-    intencion_actual = None
-    texto_parrafo = ""
-
-    for page in doc:
-        page_dict = page.get_text("dict")
-        blocks = page_dict.get("blocks", [])
-
-        for block in blocks:
-            if "lines" not in block:
-                continue
-
-            for line in block["lines"]:
-                # Extraer texto de la línea
-                temp_text = " ".join(span["text"].strip() for span in line.get("spans", [])).strip()
-                if not temp_text:
-                    continue
-
-                # Usar TU regex original para detectar títulos
-                es_titulo = any(
-                    span.get("flags", 0) == 16  # Negrita
-                    and span.get("font", "").startswith("Calibri-Bold")
-                    and (
-                        re.match(r"^[A-Z][a-z]+(?:[A-Z][a-z]+)*$", span["text"].strip())
-                        or re.match(r"^[A-Za-z]+$", span["text"].strip())
-                    )
-                    for span in line.get("spans", [])
-                )
-
-                if es_titulo:
-                    # Guardar el título anterior y su párrafo (si existen)
-                    if intencion_actual is not None:
-                        parrafos_con_intenciones.append({
-                            "intent": intencion_actual,
-                            "texto": texto_parrafo.strip()
-                        })
-                    # Actualizar el título actual y reiniciar el párrafo
-                    intencion_actual = temp_text
-                    texto_parrafo = ""
-                else:
-                    # Acumular texto del párrafo
-                    texto_parrafo += " " + temp_text
-
-    # Guardar el último título y párrafo
-    if intencion_actual is not None:
-        parrafos_con_intenciones.append({
-            "intent": intencion_actual,
-            "texto": texto_parrafo.strip()
-        })
-
-    return parrafos_con_intenciones
+    """
+    Descarga un PDF desde Cloud Storage, detecta títulos como intenciones y extrae párrafos.
+    Con FRAGMENTOS_HABILITADOS las secciones largas salen partidas en fragmentos acotados.
+    """
+    logger.info(f"Extrayendo {blob_name}")
+    return fragmentar_secciones(extraer_blob(blob_name, DetectorCalibriCamelCase()))
 
 
 def normalizar_intencion(texto: str) -> dict:
@@ -152,7 +262,7 @@ def normalizar_intencion(texto: str) -> dict:
     titulo_principal, subtitulo = texto.split("_", 1)
 
     # Validar que el título principal sea CamelCase válido
-    if not re.match(r"^[A-Z][a-z]+(?:[A-Z][a-z]+)*$", titulo_principal):
+    if not PATRON_CAMEL_CASE.match(titulo_principal):
         raise ValueError(f"Formato CamelCase inválido en título: '{titulo_principal}'")
 
     return {
@@ -169,10 +279,7 @@ def es_titulo_valido(line_text: str, spans: list) -> bool:
     2. Estilo: Negrita (flags == 16) y fuente Calibri-Bold
     """
     # Verificar formato CamelCase_subtitulo
-    formato_valido = (
-        re.match(r"^[A-Z][a-z]+(?:[A-Z][a-z]+)*_[a-z0-9_]+$", line_text.strip())
-        is not None
-    )
+    formato_valido = PATRON_CAMEL_CASE_SUBTITULO.match(line_text.strip()) is not None
 
     # Verificar estilo de fuente
     estilo_valido = any(
@@ -186,58 +293,15 @@ def es_titulo_valido(line_text: str, spans: list) -> bool:
 
 def extraer_texto_con_intenciones_beta(blob_name: str):
     """Descarga un PDF y extrae texto organizado por títulos y subtítulos"""
-    print(f"Procesando archivo: {blob_name}")
+    logger.info(f"Procesando archivo: {blob_name}")
 
     try:
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(f"{blob_name}")
-        pdf_data = blob.download_as_bytes()
-
-        doc = fitz.open(stream=pdf_data, filetype="pdf")
-        datos_extraidos = []
-        contexto_actual = None
-
-        for page in doc:
-            page_dict = page.get_text("dict")
-            blocks = page_dict.get("blocks", [])
-
-            for block in blocks:
-                if "lines" not in block:
-                    continue
-
-                for line in block["lines"]:
-                    line_text = " ".join(
-                        span["text"].strip() for span in line.get("spans", [])
-                    ).strip()
-                    if not line_text:
-                        continue
-
-                    if es_titulo_valido(line_text, line.get("spans", [])):
-                        contexto_actual = normalizar_intencion(line_text)
-                        print(
-                            f"Contexto detectado: {contexto_actual['intent_document']}"
-                        )
-                    elif contexto_actual:
-                        # Buscar si ya existe un bloque con este contexto
-                        bloque_existente = next(
-                            (
-                                b
-                                for b in datos_extraidos
-                                if b["intent_document"]
-                                == contexto_actual["intent_document"]
-                            ),
-                            None,
-                        )
-
-                        if bloque_existente:
-                            bloque_existente["texto"] += " " + line_text
-                        else:
-                            nuevo_bloque = {**contexto_actual, "texto": line_text}
-                            datos_extraidos.append(nuevo_bloque)
-
-        print(f"Extracción completada. Bloques encontrados: {len(datos_extraidos)}")
+        # La caché guarda las secciones completas; la fragmentación se aplica después
+        datos_extraidos = fragmentar_secciones(extraer_blob(blob_name, DetectorCamelCaseSubtitulo()))
+
+        logger.info(f"Extracción completada. Bloques encontrados: {len(datos_extraidos)}")
         return datos_extraidos
 
     except Exception as e:
-        print(f"Error procesando {blob_name}: {str(e)}")
+        logger.error(f"Error procesando {blob_name}: {str(e)}")
         raise
@@ -0,0 +1,130 @@
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración
+# ==============================
+# Deshabilitado por default: cada sección extraída se inserta como un solo chunk
+FRAGMENTOS_HABILITADOS = os.getenv("FRAGMENTOS_HABILITADOS", "false").lower() == "true"
+# Tamaño máximo de cada fragmento, en caracteres (la misma unidad que EMBEDDING_BATCH_MAX_CARACTERES)
+FRAGMENTOS_MAX_CARACTERES = int(os.getenv("FRAGMENTOS_MAX_CARACTERES", 1500))
+# Caracteres del final de un fragmento que se repiten al inicio del siguiente (en oraciones completas)
+FRAGMENTOS_SOLAPAMIENTO_CARACTERES = int(os.getenv("FRAGMENTOS_SOLAPAMIENTO_CARACTERES", 200))
+
+# Fin de oración: . ! ? … (y cierres de comillas/paréntesis) seguidos de espacio
+PATRON_FIN_ORACION = re.compile(r"(?<=[.!?…])[\"'”»)\]]*\s+")
+
+
+def dividir_oraciones(texto: str) -> list:
+    return [oracion.strip() for oracion in PATRON_FIN_ORACION.split(texto) if oracion.strip()]
+
+
+def _partir_oracion(oracion: str, max_caracteres: int) -> list:
+    """Una oración más larga que el máximo se parte por palabras (o a la fuerza, si una palabra no cabe)."""
+    piezas = []
+    actual = ""
+    for palabra in oracion.split():
+        while len(palabra) > max_caracteres:
+            if actual:
+                piezas.append(actual)
+                actual = ""
+            piezas.append(palabra[:max_caracteres])
+            palabra = palabra[max_caracteres:]
+        if actual and len(actual) + 1 + len(palabra) > max_caracteres:
+            piezas.append(actual)
+            actual = palabra
+        else:
+            actual = f"{actual} {palabra}" if actual else palabra
+    if actual:
+        piezas.append(actual)
+    return piezas
+
+
+def fragmentar_texto(texto: str, max_caracteres=None, solapamiento=None) -> list:
+    """
+    Ventanas de oraciones completas de a lo más `max_caracteres`; cada ventana empieza con las
+    últimas oraciones de la anterior que quepan en `solapamiento` caracteres.
+    Un texto que ya cabe se regresa intacto, así activar la fragmentación no cambia esos chunks.
+    """
+    max_caracteres = max_caracteres or FRAGMENTOS_MAX_CARACTERES
+    solapamiento = FRAGMENTOS_SOLAPAMIENTO_CARACTERES if solapamiento is None else solapamiento
+    texto = texto.strip()
+    if len(texto) <= max_caracteres:
+        return [texto]
+
+    unidades = []
+    for oracion in dividir_oraciones(texto):
+        unidades.extend(_partir_oracion(oracion, max_caracteres) if len(oracion) > max_caracteres else [oracion])
+
+    ventanas = []
+    inicio = 0
+    while inicio < len(unidades):
+        fin = inicio
+        largo = 0
+        while fin < len(unidades) and (fin == inicio or largo + 1 + len(unidades[fin]) <= max_caracteres):
+            largo += len(unidades[fin]) + (1 if fin > inicio else 0)
+            fin += 1
+        ventanas.append(" ".join(unidades[inicio:fin]))
+        if fin == len(unidades):
+            break
+        # El solapamiento nunca regresa hasta el inicio de la ventana: siempre se avanza al menos una oración
+        siguiente = fin
+        repetido = 0
+        while siguiente - 1 > inicio and repetido + len(unidades[siguiente - 1]) + 1 <= solapamiento:
+            siguiente -= 1
+            repetido += len(unidades[siguiente]) + 1
+        # La siguiente ventana debe agregar al menos una oración nueva: si no cabe detrás del
+        # solapamiento, se recorta (hasta quitarlo) en lugar de emitir una ventana repetida
+        while siguiente < fin and repetido + len(unidades[fin]) > max_caracteres:
+            repetido -= len(unidades[siguiente]) + 1
+            siguiente += 1
+        inicio = siguiente
+    return ventanas
+
+
+def fragmentar_secciones(secciones, max_caracteres=None, solapamiento=None, habilitado=None) -> list:
+    """
+    Parte cada sección {"intent", ..., "texto"} en fragmentos acotados; cada fragmento conserva
+    los metadatos de su sección (intent, intent_document, subtitle). El orden de salida es el de
+    las secciones y, dentro de ellas, el del texto, así el chunk_id que asigna la inserción
+    es estable para el mismo documento.
+    """
+    habilitado = FRAGMENTOS_HABILITADOS if habilitado is None else habilitado
+    if not habilitado:
+        return secciones
+
+    fragmentos = []
+    for seccion in secciones:
+        for texto in fragmentar_texto(seccion["texto"], max_caracteres, solapamiento):
+            fragmentos.append({**seccion, "texto": texto})
+    if len(fragmentos) != len(secciones):
+        logger.info(f"Fragmentación: {len(secciones)} secciones -> {len(fragmentos)} chunks")
+    return fragmentos
+
+
+def unir_fragmentos(fragmentos, solapamiento=None) -> str:
+    """
+    Inverso de fragmentar_texto: une fragmentos consecutivos quitando el solapamiento, es decir,
+    el prefijo más largo de cada fragmento, en fin de oración y de a lo más `solapamiento`
+    caracteres, con el que termina el texto acumulado.
+    """
+    solapamiento = FRAGMENTOS_SOLAPAMIENTO_CARACTERES if solapamiento is None else solapamiento
+    texto = ""
+    for fragmento in fragmentos:
+        fragmento = fragmento.strip()
+        if not texto:
+            texto = fragmento
+            continue
+        repetido = 0
+        for corte in [m.start() for m in PATRON_FIN_ORACION.finditer(fragmento)] + [len(fragmento)]:
+            if corte > min(len(texto), solapamiento):
+                break
+            if texto.endswith(fragmento[:corte]):
+                repetido = corte
+        resto = fragmento[repetido:].strip()
+        if resto:
+            texto = f"{texto} {resto}"
+    return texto
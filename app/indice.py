@@ -0,0 +1,385 @@
+import os
+import threading
+import time
+import logging
+
+import numpy as np
+
+from app.ann import construir_si_aplica, normalizar_filas
+from app.cuantizacion import INDICE_PRECISION, MatrizCuantizada, a_memmap, buscar_con_rerank
+from app import snapshots
+from app.modelos import ModeloIncompatible
+from app.fragmentacion import FRAGMENTOS_HABILITADOS, unir_fragmentos
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto compara una caché residente su versión con la versión de datos compartida (la de la
+# caché de resultados, que sube con cada ingesta en cualquier instancia)
+RESIDENTES_REVISION_SEGUNDOS = float(os.getenv("RESIDENTES_REVISION_SEGUNDOS", 5))
+
+# =========================================================
+# Índice vectorizado por (topic, channel)
+# =========================================================
+class IndiceEmbeddings:
+    """
+    Matriz contigua float32 con los embeddings ya normalizados de un (topic, channel),
+    junto con los textos e ids en arreglos paralelos.
+    Una búsqueda es un solo producto matriz-vector más un top-k con argpartition.
+
+    Con INDICE_PRECISION float16/int8 en memoria solo queda la matriz cuantizada;
+    la copia float32 vive en un archivo mapeado (el .npy del snapshot, o uno en
+    INDICE_DIRECTORIO_TEMPORAL) y solo se lee para re-rankear la preselección. Si no hay un
+    disco donde mapearla (solo tmpfs), el índice se queda en float32 sin cuantizar.
+
+    Con `normalizada=True` la matriz se usa tal cual (p. ej. el .npy mapeado de un snapshot).
+    `modelo` es el identificador modelo@dimensión de los vectores; una búsqueda con otro modelo se rechaza.
+    """
+
+    def __init__(self, ids, textos, embeddings, normalizada=False, version=None, modelo=None):
+        self.ids = list(ids)
+        self.textos = list(textos)
+        self.version = version
+        self.modelo = modelo
+        self.revisado_en = time.time()
+
+        if not len(self.textos):
+            matriz = np.zeros((0, 0), dtype=np.float32)
+        elif normalizada:
+            matriz = embeddings
+        else:
+            # Los vectores con norma 0 se quedan en 0 (similitud 0, igual que antes)
+            matriz = normalizar_filas(embeddings)
+
+        self.cuantizada = None
+        if INDICE_PRECISION != "float32" and len(self.textos):
+            exacta = matriz if isinstance(matriz, np.memmap) else a_memmap(matriz)
+            # Sin archivo en disco para la copia exacta, cuantizar solo sumaría memoria: se sirve en float32
+            if exacta is not None:
+                self.cuantizada = MatrizCuantizada(matriz, INDICE_PRECISION)
+                matriz = exacta
+
+        self.matriz = matriz
+        # Índice aproximado (IVF) solo para llaves grandes y si ANN_HABILITADO
+        self.ivf = construir_si_aplica(matriz) if len(self.textos) else None
+        self.cargado_en = time.time()
+
+    def __len__(self):
+        return len(self.textos)
+
+    def verificar(self, modelo, dimension):
+        """Lanza ModeloIncompatible si la pregunta no viene del mismo modelo y dimensión que la matriz."""
+        if modelo is not None and self.modelo is not None and modelo != self.modelo:
+            raise ModeloIncompatible(f"El índice es de {self.modelo} y la pregunta de {modelo}")
+        if len(self) and dimension != self.matriz.shape[1]:
+            raise ModeloIncompatible(
+                f"La pregunta tiene {dimension} dimensiones y el índice {self.matriz.shape[1]}"
+            )
+
+    def buscar(self, embedding_pregunta, k=5, nprobe=None, modelo=None):
+        """
+        Regresa una lista de (posición, similitud) ordenada de mayor a menor similitud.
+        Si la llave tiene IVF la búsqueda es aproximada y `nprobe` ajusta el recall.
+        """
+        if not len(self):
+            return []
+
+        consulta = np.asarray(embedding_pregunta, dtype=np.float32)
+        self.verificar(modelo, consulta.shape[-1])
+        norma = np.linalg.norm(consulta)
+        if not norma:
+            consulta = np.zeros_like(consulta)
+        else:
+            consulta = consulta / norma
+
+        if self.ivf is not None:
+            if self.cuantizada is not None:
+                posiciones = self.ivf.candidatos(consulta, nprobe)
+                return buscar_con_rerank(self.cuantizada, self.matriz, consulta, k, posiciones=posiciones)
+            return self.ivf.buscar(consulta, k, nprobe)
+
+        if self.cuantizada is not None:
+            return buscar_con_rerank(self.cuantizada, self.matriz, consulta, k)
+
+        similitudes = self.matriz @ consulta
+        return top_k(similitudes, k)
+
+    def buscar_lote(self, embeddings_preguntas, k=5, nprobe=None, modelo=None):
+        """
+        Top-k de varias preguntas a la vez: un solo producto matriz-matriz.
+        Regresa una lista (una por pregunta) de listas de (posición, similitud).
+        """
+        if not len(embeddings_preguntas):
+            return []
+        if not len(self):
+            return [[] for _ in embeddings_preguntas]
+        if self.ivf is not None or self.cuantizada is not None:
+            # Los caminos aproximados ya acotan el trabajo por pregunta
+            return [self.buscar(embedding, k, nprobe, modelo) for embedding in embeddings_preguntas]
+
+        consultas = normalizar_filas(embeddings_preguntas)
+        self.verificar(modelo, consultas.shape[1])
+        similitudes = self.matriz @ consultas.T  # (chunks, preguntas)
+        return [top_k(similitudes[:, j], k) for j in range(similitudes.shape[1])]
+
+
+def top_k(similitudes, k):
+    """Top-k de un vector de similitudes sin ordenar el arreglo completo."""
+    k = min(k, len(similitudes))
+    if k <= 0:
+        return []
+    if k < len(similitudes):
+        candidatos = np.argpartition(-similitudes, k - 1)[:k]
+    else:
+        candidatos = np.arange(len(similitudes))
+    orden = candidatos[np.argsort(-similitudes[candidatos], kind="stable")]
+    return [(int(i), float(similitudes[i])) for i in orden]
+
+
+# =========================================================
+# Cachés residentes por (topic, channel)
+# =========================================================
+class _CacheResidente:
+    """
+    Guarda un valor construido por (topic, channel).
+    Se carga de forma perezosa en la primera consulta de cada llave y se refresca
+    cuando la ingesta escribe en esa llave.
+
+    Con `version_datos(topic, channel)` cada valor recuerda la versión de datos con la que se
+    construyó: si una ingesta en otra instancia la sube, el valor se reconstruye. Quien ya conoce
+    la versión que necesita (p. ej. la caché de resultados) la pasa como `version` y no espera
+    a la revisión periódica.
+    """
+
+    def __init__(self, cargador, version_datos=None):
+        self._cargador = cargador
+        self._version_datos = version_datos
+        self._valores = {}
+        # llave -> [versión de datos del valor, momento de la última revisión]
+        self._versiones = {}
+        self._lock = threading.Lock()
+        self._locks_llave = {}
+
+    @staticmethod
+    def llave(topic, channel):
+        return (topic.lower().strip(), channel.lower().strip())
+
+    def _lock_de(self, llave):
+        with self._lock:
+            return self._locks_llave.setdefault(llave, threading.Lock())
+
+    def _construir(self, llave, version=None):
+        """`version` es la versión de datos que debe reflejar el valor (None si no se conoce)."""
+        raise NotImplementedError
+
+    def _vigente(self, llave, valor):
+        """Si es False, el valor residente se vuelve a construir en la siguiente consulta."""
+        return True
+
+    def _al_dia(self, llave, version, consultar):
+        """
+        Si el valor residente refleja la versión de datos. Sin `version`, la versión compartida se
+        consulta cada RESIDENTES_REVISION_SEGUNDOS; con consultar=False (sin I/O) una revisión
+        pendiente cuenta como desactualizado, para que el llamador pase por `obtener`.
+        """
+        estado = self._versiones.get(llave)
+        if estado is None:
+            return True
+        if version is not None:
+            return estado[0] is None or estado[0] >= version
+        if self._version_datos is None or time.monotonic() - estado[1] < RESIDENTES_REVISION_SEGUNDOS:
+            return True
+        if not consultar:
+            return False
+        try:
+            actual = self._version_datos(*llave)
+        except Exception as e:
+            logger.warning(f"No se pudo revisar la versión de datos de {llave}: {e}")
+            actual = None
+        estado[1] = time.monotonic()
+        return actual is None or estado[0] is None or estado[0] >= actual
+
+    def _version_actual(self, llave):
+        if self._version_datos is None:
+            return None
+        try:
+            return self._version_datos(*llave)
+        except Exception as e:
+            logger.warning(f"No se pudo leer la versión de datos de {llave}: {e}")
+            return None
+
+    def _guardar(self, llave, valor, version):
+        self._valores[llave] = valor
+        self._versiones[llave] = [version, time.monotonic()]
+
+    def residente(self, topic, channel, version=None):
+        """Regresa el valor si ya está en memoria y sigue vigente, sin cargarlo."""
+        llave = self.llave(topic, channel)
+        valor = self._valores.get(llave)
+        if valor is not None and self._vigente(llave, valor) and self._al_dia(llave, version, consultar=False):
+            return valor
+        return None
+
+    def obtener(self, topic, channel, version=None):
+        """
+        Regresa (valor, segundos_de_carga). segundos_de_carga es 0 si ya estaba residente.
+        `version` es la versión de datos mínima que debe reflejar el valor.
+        """
+        llave = self.llave(topic, channel)
+        valor = self._valores.get(llave)
+        if valor is not None and self._vigente(llave, valor) and self._al_dia(llave, version, consultar=True):
+            return valor, 0.0
+
+        # Un lock por llave para que solicitudes simultáneas no disparen varias cargas
+        with self._lock_de(llave):
+            valor = self._valores.get(llave)
+            if valor is not None and self._vigente(llave, valor) and self._al_dia(llave, version, consultar=True):
+                return valor, 0.0
+            inicio = time.time()
+            # La versión se lee antes de cargar: si entra una ingesta en medio, el valor nace viejo y se recarga
+            version_cargada = self._version_actual(llave)
+            if version is not None and (version_cargada is None or version_cargada < version):
+                version_cargada = version
+            valor = self._construir(llave, version_cargada)
+            self._guardar(llave, valor, version_cargada)
+            return valor, time.time() - inicio
+
+    def refrescar(self, topic, channel):
+        """Recarga la llave si ya estaba residente; si no, se cargará en la siguiente consulta."""
+        llave = self.llave(topic, channel)
+        if llave not in self._valores:
+            return
+        with self._lock_de(llave):
+            try:
+                version = self._version_actual(llave)
+                self._guardar(llave, self._construir(llave, version), version)
+            except Exception as e:
+                # Si la recarga falla, se descarta para no servir datos viejos
+                logger.error(f"Error refrescando {type(self).__name__} {llave}: {e}")
+                self._valores.pop(llave, None)
+
+    def invalidar(self, topic=None, channel=None):
+        if topic is None:
+            self._valores.clear()
+            self._versiones.clear()
+            return
+        self._valores.pop(self.llave(topic, channel), None)
+        self._versiones.pop(self.llave(topic, channel), None)
+
+
+class CacheIndices(_CacheResidente):
+    """
+    Un IndiceEmbeddings por (topic, channel).
+    `cargador(topic, channel)` debe regresar un iterable de filas con id, text y embedding,
+    solo del modelo `modelo` (identificador modelo@dimensión); un snapshot de otro modelo se ignora.
+
+    Con SNAPSHOT_DIR, el índice se abre desde el snapshot publicado (mapeado en memoria y
+    compartido entre workers) y solo se va a BigQuery si la llave no tiene snapshot.
+    Cada worker revisa periódicamente CURRENT y cambia a la versión nueva cuando se publica.
+    """
+
+    def __init__(self, cargador, modelo=None, version_datos=None):
+        super().__init__(cargador, version_datos)
+        self.modelo = modelo
+
+    def _construir(self, llave, version=None):
+        if snapshots.habilitados():
+            leido = snapshots.leer_snapshot(*llave)
+            if leido is not None:
+                version_snapshot, ids, textos, matriz, modelo, version_datos = leido
+                if self.modelo is not None and modelo != self.modelo:
+                    logger.warning(
+                        f"Snapshot {version_snapshot} de {llave} es de {modelo}, no de {self.modelo}; se reconstruye"
+                    )
+                elif version is not None and (version_datos is None or version_datos < version):
+                    # Publicado antes de la última ingesta (p. ej. en otro host): no refleja la tabla
+                    logger.info(f"Snapshot {version_snapshot} de {llave} es de la versión de datos {version_datos}, "
+                                f"se necesita {version}; se reconstruye")
+                else:
+                    indice = IndiceEmbeddings(
+                        ids, textos, matriz, normalizada=True, version=version_snapshot, modelo=modelo
+                    )
+                    logger.info(f"Índice abierto desde snapshot {version_snapshot} para {llave}: {len(indice)} chunks")
+                    return indice
+        return self._construir_desde_origen(llave, version)
+
+    def _construir_desde_origen(self, llave, version_datos=None):
+        filas = list(self._cargador(*llave))
+        ids = [fila["id"] for fila in filas]
+        textos = [fila["text"] for fila in filas]
+        embeddings = [fila["embedding"] for fila in filas]
+        if snapshots.habilitados():
+            try:
+                matriz = normalizar_filas(embeddings) if filas else np.zeros((0, 0), dtype=np.float32)
+                snapshots.publicar_snapshot(
+                    *llave, ids, textos, matriz, modelo=self.modelo, version_datos=version_datos
+                )
+                # Se abre mapeado para compartir las mismas páginas que los demás workers;
+                # con cuantización el re-rank lee del mismo .npy, sin otra copia float32
+                version, ids, textos, matriz, modelo, _ = snapshots.leer_snapshot(*llave)
+                indice = IndiceEmbeddings(ids, textos, matriz, normalizada=True, version=version, modelo=modelo)
+                logger.info(f"Índice cargado para {llave}: {len(indice)} chunks")
+                return indice
+            except Exception as e:
+                # Sin snapshot el worker sigue sirviendo su copia en memoria
+                logger.error(f"No se pudo publicar el snapshot de {llave}: {e}")
+        indice = IndiceEmbeddings(ids, textos, embeddings, modelo=self.modelo)
+        logger.info(f"Índice cargado para {llave}: {len(indice)} chunks")
+        return indice
+
+    def _vigente(self, llave, indice):
+        if not snapshots.habilitados() or indice.version is None:
+            return True
+        ahora = time.time()
+        if ahora - indice.revisado_en < snapshots.SNAPSHOT_REVISION_SEGUNDOS:
+            return True
+        indice.revisado_en = ahora
+        return snapshots.version_actual(*llave) in (None, indice.version)
+
+    def refrescar(self, topic, channel):
+        """
+        Sin snapshots, recarga la llave si ya estaba residente.
+        Con snapshots, la ingesta siempre reconstruye desde BigQuery y publica una versión
+        nueva, para que el resto de los workers cambie a ella.
+        """
+        if not snapshots.habilitados():
+            return super().refrescar(topic, channel)
+        llave = self.llave(topic, channel)
+        with self._lock_de(llave):
+            try:
+                version = self._version_actual(llave)
+                self._guardar(llave, self._construir_desde_origen(llave, version), version)
+            except Exception as e:
+                logger.error(f"Error refrescando {type(self).__name__} {llave}: {e}")
+                self._valores.pop(llave, None)
+
+
+class CacheIntenciones(_CacheResidente):
+    """
+    Mapa intent -> text por (topic, channel), llenado con una sola consulta masiva.
+    `cargador(topic, channel)` debe regresar un iterable de filas con intent, text, name_document
+    y chunk_id, en orden de chunk_id. Si un intent se repite se conserva su primera sección.
+    Con FRAGMENTOS_HABILITADOS la sección es la primera fila más las que le siguen en el mismo
+    documento con chunk_id consecutivo y el mismo intent (los fragmentos de una sección larga,
+    ver app/fragmentacion.py), unidas sin el solapamiento. Sin fragmentación esas filas son secciones
+    distintas con el mismo título y solo se usa la primera, como antes.
+    """
+
+    def _construir(self, llave, version=None):
+        secciones = {}
+        for fila in self._cargador(*llave):
+            seccion = secciones.get(fila["intent"])
+            if seccion is None:
+                secciones[fila["intent"]] = [fila["name_document"], int(fila["chunk_id"]), [fila["text"]]]
+            elif (
+                FRAGMENTOS_HABILITADOS
+                and seccion[0] == fila["name_document"]
+                and int(fila["chunk_id"]) == seccion[1] + 1
+            ):
+                seccion[1] += 1
+                seccion[2].append(fila["text"])
+        mapa = {
+            intent: textos[0] if len(textos) == 1 else unir_fragmentos(textos)
+            for intent, (_, _, textos) in secciones.items()
+        }
+        logger.info(f"Intenciones cargadas para {llave}: {len(mapa)}")
+        return mapa
@@ -1,41 +1,139 @@
+import time
+
+_inicio_imports = time.perf_counter()
+
 from xmlrpc.client import boolean
-from fastapi import FastAPI
-from pydantic import BaseModel
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 from app.extractor import extraer_texto_con_intenciones, extraer_texto_con_intenciones_beta
 from app.bigquery import insertar_chunks_en_bigquery, insertar_chunks_en_bigquery_beta
+from app.indice import CacheIndices, CacheIntenciones
+from app.ranking_bigquery import MODOS_RANKING, buscar_top_k_en_bigquery
+from app.concurrencia import ejecutar, cerrar_executors
+from app.pipeline import procesar_lote, resolver_documentos
+from app.embeddings import generar_embeddings_en_lotes
+from app.pasarela_embeddings import PRIORIDAD_BUSQUEDA, PRIORIDAD_INGESTA, embeber, obtener_pasarela
+from app.modelos import CONDICION_MODELO_SQL, modelo_activo, parametros_modelo
+from app.cache_resultados import RESULTADOS_CACHE_HABILITADA, normalizar_consulta, obtener_cache_resultados
+from app.respuestas_precalculadas import PRECALCULO_HABILITADO, obtener_respuestas_precalculadas
+from app.trabajos import ColaLlena, Trabajadores, obtener_cola
+from app.metricas import (
+    DURACION_SOLICITUDES,
+    ETAPA_BIGQUERY_CONSULTA,
+    ETAPA_EMBEDDINGS,
+    ETAPA_RANKING,
+    EVENTOS,
+    METRICAS_SERVER_TIMING,
+    exponer,
+    iniciar_solicitud,
+    server_timing,
+    span,
+    terminar_solicitud,
+)
+from app.clientes import (
+    TIEMPOS_ARRANQUE,
+    calentar,
+    obtener_bq_client,
+    obtener_redis,
+    registrar_tiempo,
+)
+import asyncio
+import logging
 import os
 from dotenv import load_dotenv
 from google.cloud import bigquery
-from vertexai.language_models import TextEmbeddingModel
-import numpy as np
 from google.api_core.exceptions import GoogleAPICallError
-import time
-import redis
+
+registrar_tiempo("imports_app_main", time.perf_counter() - _inicio_imports)
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
 
+@app.middleware("http")
+async def medir_solicitud(request: Request, call_next):
+    """Duración por ruta y, si METRICAS_SERVER_TIMING está activo, el desglose por etapa en Server-Timing."""
+    token = iniciar_solicitud()
+    inicio = time.perf_counter()
+    codigo = 500
+    try:
+        response = await call_next(request)
+        codigo = response.status_code
+    finally:
+        etapas = terminar_solicitud(token)
+        ruta = request.scope.get("route")
+        # La plantilla de la ruta (no la URL) mantiene acotado el número de series
+        DURACION_SOLICITUDES.observar(
+            time.perf_counter() - inicio,
+            ruta=ruta.path if ruta is not None else "desconocida",
+            metodo=request.method,
+            codigo=codigo,
+        )
+    if METRICAS_SERVER_TIMING and etapas:
+        response.headers["Server-Timing"] = server_timing(etapas)
+    return response
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Histogramas por etapa y por ruta, y contadores, en formato de texto de Prometheus."""
+    return PlainTextResponse(exponer(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/embeddings/pasarela")
+def estado_pasarela_embeddings():
+    """Límite de concurrencia actual, llamadas en vuelo y en espera por prioridad."""
+    return obtener_pasarela().estado()
+
+
+@app.get("/precalculadas")
+async def estado_precalculadas(topic: str, channel: str):
+    """Preguntas frecuentes del (topic, channel) con respuesta precalculada y si el conjunto sigue vigente."""
+    conjunto = await ejecutar(
+        "redis", obtener_respuestas_precalculadas().obtener, topic, channel, modelo_activo().identificador
+    )
+    return conjunto.resumen()
+
+
 @app.post("/procesar-documento/")
-def procesar_documento(documento: str, topic: str, carga: boolean, channel : str, beta: boolean):
+async def procesar_documento(documento: str, topic: str, carga: boolean, channel : str, beta: boolean, modo_escritura: Optional[str] = None):
     """Extrae el texto del documento, asigna subintenciones y lo almacena en BigQuery"""
 
-    parrafos_con_intenciones = extraer_texto_con_intenciones(documento)
+    # Descarga + parseo del PDF fuera del event loop
+    parrafos_con_intenciones = await ejecutar("extraccion", extraer_texto_con_intenciones, documento)
     total_extraidos = len(parrafos_con_intenciones)
     total_insertados = 0
+    embedding_cache = {"hits": 0, "misses": 0}
+    cambios = None
     
     if carga:
         if beta:
-            total_insertados = insertar_chunks_en_bigquery_beta(parrafos_con_intenciones, documento, topic, channel)
+            resultado = await ejecutar("ingesta", insertar_chunks_en_bigquery_beta, parrafos_con_intenciones, documento, topic, channel, modo_escritura=modo_escritura)
         else:   
-            total_insertados = insertar_chunks_en_bigquery(parrafos_con_intenciones, documento, topic, channel)
-    
-    print("###### PARRAFOS CON INTENCIONS COMPLETAS ####")
-    print(parrafos_con_intenciones)
-    
+            resultado = await ejecutar("ingesta", insertar_chunks_en_bigquery, parrafos_con_intenciones, documento, topic, channel, modo_escritura=modo_escritura)
+        total_insertados = resultado["total_insertados"]
+        embedding_cache = resultado["embedding_cache"]
+        # Solo en modo_escritura="incremental": nuevos, modificados, movidos, eliminados, sin_cambios
+        cambios = resultado.get("cambios")
+        EVENTOS.incrementar(total_insertados, evento="filas_insertadas")
+        # Primero se sube la versión de datos (las demás instancias recargan su copia residente)
+        # y luego se refresca la de este worker, que queda marcada con la versión nueva
+        await invalidar_resultados(topic, channel)
+        await asyncio.gather(
+            ejecutar("bigquery", indices.refrescar, topic, channel),
+            ejecutar("bigquery", intenciones.refrescar, topic, channel),
+        )
+        await precalcular(topic, channel)
+
     return {
         "mensaje": f"{total_extraidos} chunks extraídos",
         "total_extraidos": total_extraidos,
         "total_insertados_bigquery": total_insertados if carga else 0,
+        "embedding_cache": embedding_cache,
+        "cambios": cambios,
         "carga_habilitada": carga,
         "modo_beta": beta,
         "topic": topic,
@@ -43,79 +141,449 @@ def procesar_documento(documento: str, topic: str, carga: boolean, channel : str
     }
 
 
+# Modelo de datos para la ingesta por lotes
+class BatchIngestRequest(BaseModel):
+    documentos: List[str] = []
+    prefijo: Optional[str] = None
+    topic: str
+    channel: str
+    carga: bool = True
+    # Hilos por etapa: descarga, extraccion, embeddings, insercion
+    trabajadores: Optional[Dict[str, int]] = None
+
+
+@app.post("/procesar-documentos/")
+async def procesar_documentos(request: BatchIngestRequest):
+    """Ingesta varios documentos (lista de blobs y/o prefijo de GCS) con un pipeline por etapas"""
+    try:
+        documentos = await ejecutar("gcs", resolver_documentos, request.documentos, request.prefijo)
+        if not documentos:
+            return {"error": "No hay documentos: indica 'documentos' o un 'prefijo' con PDFs"}
+
+        inicio = time.time()
+        resultados = await ejecutar(
+            "ingesta", procesar_lote, documentos, request.topic, request.channel, request.carga, request.trabajadores
+        )
+        tiempo_total = time.time() - inicio
+
+        if request.carga:
+            await invalidar_resultados(request.topic, request.channel)
+            await asyncio.gather(
+                ejecutar("bigquery", indices.refrescar, request.topic, request.channel),
+                ejecutar("bigquery", intenciones.refrescar, request.topic, request.channel),
+            )
+            await precalcular(request.topic, request.channel)
+
+        return {
+            "total_documentos": len(resultados),
+            "total_con_error": sum(1 for r in resultados if r["error"]),
+            "total_insertados_bigquery": sum(r["total_insertados_bigquery"] for r in resultados),
+            "tiempo_total": tiempo_total,
+            "topic": request.topic,
+            "channel": request.channel,
+            "documentos": resultados,
+        }
+    except GoogleAPICallError as e:
+        return {"error": f"Error al consultar GCS: {str(e)}"}
+    except Exception as e:
+        return {"error": f"Error inesperado: {str(e)}"}
+
+
+# Modelo de datos para la ingesta en segundo plano
+class IngestJobRequest(BaseModel):
+    documento: str
+    topic: str
+    channel: str
+    carga: bool = True
+    beta: bool = False
+    modo_escritura: Optional[str] = None
+
+
+def ingestar_documento(parametros, progreso):
+    """Mismas etapas que /procesar-documento/, corridas por un trabajador de la cola con progreso persistido."""
+    documento, topic, channel = parametros["documento"], parametros["topic"], parametros["channel"]
+    with progreso.etapa("extraccion"):
+        parrafos = extraer_texto_con_intenciones(documento)
+    progreso.actualizar(total_extraidos=len(parrafos))
+
+    resultado = {"total_extraidos": len(parrafos), "total_insertados_bigquery": 0}
+    if parametros.get("carga", True):
+        insertar = insertar_chunks_en_bigquery_beta if parametros.get("beta") else insertar_chunks_en_bigquery
+        with progreso.etapa("insercion"):
+            insercion = insertar(parrafos, documento, topic, channel, modo_escritura=parametros.get("modo_escritura"))
+        EVENTOS.incrementar(insercion["total_insertados"], evento="filas_insertadas")
+        resultado.update(
+            total_insertados_bigquery=insercion["total_insertados"],
+            embedding_cache=insercion["embedding_cache"],
+            cambios=insercion.get("cambios"),
+        )
+        progreso.actualizar(total_insertados=insercion["total_insertados"])
+
+        with progreso.etapa("refresco"):
+            try:
+                obtener_cache_resultados().invalidar(topic, channel)
+            except Exception as e:
+                logger.warning(f"No se pudo invalidar la caché de resultados de ({topic}, {channel}): {e}")
+            indices.refrescar(topic, channel)
+            intenciones.refrescar(topic, channel)
+        if PRECALCULO_HABILITADO:
+            with progreso.etapa("precalculo"):
+                try:
+                    recalcular_precalculadas(topic, channel)
+                except Exception:
+                    logger.exception(f"No se pudieron precalcular las respuestas de ({topic}, {channel})")
+    return resultado
+
+
+# Si es false este proceso solo encola; los trabajos los procesa otro proceso con la misma TRABAJOS_DB_PATH
+TRABAJOS_HABILITADOS = os.getenv("TRABAJOS_HABILITADOS", "true").lower() == "true"
+trabajadores = None
+
+
+@app.post("/trabajos/ingesta", status_code=202)
+async def encolar_ingesta(request: IngestJobRequest):
+    """Encola la ingesta de un documento y regresa el id del trabajo de inmediato; 429 si la cola está llena."""
+    try:
+        trabajo_id, posicion = await ejecutar("trabajos", obtener_cola().encolar, "ingesta", request.dict())
+    except ColaLlena as e:
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "30"})
+    return {"job_id": trabajo_id, "estado": "en_cola", "posicion": posicion}
+
+
+@app.get("/trabajos/{trabajo_id}")
+async def estado_trabajo(trabajo_id: str):
+    """Estado, etapa actual, conteos de chunks, tiempos por etapa y resultado del trabajo."""
+    trabajo = await ejecutar("trabajos", obtener_cola().obtener, trabajo_id)
+    if trabajo is None:
+        return JSONResponse(status_code=404, content={"error": f"No existe el trabajo '{trabajo_id}'"})
+    return trabajo
+
+
+@app.get("/trabajos")
+async def listar_trabajos(estado: Optional[str] = None, limite: int = 50):
+    cola = obtener_cola()
+    trabajos = await ejecutar("trabajos", cola.listar, estado, limite)
+    return {"conteos": await ejecutar("trabajos", cola.conteos), "trabajos": trabajos}
+
+
 # Modelo de datos para la búsqueda
 class SearchRequest(BaseModel):
     question: str
     intent: str
     topic: str
     channel: str
+    # "local", "bigquery" o "vector_search"; si no viene se usa RANKING_MODE
+    ranking: Optional[str] = None
+    # Listas del IVF a revisar (solo aplica a llaves con índice aproximado); default ANN_NPROBE
+    nprobe: Optional[int] = None
+
+
+# Máximo de resultados por pregunta en /buscar/batch; /buscar/ siempre regresa 5
+BUSCAR_BATCH_MAX_K = int(os.getenv("BUSCAR_BATCH_MAX_K", 5))
+
+
+# Modelo de datos para la búsqueda por lotes
+class BatchSearchItem(BaseModel):
+    question: str
+    topic: str
+    channel: str
+
+
+class BatchSearchRequest(BaseModel):
+    questions: List[BatchSearchItem]
+    k: int = Field(5, ge=1, le=BUSCAR_BATCH_MAX_K)
+    nprobe: Optional[int] = None
 
 
 # Configuración para la búsqueda: BigQuery y modelo de embeddings
 PROJECT_ID = os.getenv("PROJECT_ID")
 DATASET_ID = os.getenv("DATASET_ID")
 TABLE_ID = os.getenv("TABLE_ID")
+RANKING_MODE = os.getenv("RANKING_MODE", "local")
+# Llaves a precargar al arrancar, p. ej. "pensiones:web;pensiones:whatsapp"
+WARMUP_KEYS = os.getenv("WARMUP_KEYS", "")
 
-bq_client = bigquery.Client()
-embedding_model = TextEmbeddingModel.from_pretrained("textembedding-gecko")
+# Las preguntas se embeben con el mismo modelo y dimensión que los chunks (app/modelos.py)
+# Si es true, los clientes se crean al arrancar y no en la primera solicitud
+WARMUP_CLIENTES = os.getenv("WARMUP_CLIENTES", "false").lower() == "true"
+
+
+def cargar_filas_indice(topic, channel):
+    """
+    Descarga los embeddings de un (topic, channel) para construir su índice residente.
+    Solo las filas del modelo activo: las de otro modelo o dimensión no son comparables con la pregunta.
+    """
+    query = f"""
+        SELECT id, text, embedding
+        FROM `{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}`
+        WHERE is_repeat = 'N' AND topic = @topic AND channel = @channel
+          AND {CONDICION_MODELO_SQL}
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("topic", "STRING", topic),
+            bigquery.ScalarQueryParameter("channel", "STRING", channel),
+        ]
+        + parametros_modelo(modelo_activo())
+    )
+    with span(ETAPA_BIGQUERY_CONSULTA):
+        return obtener_bq_client().query(query, job_config=job_config).result()
+
+
+def cargar_filas_intenciones(topic, channel):
+    """Descarga en una sola consulta todos los (intent, text) de un (topic, channel), con su documento y chunk_id."""
+    query = f"""
+        SELECT intent, text, name_document, chunk_id
+        FROM `{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}`
+        WHERE topic = @topic AND channel = @channel
+        ORDER BY chunk_id, name_document
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("topic", "STRING", topic),
+            bigquery.ScalarQueryParameter("channel", "STRING", channel),
+        ]
+    )
+    with span(ETAPA_BIGQUERY_CONSULTA):
+        return obtener_bq_client().query(query, job_config=job_config).result()
+
+
+def version_datos(topic, channel):
+    """Versión de datos del (topic, channel): la de la caché de resultados, que sube con cada ingesta."""
+    return obtener_cache_resultados().version(topic, channel)
+
+
+indices = CacheIndices(cargar_filas_indice, modelo=modelo_activo().identificador, version_datos=version_datos)
+intenciones = CacheIntenciones(cargar_filas_intenciones, version_datos=version_datos)
+
+
+def precargar_llaves():
+    """Precarga índices e intenciones de las llaves en WARMUP_KEYS para que la primera consulta no pague la carga."""
+    for par in filter(None, (p.strip() for p in WARMUP_KEYS.split(";"))):
+        topic, _, channel = par.partition(":")
+        try:
+            inicio = time.perf_counter()
+            indices.obtener(topic, channel)
+            intenciones.obtener(topic, channel)
+            registrar_tiempo(f"indice:{topic}:{channel}", time.perf_counter() - inicio)
+        except Exception:
+            logger.exception(f"No se pudo precargar {par}")
+
+
+@app.on_event("startup")
+def arrancar():
+    """Solo precarga lo configurado; el resto se crea con la primera solicitud que lo necesite."""
+    global trabajadores
+    if WARMUP_CLIENTES:
+        calentar(modelos=[modelo_activo().nombre])
+    precargar_llaves()
+    if TRABAJOS_HABILITADOS:
+        trabajadores = Trabajadores(obtener_cola(), {"ingesta": ingestar_documento})
+        trabajadores.iniciar()
+
+
+@app.post("/warmup")
+async def warmup():
+    """Hook de calentamiento (p. ej. startup probe de Cloud Run): clientes, modelo de búsqueda e índices de WARMUP_KEYS."""
+    await ejecutar("bigquery", calentar, [modelo_activo().nombre])
+    await ejecutar("bigquery", precargar_llaves)
+    return {"tiempos_arranque": dict(TIEMPOS_ARRANQUE)}
+
+
+@app.get("/tiempos-arranque")
+def tiempos_arranque():
+    """Desglose de lo que costó importar y crear cada cliente, modelo e índice precargado."""
+    return {"tiempos_arranque": dict(TIEMPOS_ARRANQUE)}
+
+
+@app.on_event("shutdown")
+def liberar_executors():
+    if trabajadores is not None:
+        trabajadores.detener()
+    cerrar_executors()
+
+
+async def invalidar_resultados(topic, channel):
+    """Las respuestas cacheadas del (topic, channel) dejan de servirse en todas las instancias."""
+    try:
+        await ejecutar("redis", obtener_cache_resultados().invalidar, topic, channel)
+    except Exception as e:
+        logger.warning(f"No se pudo invalidar la caché de resultados de ({topic}, {channel}): {e}")
+
+
+async def precalcular(topic, channel):
+    """Recalcula el top-k de las preguntas frecuentes del (topic, channel) con los datos recién ingestados."""
+    if not PRECALCULO_HABILITADO:
+        return
+    try:
+        await ejecutar("ingesta", recalcular_precalculadas, topic, channel)
+    except Exception:
+        logger.exception(f"No se pudieron precalcular las respuestas de ({topic}, {channel})")
+
+
+def recalcular_precalculadas(topic, channel):
+    """Top-k de las preguntas más frecuentes con el índice residente, igual que lo calcularía /buscar/."""
+    # La versión se lee antes que el índice: si otra ingesta entra en medio, el conjunto nace obsoleto y se recalcula
+    version = version_datos(topic, channel)
+    indice, _ = indices.obtener(topic, channel, version)
+    return obtener_respuestas_precalculadas().recalcular(
+        topic,
+        channel,
+        version,
+        indice,
+        lambda preguntas: embeber_preguntas(preguntas, prioridad=PRIORIDAD_INGESTA),
+        modelo_activo().identificador,
+        k=5,
+    )
+
+
+async def conjunto_precalculado(topic, channel):
+    """Respuestas precalculadas vigentes del (topic, channel), o None; si están obsoletas se recalculan en segundo plano."""
+    precalculadas = obtener_respuestas_precalculadas()
+    conjunto = precalculadas.residente(topic, channel)
+    if conjunto is None:
+        try:
+            conjunto = await ejecutar("redis", precalculadas.obtener, topic, channel, modelo_activo().identificador)
+        except Exception as e:
+            logger.warning(f"Respuestas precalculadas no disponibles: {e}")
+            return None
+        if conjunto.renovar:
+            EVENTOS.incrementar(evento="precalculo_obsoleto" if not conjunto.vigente else "precalculo_renovacion")
+            precalculadas.programar(topic, channel, recalcular_precalculadas)
+    return conjunto if conjunto.vigente else None
+
+
+def respuesta_precalculada(request, entrada, coincidencia):
+    EVENTOS.incrementar(evento=f"precalculo_{coincidencia}")
+    return {
+        "response": entrada["response"],
+        "knowledge_domain": request.topic,
+        "transactional_or_non_transactional": "non_transactional",
+        "time_execution": 0.0,
+        "query_time_execution": 0.0,
+        "precomputed": coincidencia,
+    }
+
+
+def rankear(indice, embedding, k, nprobe):
+    with span(ETAPA_RANKING):
+        return indice.buscar(embedding, k=k, nprobe=nprobe, modelo=modelo_activo().identificador)
+
+
+def rankear_lote(indice, embeddings, k, nprobe):
+    with span(ETAPA_RANKING):
+        return indice.buscar_lote(embeddings, k=k, nprobe=nprobe, modelo=modelo_activo().identificador)
+
+
+def embeber_pregunta(question):
+    with span(ETAPA_EMBEDDINGS):
+        return embeber(modelo_activo(), [question], prioridad=PRIORIDAD_BUSQUEDA)[0].values
 
 
 # Endpoint para buscar la respuesta a partir de una pregunta, intención y subintención
 @app.post("/buscar/")
-def buscar(request: SearchRequest):
+async def buscar(request: SearchRequest):
+    """
+    Sirve la respuesta desde la caché compartida de resultados si existe; si no, la calcula
+    una sola vez aunque lleguen varias consultas idénticas al mismo tiempo.
     """
+    if PRECALCULO_HABILITADO and not request.intent:
+        obtener_respuestas_precalculadas().registrar(request.topic, request.channel, request.question)
+
+    if not RESULTADOS_CACHE_HABILITADA:
+        return await calcular_busqueda(request)
+
+    if request.intent:
+        # Con intent la respuesta no depende de la pregunta
+        partes = ("intent", request.intent)
+    else:
+        # La pregunta no distingue mayúsculas; con otro modelo o dimensión el ranking cambia
+        partes = (
+            "semantica",
+            normalizar_consulta(request.question),
+            request.ranking or RANKING_MODE,
+            request.nprobe,
+            modelo_activo().identificador,
+        )
+    respuesta, origen = await obtener_cache_resultados().obtener_o_calcular(
+        request.topic,
+        request.channel,
+        partes,
+        lambda version: calcular_busqueda(request, version),
+        cacheable=lambda r: "error" not in r,
+    )
+    EVENTOS.incrementar(evento=f"cache_resultados_{origen}")
+    return {**respuesta, "result_cache": origen}
+
+
+async def calcular_busqueda(request: SearchRequest, version=None):
+    """
+    `version` es la versión de datos con la que la caché de resultados guardará la respuesta:
+    los índices residentes más viejos que ella se recargan antes de rankear.
+
     1. Si el intent es nulo o vacío, busca todas las filas con el topic y realiza la comparación de embeddings.
     2. Si el intent no es nulo ni vacío, busca la fila que coincida con el intent, topic y channel.
     """
     try:
         # Verificar si el intent es nulo o vacío
         if not request.intent:
-            # Convertir la pregunta a embedding
-            question_embedding = embedding_model.get_embeddings([request.question])[
-                0
-            ].values
-            start_time_query = time.time() 
-            # Construir la consulta filtrando solo por topic
-            query = f"""
-                SELECT id, name_document, text, embedding
-                FROM `{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}`
-                WHERE is_repeat = 'N' AND topic = '{request.topic.lower()}' AND channel = '{request.channel.lower()}'
-            """
-            query_job = bq_client.query(query)
-            rows = query_job.result()
-            end_time_query = time.time()  # Fin de la medición
-            time_execution_query = end_time_query - start_time_query
-            # Lista para almacenar similitudes y respuestas
-            similarities = []
-
-            # Función para calcular la similitud coseno
-            def cosine_similarity(vec_a, vec_b):
-                dot = np.dot(vec_a, vec_b)
-                norm_a = np.linalg.norm(vec_a)
-                norm_b = np.linalg.norm(vec_b)
-                return dot / (norm_a * norm_b) if norm_a and norm_b else 0
-
-            start_time = time.time()  # Inicio de la medición
-            # Calcular similitudes para cada fila
-            for row in rows:
-                chunk_embedding = row["embedding"]
-                similarity = cosine_similarity(question_embedding, chunk_embedding)
-                similarities.append(
-                    {
-                        "text": row[
-                            "text"
-                        ],  # Solo almacenamos el texto de la respuesta
-                        "similarity": similarity,
-                    }
+            ranking = request.ranking or RANKING_MODE
+            if ranking not in MODOS_RANKING:
+                return {"error": f"Modo de ranking no soportado: '{ranking}'"}
+
+            if ranking == "local":
+                # Las respuestas precalculadas se rankearon igual: índice local con el nprobe por default
+                conjunto = None
+                if PRECALCULO_HABILITADO and request.nprobe is None:
+                    conjunto = await conjunto_precalculado(request.topic, request.channel)
+                    entrada = conjunto.por_forma(request.question) if conjunto is not None else None
+                    if entrada is not None:
+                        # Misma pregunta salvo mayúsculas, acentos y signos: ni Vertex ni ranking
+                        return respuesta_precalculada(request, entrada, "exacta")
+
+                indice = indices.residente(request.topic, request.channel, version)
+                if indice is not None:
+                    time_execution_query = 0.0
+                    question_embedding = await ejecutar("vertex", embeber_pregunta, request.question)
+                else:
+                    # Se embebe la pregunta mientras se carga el índice del (topic, channel)
+                    question_embedding, (indice, time_execution_query) = await asyncio.gather(
+                        ejecutar("vertex", embeber_pregunta, request.question),
+                        ejecutar("bigquery", indices.obtener, request.topic, request.channel, version),
+                    )
+
+                entrada = conjunto.por_similitud(question_embedding) if conjunto is not None else None
+                if entrada is not None:
+                    # Pregunta casi igual a una frecuente: se omite el ranking
+                    return respuesta_precalculada(request, entrada, "similar")
+
+                start_time = time.time()  # Inicio de la medición
+                # Un solo producto matriz-vector + top-k con argpartition, fuera del event loop
+                top = await ejecutar("ranking", rankear, indice, question_embedding, 5, request.nprobe)
+                end_time = time.time()  # Fin de la medición
+                time_execution = end_time - start_time
+
+                top_responses = [indice.textos[posicion] for posicion, _ in top]
+            else:
+                # Ranking en servidor: BigQuery calcula la similitud y solo regresa los top-k
+                question_embedding = await ejecutar("vertex", embeber_pregunta, request.question)
+                start_time_query = time.time()
+                top = await ejecutar(
+                    "bigquery",
+                    buscar_top_k_en_bigquery,
+                    obtener_bq_client(),
+                    f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}",
+                    question_embedding,
+                    request.topic,
+                    request.channel,
+                    k=5,
+                    modo=ranking,
+                    modelo=modelo_activo(),
                 )
-            end_time = time.time()  # Fin de la medición
-            time_execution = end_time - start_time
-            # print("Tiempo de ejecución:", end_time - start_time, "segundos")
-            # Ordenar por similitud (de mayor a menor)
-            similarities.sort(key=lambda x: x["similarity"], reverse=True)
+                time_execution_query = time.time() - start_time_query
+                time_execution = 0.0
 
-            # Seleccionar el top 3 de respuestas (solo el texto)
-            top_responses = [resp["text"] for resp in similarities[:5]]
+                top_responses = [resp["text"] for resp in top]
 
             # Retornar el top 3 de respuestas
             return {
@@ -123,27 +591,22 @@ def buscar(request: SearchRequest):
                 "knowledge_domain": request.topic,
                 "transactional_or_non_transactional": "non_transactional",
                 "time_execution": time_execution,
-                "query_time_execution" : time_execution_query
+                "query_time_execution" : time_execution_query,
+                "precomputed": None,
             }
         else:
-            # Construir la consulta filtrando por intent, topic y channel
-            query = f"""
-                SELECT id, name_document, text
-                FROM `{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}`
-                WHERE intent = '{request.intent}'
-                  AND topic = '{request.topic}'
-                  AND channel = '{request.channel}'
-            """
-            query_job = bq_client.query(query)
-            rows = query_job.result()
-
-            # Obtener la primera fila (debería ser única)
-            row = next(rows, None)
+            # Mapa residente intent -> text del (topic, channel); se carga con una sola consulta
+            mapa_intenciones = intenciones.residente(request.topic, request.channel, version)
+            if mapa_intenciones is None:
+                mapa_intenciones, _ = await ejecutar(
+                    "bigquery", intenciones.obtener, request.topic, request.channel, version
+                )
+            texto = mapa_intenciones.get(request.intent)
 
             # Retornar la respuesta si se encontró un match
-            if row:
+            if texto is not None:
                 return {
-                    "response": [row["text"]],  # Solo el texto de la respuesta
+                    "response": [texto],  # Solo el texto de la respuesta
                 }
             else:
                 return {
@@ -156,18 +619,81 @@ def buscar(request: SearchRequest):
 
 
 
-REDIS_HOST = os.getenv("REDIS_HOST")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+def embeber_preguntas(preguntas, prioridad=PRIORIDAD_BUSQUEDA):
+    """Embeddings de varias preguntas en la menor cantidad de llamadas que permita el modelo."""
+    modelo = modelo_activo()
+    resultados = generar_embeddings_en_lotes(
+        modelo,
+        preguntas,
+        nombre_modelo=modelo.nombre,
+        prioridad=prioridad,
+    )
+    fallidos = [r for r in resultados if not r.ok]
+    if fallidos:
+        raise Exception(f"Error generando embeddings de {len(fallidos)} preguntas: {fallidos[0].error}")
+    return [r.values for r in resultados]
 
-@app.post("/redis_test")
-def test_redis():
+
+# Endpoint para buscar varias preguntas: una llamada de embeddings y un producto matriz-matriz por (topic, channel)
+@app.post("/buscar/batch")
+async def buscar_batch(request: BatchSearchRequest):
+    """
+    Agrupa las preguntas por (topic, channel), las embebe juntas y las rankea con un solo
+    producto matriz-matriz por grupo. Regresa el top-k de cada pregunta en el orden recibido.
+    """
     try:
-        r = redis.Redis(
-            host='10.128.238.245',
-            port=6379,
-            socket_timeout=25
+        if not request.questions:
+            return {"results": []}
+
+        grupos = {}
+        for posicion, item in enumerate(request.questions):
+            grupos.setdefault(CacheIndices.llave(item.topic, item.channel), []).append(posicion)
+
+        # Las preguntas se embeben mientras se cargan los índices que no están residentes
+        inicio = time.time()
+        embeddings, cargas = await asyncio.gather(
+            ejecutar("vertex", embeber_preguntas, [item.question for item in request.questions]),
+            asyncio.gather(*(ejecutar("bigquery", indices.obtener, *llave) for llave in grupos)),
         )
-        r.ping()  # Prueba de conexión
+        tiempo_embeddings_y_carga = time.time() - inicio
+
+        resultados = [None] * len(request.questions)
+        inicio = time.time()
+        # Un producto matriz-matriz por grupo, los grupos en paralelo en el pool de ranking
+        tops_por_grupo = await asyncio.gather(*(
+            ejecutar("ranking", rankear_lote, indice, [embeddings[p] for p in posiciones], request.k, request.nprobe)
+            for posiciones, (indice, _) in zip(grupos.values(), cargas)
+        ))
+        for posiciones, (indice, _), tops in zip(grupos.values(), cargas, tops_por_grupo):
+            for posicion, top in zip(posiciones, tops):
+                resultados[posicion] = {
+                    "question": request.questions[posicion].question,
+                    "knowledge_domain": request.questions[posicion].topic,
+                    "response": [indice.textos[i] for i, _ in top],
+                    "similarities": [similitud for _, similitud in top],
+                }
+        tiempo_ranking = time.time() - inicio
+
+        return {
+            "results": resultados,
+            "total_questions": len(resultados),
+            "total_groups": len(grupos),
+            "time_embedding_and_load": tiempo_embeddings_y_carga,
+            "query_time_execution": sum(segundos for _, segundos in cargas),
+            "time_execution": tiempo_ranking,
+        }
+    except GoogleAPICallError as e:
+        return {"error": f"Error al consultar BigQuery: {str(e)}"}
+    except Exception as e:
+        return {"error": f"Error inesperado: {str(e)}"}
+
+
+
+@app.post("/redis_test")
+async def test_redis():
+    try:
+        # Mismo cliente con pool que usa la caché de resultados (REDIS_HOST / REDIS_PORT)
+        await ejecutar("redis", lambda: obtener_redis().ping())  # Prueba de conexión
         return "✅ Redis is reachable from Cloud Run!"
     except Exception as e:
         return f"❌ Redis connection failed: {str(e)}"
\ No newline at end of file
@@ -0,0 +1,181 @@
+import os
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración
+# ==============================
+# Agrega el header Server-Timing con las etapas medidas en cada respuesta
+METRICAS_SERVER_TIMING = os.getenv("METRICAS_SERVER_TIMING", "false").lower() == "true"
+# Etapas más lentas que esto se registran con logger.warning (0 = nunca)
+METRICAS_UMBRAL_LENTO_SEGUNDOS = float(os.getenv("METRICAS_UMBRAL_LENTO_SEGUNDOS", 0))
+
+PREFIJO = "service_retrieval_"
+# Límites superiores de los buckets en segundos (de 1 ms a 2 min)
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Etapas instrumentadas
+ETAPA_GCS_METADATOS = "gcs_metadatos"
+ETAPA_GCS_DESCARGA = "gcs_descarga"
+ETAPA_PDF_PARSEO = "pdf_parseo"
+ETAPA_DETECCION_TITULOS = "deteccion_titulos"
+ETAPA_EMBEDDINGS = "embeddings"
+ETAPA_BIGQUERY_CONSULTA = "bigquery_consulta"
+ETAPA_BIGQUERY_INSERCION = "bigquery_insercion"
+ETAPA_RANKING = "ranking"
+
+# Etapas medidas durante la solicitud HTTP actual: [(etapa, segundos)]
+_etapas_solicitud = contextvars.ContextVar("etapas_solicitud", default=None)
+
+
+class Histograma:
+    """Histograma acumulativo estilo Prometheus con una serie por combinación de etiquetas."""
+
+    def __init__(self, nombre, ayuda, etiquetas, buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **etiquetas):
+        llave = tuple(str(etiquetas.get(e, "")) for e in self.etiquetas)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(llave)
+            if serie is None:
+                serie = self._series[llave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = [(llave, list(conteos), suma, total) for llave, (conteos, suma, total) in self._series.items()]
+        for llave, conteos, suma, total in sorted(series):
+            base = _etiquetas(self.etiquetas, llave)
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + ("+Inf",), conteos):
+                acumulado += conteo
+                lineas.append(f'{self.nombre}_bucket{{{base}{"," if base else ""}le="{limite}"}} {acumulado}')
+            lineas.append(f"{self.nombre}_sum{{{base}}} {suma}")
+            lineas.append(f"{self.nombre}_count{{{base}}} {total}")
+        return lineas
+
+
+class Contador:
+    """Contador monotónico con una serie por combinación de etiquetas."""
+
+    def __init__(self, nombre, ayuda, etiquetas):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, valor=1, **etiquetas):
+        llave = tuple(str(etiquetas.get(e, "")) for e in self.etiquetas)
+        with self._lock:
+            self._series[llave] = self._series.get(llave, 0) + valor
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for llave, valor in series:
+            lineas.append(f"{self.nombre}{{{_etiquetas(self.etiquetas, llave)}}} {valor}")
+        return lineas
+
+
+class Indicador:
+    """Gauge cuyo valor se lee al exponer: `leer()` regresa {tupla_de_etiquetas: valor}."""
+
+    def __init__(self, nombre, ayuda, etiquetas, leer):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._leer = leer
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} gauge"]
+        for llave, valor in sorted(self._leer().items()):
+            lineas.append(f"{self.nombre}{{{_etiquetas(self.etiquetas, llave)}}} {valor}")
+        return lineas
+
+
+def _etiquetas(nombres, valores):
+    escapar = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{n}="{escapar(v)}"' for n, v in zip(nombres, valores))
+
+
+DURACION_ETAPAS = Histograma(
+    PREFIJO + "etapa_segundos", "Duración de cada etapa de ingesta y búsqueda", ("etapa", "estado")
+)
+DURACION_SOLICITUDES = Histograma(
+    PREFIJO + "solicitud_segundos", "Duración de las solicitudes HTTP", ("ruta", "metodo", "codigo")
+)
+EVENTOS = Contador(PREFIJO + "eventos_total", "Eventos contados (aciertos de caché, filas insertadas, ...)", ("evento",))
+
+_registro = [DURACION_ETAPAS, DURACION_SOLICITUDES, EVENTOS]
+
+
+def registrar(metrica):
+    """Agrega una métrica propia de otro módulo a la salida de /metrics."""
+    _registro.append(metrica)
+    return metrica
+
+
+@contextmanager
+def span(etapa):
+    """Mide un bloque: lo observa en el histograma de etapas y lo anota en la solicitud actual."""
+    inicio = time.perf_counter()
+    estado = "ok"
+    try:
+        yield
+    except BaseException:
+        estado = "error"
+        raise
+    finally:
+        segundos = time.perf_counter() - inicio
+        DURACION_ETAPAS.observar(segundos, etapa=etapa, estado=estado)
+        etapas = _etapas_solicitud.get()
+        if etapas is not None:
+            etapas.append((etapa, segundos))
+        if METRICAS_UMBRAL_LENTO_SEGUNDOS and segundos > METRICAS_UMBRAL_LENTO_SEGUNDOS:
+            logger.warning(f"Etapa lenta: {etapa} tardó {segundos:.3f}s")
+
+
+def iniciar_solicitud():
+    """Empieza a juntar las etapas de la solicitud actual; regresa el token para terminarla."""
+    return _etapas_solicitud.set([])
+
+
+def terminar_solicitud(token):
+    """Regresa las etapas medidas en la solicitud y deja de juntarlas."""
+    etapas = _etapas_solicitud.get() or []
+    _etapas_solicitud.reset(token)
+    return etapas
+
+
+def server_timing(etapas):
+    """Valor del header Server-Timing; las etapas repetidas se suman."""
+    totales = {}
+    for etapa, segundos in etapas:
+        totales[etapa] = totales.get(etapa, 0.0) + segundos
+    return ", ".join(f"{etapa};dur={segundos * 1000:.1f}" for etapa, segundos in totales.items())
+
+
+def exponer():
+    """Todas las métricas en formato de texto de Prometheus."""
+    lineas = []
+    for metrica in _registro:
+        lineas.extend(metrica.exponer())
+    return "\n".join(lineas) + "\n"
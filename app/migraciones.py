@@ -0,0 +1,57 @@
+import sys
+import json
+import argparse
+import logging
+
+from app.clientes import obtener_bq_client
+
+logger = logging.getLogger(__name__)
+
+# =========================================================
+# Migraciones de esquema de las tablas de chunks
+# =========================================================
+# Se corren una vez por despliegue, antes de que el servicio ingeste o busque con la versión nueva:
+#   python -m app.migraciones
+# La ingesta no altera tablas: en BigQuery un cambio de esquema tarda en verse en las inserciones
+# por streaming, y escribir en la misma llamada que lo hizo puede fallar o descartar campos.
+
+# Columnas con el modelo y la dimensión de cada embedding (ver app/modelos.py)
+COLUMNAS_MODELO = {"embedding_model": "STRING", "embedding_dimension": "INT64"}
+
+
+def agregar_columnas_modelo(table_ref):
+    """Agrega las columnas que falten de COLUMNAS_MODELO (idempotente); regresa las agregadas."""
+    existentes = {campo.name for campo in obtener_bq_client().get_table(table_ref).schema}
+    faltantes = [columna for columna in COLUMNAS_MODELO if columna not in existentes]
+    if faltantes:
+        adiciones = ",\n".join(
+            f"ADD COLUMN IF NOT EXISTS {columna} {COLUMNAS_MODELO[columna]}" for columna in faltantes
+        )
+        obtener_bq_client().query(f"ALTER TABLE `{table_ref}`\n{adiciones}").result()
+        logger.info(f"Columnas agregadas a {table_ref}: {faltantes}")
+    return faltantes
+
+
+# =========================================================
+# CLI: python -m app.migraciones [tablas ...]
+# =========================================================
+def main(argv=None):
+    from app.bigquery import DATASET_ID, PROJECT_ID, TABLE_ID, TABLE_ID_BETA
+
+    parser = argparse.ArgumentParser(description="Aplica las migraciones de esquema de las tablas de chunks")
+    parser.add_argument(
+        "tablas", nargs="*", help="Tablas proyecto.dataset.tabla (default: TABLE_ID y TABLE_ID_BETA)"
+    )
+    args = parser.parse_args(argv)
+
+    tablas = args.tablas or [
+        f"{PROJECT_ID}.{DATASET_ID}.{tabla}" for tabla in (TABLE_ID, TABLE_ID_BETA) if tabla
+    ]
+    if not tablas:
+        parser.error("No hay tablas: indica alguna o configura TABLE_ID / TABLE_ID_BETA")
+    print(json.dumps({tabla: agregar_columnas_modelo(tabla) for tabla in tablas}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
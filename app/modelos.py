@@ -0,0 +1,143 @@
+import os
+import logging
+import threading
+
+import numpy as np
+
+from app.clientes import obtener_modelo_embeddings
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración
+# ==============================
+# Un solo modelo para ingesta y búsqueda: dos vectores solo se comparan si vienen del mismo modelo y dimensión
+EMBEDDING_MODELO = os.getenv("EMBEDDING_MODELO", "gemini-embedding-001")
+# Dimensión de salida; vacío = la nativa del modelo. Cambiarla requiere re-ingestar (las filas viejas dejan de usarse)
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION") or 0) or None
+# Modelo con el que se escribieron las filas anteriores a las columnas embedding_model / embedding_dimension
+EMBEDDING_MODELO_LEGADO = os.getenv("EMBEDDING_MODELO_LEGADO", "gemini-embedding-001")
+
+
+class EspecificacionModelo:
+    """
+    Lo que hay que saber de un modelo de Vertex para usarlo:
+    - dimension_nativa: tamaño del vector completo
+    - output_dimensionality: si la API acepta pedir menos dimensiones (si no, se trunca del lado del cliente)
+    - max_textos: textos por request que acepta
+    """
+
+    def __init__(self, nombre, dimension_nativa, output_dimensionality, max_textos):
+        self.nombre = nombre
+        self.dimension_nativa = dimension_nativa
+        self.output_dimensionality = output_dimensionality
+        self.max_textos = max_textos
+
+
+CATALOGO = {
+    especificacion.nombre: especificacion
+    for especificacion in (
+        # Entrenado con Matryoshka: 768 o 256 dimensiones conservan casi toda la calidad
+        EspecificacionModelo("gemini-embedding-001", 3072, True, 1),
+        EspecificacionModelo("text-embedding-005", 768, True, 250),
+        EspecificacionModelo("text-embedding-004", 768, True, 250),
+        EspecificacionModelo("text-multilingual-embedding-002", 768, True, 250),
+        EspecificacionModelo("textembedding-gecko", 768, False, 250),
+    )
+}
+
+
+class ModeloIncompatible(ValueError):
+    """Se intentó comparar vectores de modelos o dimensiones distintos."""
+
+
+class _Vector:
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values
+
+
+def reducir(values, dimension):
+    """Primeras `dimension` componentes, renormalizadas a norma 1 (válido para modelos Matryoshka)."""
+    vector = np.asarray(values[:dimension], dtype=np.float64)
+    norma = np.linalg.norm(vector)
+    return (vector / norma if norma else vector).tolist()
+
+
+class ModeloEmbeddings:
+    """
+    Un modelo del catálogo a una dimensión de salida. Tiene la misma interfaz que
+    TextEmbeddingModel (get_embeddings), así lo pueden usar la pasarela y los lotes sin cambios.
+    """
+
+    def __init__(self, nombre, dimension=None):
+        especificacion = CATALOGO.get(nombre)
+        if especificacion is None:
+            raise ValueError(f"Modelo de embeddings no registrado: '{nombre}' (disponibles: {', '.join(CATALOGO)})")
+        if dimension is not None and not 0 < dimension <= especificacion.dimension_nativa:
+            raise ValueError(
+                f"Dimensión {dimension} inválida para {nombre} (nativa: {especificacion.dimension_nativa})"
+            )
+        self.especificacion = especificacion
+        self.nombre = nombre
+        self.dimension = dimension or especificacion.dimension_nativa
+        # None con la dimensión nativa; es lo que entra en la llave de la caché de embeddings
+        self.dimension_reducida = self.dimension if self.dimension < especificacion.dimension_nativa else None
+
+    @property
+    def identificador(self):
+        return f"{self.nombre}@{self.dimension}"
+
+    @property
+    def max_textos(self):
+        return self.especificacion.max_textos
+
+    def get_embeddings(self, textos, **kwargs):
+        modelo = obtener_modelo_embeddings(self.nombre)
+        if self.dimension_reducida is None:
+            return modelo.get_embeddings(textos, **kwargs)
+        if self.especificacion.output_dimensionality:
+            kwargs["output_dimensionality"] = self.dimension
+        # Aunque la API ya regrese la dimensión pedida, esos vectores no vienen normalizados
+        return [_Vector(reducir(e.values, self.dimension)) for e in modelo.get_embeddings(textos, **kwargs)]
+
+    def verificar(self, nombre, dimension):
+        """Lanza ModeloIncompatible si (nombre, dimension) no es este modelo."""
+        if (nombre or EMBEDDING_MODELO_LEGADO) != self.nombre or (dimension is not None and int(dimension) != self.dimension):
+            raise ModeloIncompatible(
+                f"Vectores de {nombre or EMBEDDING_MODELO_LEGADO}@{dimension} no se comparan con {self.identificador}"
+            )
+
+
+# Condición SQL que deja solo las filas escritas con el modelo activo; las filas previas a las
+# columnas de modelo cuentan como EMBEDDING_MODELO_LEGADO con la dimensión de su vector
+CONDICION_MODELO_SQL = (
+    "COALESCE(embedding_model, @modelo_legado) = @embedding_model "
+    "AND COALESCE(embedding_dimension, ARRAY_LENGTH(embedding)) = @embedding_dimension"
+)
+
+
+def parametros_modelo(modelo):
+    """Parámetros de CONDICION_MODELO_SQL."""
+    from google.cloud import bigquery
+
+    return [
+        bigquery.ScalarQueryParameter("embedding_model", "STRING", modelo.nombre),
+        bigquery.ScalarQueryParameter("embedding_dimension", "INT64", modelo.dimension),
+        bigquery.ScalarQueryParameter("modelo_legado", "STRING", EMBEDDING_MODELO_LEGADO),
+    ]
+
+
+_activo = None
+_activo_lock = threading.Lock()
+
+
+def modelo_activo():
+    """El modelo configurado (EMBEDDING_MODELO / EMBEDDING_DIMENSION), el mismo para ingesta y búsqueda."""
+    global _activo
+    with _activo_lock:
+        if _activo is None:
+            _activo = ModeloEmbeddings(EMBEDDING_MODELO, EMBEDDING_DIMENSION)
+            logger.info(f"Modelo de embeddings activo: {_activo.identificador}")
+    return _activo
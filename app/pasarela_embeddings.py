@@ -0,0 +1,207 @@
+import os
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+
+from app.metricas import PREFIJO, EVENTOS, Histograma, Indicador, registrar
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración
+# ==============================
+# Presupuesto de requests a Vertex por proceso (token bucket)
+EMBEDDINGS_REQUESTS_POR_SEGUNDO = float(os.getenv("EMBEDDINGS_REQUESTS_POR_SEGUNDO", 10))
+EMBEDDINGS_RAFAGA = int(os.getenv("EMBEDDINGS_RAFAGA", 20))
+# Límites de la concurrencia adaptativa (AIMD)
+EMBEDDINGS_CONCURRENCIA_MAX = int(os.getenv("EMBEDDINGS_CONCURRENCIA_MAX", 16))
+EMBEDDINGS_CONCURRENCIA_MIN = int(os.getenv("EMBEDDINGS_CONCURRENCIA_MIN", 1))
+# Lugares de concurrencia que la ingesta nunca ocupa, para que una búsqueda no espere a un lote
+EMBEDDINGS_RESERVA_BUSQUEDA = int(os.getenv("EMBEDDINGS_RESERVA_BUSQUEDA", 2))
+EMBEDDINGS_REINTENTOS = int(os.getenv("EMBEDDINGS_REINTENTOS", 4))
+EMBEDDINGS_BACKOFF_BASE_SEGUNDOS = float(os.getenv("EMBEDDINGS_BACKOFF_BASE_SEGUNDOS", 0.5))
+EMBEDDINGS_BACKOFF_MAX_SEGUNDOS = float(os.getenv("EMBEDDINGS_BACKOFF_MAX_SEGUNDOS", 20))
+
+# Menor número = se atiende primero
+PRIORIDAD_BUSQUEDA = 0
+PRIORIDAD_INGESTA = 1
+NOMBRES_PRIORIDAD = {PRIORIDAD_BUSQUEDA: "busqueda", PRIORIDAD_INGESTA: "ingesta"}
+
+# Códigos HTTP que vale la pena reintentar; 429 además reduce la concurrencia
+_CODIGOS_CUOTA = {429}
+_CODIGOS_TRANSITORIOS = {500, 502, 503, 504}
+
+
+def es_error_de_cuota(error) -> bool:
+    codigo = getattr(error, "code", None)
+    if codigo in _CODIGOS_CUOTA:
+        return True
+    mensaje = str(error)
+    return "RESOURCE_EXHAUSTED" in mensaje or "Quota exceeded" in mensaje or "429" in mensaje[:20]
+
+
+def es_error_transitorio(error) -> bool:
+    return getattr(error, "code", None) in _CODIGOS_TRANSITORIOS or isinstance(error, (TimeoutError, ConnectionError))
+
+
+class CubetaTokens:
+    """Token bucket: `tasa` tokens por segundo hasta `capacidad`."""
+
+    def __init__(self, tasa, capacidad):
+        self.tasa = tasa
+        self.capacidad = max(1, capacidad)
+        self._tokens = float(self.capacidad)
+        self._actualizado = time.monotonic()
+
+    def tomar(self):
+        """Toma un token y regresa 0, o regresa los segundos que faltan para que haya uno. No es thread-safe."""
+        ahora = time.monotonic()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._actualizado) * self.tasa)
+        self._actualizado = ahora
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.tasa
+
+
+class PasarelaEmbeddings:
+    """
+    Punto único por proceso para llamar a Vertex:
+    - token bucket con el presupuesto de requests por segundo,
+    - concurrencia adaptativa AIMD: +1/límite por llamada exitosa, la mitad ante un error de cuota,
+    - reintentos con backoff exponencial y jitter completo para errores de cuota y transitorios,
+    - cola con prioridad: las búsquedas se atienden antes que la ingesta y tienen lugares reservados.
+    """
+
+    def __init__(self, tasa=None, rafaga=None, concurrencia_max=None, concurrencia_min=None, reserva_busqueda=None,
+                 reintentos=None):
+        self._cubeta = CubetaTokens(tasa or EMBEDDINGS_REQUESTS_POR_SEGUNDO, rafaga or EMBEDDINGS_RAFAGA)
+        self.concurrencia_max = concurrencia_max or EMBEDDINGS_CONCURRENCIA_MAX
+        self.concurrencia_min = concurrencia_min or EMBEDDINGS_CONCURRENCIA_MIN
+        self.reserva_busqueda = EMBEDDINGS_RESERVA_BUSQUEDA if reserva_busqueda is None else reserva_busqueda
+        self.reintentos = EMBEDDINGS_REINTENTOS if reintentos is None else reintentos
+        self._limite = float(self.concurrencia_max)
+        self._en_vuelo = 0
+        self._espera = []
+        self._en_espera = {prioridad: 0 for prioridad in NOMBRES_PRIORIDAD}
+        self._secuencia = itertools.count()
+        self._condicion = threading.Condition()
+
+    # -------------------------
+    # Lugares de concurrencia
+    # -------------------------
+    def _limite_para(self, prioridad):
+        limite = int(self._limite)
+        if prioridad == PRIORIDAD_BUSQUEDA:
+            return limite
+        return max(1, limite - self.reserva_busqueda)
+
+    def _adquirir(self, prioridad):
+        turno = (prioridad, next(self._secuencia))
+        inicio = time.monotonic()
+        with self._condicion:
+            heapq.heappush(self._espera, turno)
+            self._en_espera[prioridad] += 1
+            try:
+                while True:
+                    if self._espera[0] == turno and self._en_vuelo < self._limite_para(prioridad):
+                        faltan = self._cubeta.tomar()
+                        if faltan == 0:
+                            heapq.heappop(self._espera)
+                            self._en_vuelo += 1
+                            # El siguiente en la fila puede tener lugar también
+                            self._condicion.notify_all()
+                            break
+                        EVENTOS.incrementar(evento="embeddings_espera_tokens")
+                        self._condicion.wait(faltan)
+                    else:
+                        self._condicion.wait(0.5)
+            finally:
+                self._en_espera[prioridad] -= 1
+        ESPERA.observar(time.monotonic() - inicio, prioridad=NOMBRES_PRIORIDAD.get(prioridad, prioridad))
+
+    def _liberar(self, exito, limitado):
+        with self._condicion:
+            self._en_vuelo -= 1
+            if limitado:
+                self._limite = max(self.concurrencia_min, self._limite / 2)
+                logger.warning(f"Cuota de Vertex alcanzada: concurrencia de embeddings reducida a {int(self._limite)}")
+            elif exito:
+                self._limite = min(self.concurrencia_max, self._limite + 1 / self._limite)
+            self._condicion.notify_all()
+
+    # -------------------------
+    # Llamadas
+    # -------------------------
+    def llamar(self, fn, *args, prioridad=PRIORIDAD_INGESTA, **kwargs):
+        """Ejecuta `fn(*args, **kwargs)` respetando el presupuesto y reintentando errores de cuota o transitorios."""
+        nombre = NOMBRES_PRIORIDAD.get(prioridad, str(prioridad))
+        for intento in range(self.reintentos + 1):
+            self._adquirir(prioridad)
+            exito = limitado = False
+            try:
+                resultado = fn(*args, **kwargs)
+                exito = True
+                EVENTOS.incrementar(evento=f"embeddings_llamada_{nombre}")
+                return resultado
+            except Exception as e:
+                limitado = es_error_de_cuota(e)
+                if limitado:
+                    EVENTOS.incrementar(evento=f"embeddings_limitado_{nombre}")
+                if not (limitado or es_error_transitorio(e)) or intento == self.reintentos:
+                    EVENTOS.incrementar(evento=f"embeddings_error_{nombre}")
+                    raise
+                error = e
+            finally:
+                self._liberar(exito, limitado)
+
+            # Backoff exponencial con jitter completo
+            espera = random.uniform(0, min(EMBEDDINGS_BACKOFF_MAX_SEGUNDOS, EMBEDDINGS_BACKOFF_BASE_SEGUNDOS * 2 ** intento))
+            EVENTOS.incrementar(evento=f"embeddings_reintento_{nombre}")
+            logger.info(f"Reintento {intento + 1}/{self.reintentos} de embeddings ({nombre}) en {espera:.2f}s: {error}")
+            time.sleep(espera)
+
+    def estado(self):
+        with self._condicion:
+            return {
+                "limite_concurrencia": round(self._limite, 2),
+                "en_vuelo": self._en_vuelo,
+                "en_espera": {NOMBRES_PRIORIDAD[p]: n for p, n in self._en_espera.items()},
+                "tokens_por_segundo": self._cubeta.tasa,
+            }
+
+
+_pasarela = None
+_pasarela_lock = threading.Lock()
+
+
+def obtener_pasarela():
+    global _pasarela
+    with _pasarela_lock:
+        if _pasarela is None:
+            _pasarela = PasarelaEmbeddings()
+    return _pasarela
+
+
+def embeber(embedding_model, textos, prioridad=PRIORIDAD_INGESTA, **kwargs):
+    """`embedding_model.get_embeddings(textos)` a través de la pasarela compartida."""
+    return obtener_pasarela().llamar(embedding_model.get_embeddings, textos, prioridad=prioridad, **kwargs)
+
+
+def _leer_indicadores():
+    if _pasarela is None:
+        return {}
+    estado = _pasarela.estado()
+    valores = {("limite_concurrencia",): estado["limite_concurrencia"], ("en_vuelo",): estado["en_vuelo"]}
+    for nombre, total in estado["en_espera"].items():
+        valores[(f"en_espera_{nombre}",)] = total
+    return valores
+
+
+ESPERA = registrar(Histograma(
+    PREFIJO + "embeddings_espera_segundos", "Espera por un lugar en la pasarela de embeddings", ("prioridad",)
+))
+registrar(Indicador(PREFIJO + "embeddings_pasarela", "Estado de la pasarela de embeddings", ("medida",), _leer_indicadores))
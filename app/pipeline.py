@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+
+from app.extractor import (
+    DetectorCalibriCamelCase,
+    blob_pdf,
+    consultar_cache_extraccion,
+    descargar_blob,
+    guardar_en_cache_extraccion,
+    liberar_descarga,
+    lineas_y_secciones,
+    listar_pdfs,
+)
+from app.bigquery import generar_embeddings_parrafos, insertar_chunks_en_bigquery
+from app.fragmentacion import fragmentar_secciones
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración del pipeline
+# ==============================
+PIPELINE_TRABAJADORES = {
+    "descarga": int(os.getenv("PIPELINE_TRABAJADORES_DESCARGA", 4)),
+    "extraccion": int(os.getenv("PIPELINE_TRABAJADORES_EXTRACCION", 2)),
+    "embeddings": int(os.getenv("PIPELINE_TRABAJADORES_EMBEDDINGS", 2)),
+    "insercion": int(os.getenv("PIPELINE_TRABAJADORES_INSERCION", 2)),
+}
+# Documentos en espera entre una etapa y la siguiente; acota la memoria de PDFs descargados
+PIPELINE_TAMANO_COLA = int(os.getenv("PIPELINE_TAMANO_COLA", 4))
+
+_FIN = object()
+
+
+class ResultadoDocumento:
+    """Estado de un documento dentro del pipeline."""
+
+    def __init__(self, posicion, documento):
+        self.posicion = posicion
+        self.documento = documento
+        self.pdf_data = None
+        self.llave_extraccion = None
+        self.parrafos = None
+        self.embeddings = None
+        self.total_extraidos = 0
+        self.total_insertados = 0
+        self.embedding_cache = {"hits": 0, "misses": 0}
+        self.tiempos = {}
+        self.error = None
+        self.etapa_error = None
+
+    def a_dict(self):
+        return {
+            "documento": self.documento,
+            "estado": "error" if self.error else "ok",
+            "total_extraidos": self.total_extraidos,
+            "total_insertados_bigquery": self.total_insertados,
+            "embedding_cache": self.embedding_cache,
+            "tiempos": self.tiempos,
+            "error": self.error,
+            "etapa_error": self.etapa_error,
+        }
+
+
+def _correr_etapa(nombre, funcion, entrada, salida, trabajadores):
+    """
+    Arranca `trabajadores` hilos que leen de `entrada`, aplican `funcion` y escriben en `salida`.
+    Un documento con error sigue pasando por las colas (para reportarlo) pero ya no se procesa.
+    El último hilo en terminar propaga el fin a la siguiente etapa.
+    """
+    pendientes = [trabajadores]
+    lock = threading.Lock()
+
+    def trabajar():
+        while True:
+            resultado = entrada.get()
+            if resultado is _FIN:
+                # Se regresa el fin para que los demás hilos de la etapa también terminen
+                entrada.put(_FIN)
+                break
+            if resultado.error is None:
+                inicio = time.time()
+                try:
+                    funcion(resultado)
+                except Exception as e:
+                    logger.error(f"Error en etapa {nombre} para {resultado.documento}: {e}")
+                    resultado.error = str(e)
+                    resultado.etapa_error = nombre
+                    # Se suelta la memoria del documento fallido
+                    resultado.pdf_data = resultado.parrafos = resultado.embeddings = None
+                resultado.tiempos[nombre] = round(time.time() - inicio, 4)
+            salida.put(resultado)
+
+        with lock:
+            pendientes[0] -= 1
+            if pendientes[0] == 0:
+                salida.put(_FIN)
+
+    hilos = [
+        threading.Thread(target=trabajar, name=f"pipeline-{nombre}-{i}", daemon=True)
+        for i in range(trabajadores)
+    ]
+    for hilo in hilos:
+        hilo.start()
+    return hilos
+
+
+def procesar_lote(documentos, topic, channel, carga=True, trabajadores=None):
+    """
+    Procesa varios documentos como un pipeline por etapas con colas acotadas:
+    descarga -> extracción -> embeddings -> inserción.
+    Mientras el documento N se embebe o se inserta, el N+1 ya se está descargando y extrayendo.
+    Regresa un resultado por documento, en el orden de entrada.
+    """
+    trabajadores = {**PIPELINE_TRABAJADORES, **(trabajadores or {})}
+
+    detector = DetectorCalibriCamelCase()
+
+    def descargar(r):
+        # Un documento sin cambios sale de aquí ya extraído y no se descarga
+        blob = blob_pdf(r.documento)
+        r.llave_extraccion, r.parrafos = consultar_cache_extraccion(blob, detector)
+        if r.parrafos is None:
+            r.pdf_data = descargar_blob(blob)
+
+    def extraer(r):
+        if r.parrafos is None:
+            try:
+                r.parrafos = lineas_y_secciones(r.pdf_data, detector)
+            finally:
+                liberar_descarga(r.pdf_data)
+                r.pdf_data = None
+            guardar_en_cache_extraccion(r.llave_extraccion, r.parrafos)
+        r.parrafos = fragmentar_secciones(r.parrafos)
+        r.total_extraidos = len(r.parrafos)
+
+    def embeber(r):
+        r.embeddings = generar_embeddings_parrafos(r.parrafos)
+        r.embedding_cache = r.embeddings[1]
+
+    def insertar(r):
+        resultado = insertar_chunks_en_bigquery(
+            r.parrafos, r.documento, topic, channel, embeddings_precalculados=r.embeddings
+        )
+        r.total_insertados = resultado["total_insertados"]
+        r.parrafos = r.embeddings = None
+
+    etapas = [("descarga", descargar), ("extraccion", extraer)]
+    if carga:
+        etapas += [("embeddings", embeber), ("insercion", insertar)]
+
+    colas = [queue.Queue(maxsize=PIPELINE_TAMANO_COLA) for _ in range(len(etapas) + 1)]
+    # La cola final no se acota: solo junta resultados
+    colas[-1] = queue.Queue()
+
+    for i, (nombre, funcion) in enumerate(etapas):
+        _correr_etapa(nombre, funcion, colas[i], colas[i + 1], max(1, trabajadores[nombre]))
+
+    def alimentar():
+        for posicion, documento in enumerate(documentos):
+            colas[0].put(ResultadoDocumento(posicion, documento))
+        colas[0].put(_FIN)
+
+    threading.Thread(target=alimentar, name="pipeline-entrada", daemon=True).start()
+
+    resultados = []
+    while True:
+        resultado = colas[-1].get()
+        if resultado is _FIN:
+            break
+        resultados.append(resultado)
+        logger.info(
+            f"Documento {len(resultados)}/{len(documentos)} terminado: "
+            f"{resultado.documento} ({'error' if resultado.error else 'ok'})"
+        )
+
+    resultados.sort(key=lambda r: r.posicion)
+    return [r.a_dict() for r in resultados]
+
+
+def resolver_documentos(documentos=None, prefijo=None):
+    """Lista final de blobs: los nombres explícitos más los PDFs bajo `prefijo`, sin repetir."""
+    nombres = list(documentos or [])
+    if prefijo:
+        nombres += listar_pdfs(prefijo)
+    return list(dict.fromkeys(nombres))
+
+
+# =========================================================
+# CLI: python -m app.pipeline --topic ... --channel ... [--prefijo ...] [blobs ...]
+# =========================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingesta por lotes de documentos a BigQuery")
+    parser.add_argument("documentos", nargs="*", help="Nombres de blobs en el bucket")
+    parser.add_argument("--prefijo", help="Procesar todos los PDFs bajo este prefijo de GCS")
+    parser.add_argument("--topic", required=True)
+    parser.add_argument("--channel", required=True)
+    parser.add_argument("--sin-carga", action="store_true", help="Solo descargar y extraer")
+    for etapa in PIPELINE_TRABAJADORES:
+        parser.add_argument(f"--trabajadores-{etapa}", type=int, dest=f"trabajadores_{etapa}")
+    args = parser.parse_args(argv)
+
+    documentos = resolver_documentos(args.documentos, args.prefijo)
+    if not documentos:
+        parser.error("No hay documentos: indica blobs o un --prefijo con PDFs")
+
+    trabajadores = {
+        etapa: getattr(args, f"trabajadores_{etapa}")
+        for etapa in PIPELINE_TRABAJADORES
+        if getattr(args, f"trabajadores_{etapa}")
+    }
+    inicio = time.time()
+    resultados = procesar_lote(documentos, args.topic, args.channel, not args.sin_carga, trabajadores)
+    if not args.sin_carga:
+        # Las instancias del servicio dejan de servir respuestas cacheadas de esta llave
+        from app.cache_resultados import obtener_cache_resultados
+
+        obtener_cache_resultados().invalidar(args.topic, args.channel)
+    print(json.dumps(
+        {"tiempo_total": round(time.time() - inicio, 2), "documentos": resultados},
+        ensure_ascii=False,
+        indent=2,
+    ))
+    return 1 if any(r["error"] for r in resultados) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+from google.cloud import bigquery
+
+from app.metricas import ETAPA_BIGQUERY_CONSULTA, span
+from app.modelos import CONDICION_MODELO_SQL, parametros_modelo
+
+# ==============================
+# Modos de ranking
+# ==============================
+# local: índice residente en memoria (app/indice.py)
+# bigquery: similitud coseno calculada en SQL, solo viajan los top-k
+# vector_search: función VECTOR_SEARCH de BigQuery (usa el índice vectorial si existe)
+MODOS_RANKING = {"local", "bigquery", "vector_search"}
+
+
+def construir_consulta_top_k(table_ref: str, modo: str = "bigquery", k: int = 5, filtrar_modelo: bool = False) -> str:
+    """
+    Construye la consulta que regresa solo los top-k textos con su similitud.
+    Los valores del usuario viajan como parámetros (@topic, @channel, @question_embedding, @k).
+    Con `filtrar_modelo` solo se comparan las filas del mismo modelo y dimensión que la pregunta.
+    """
+    condicion_modelo = f" AND {CONDICION_MODELO_SQL}" if filtrar_modelo else ""
+    if modo == "bigquery":
+        return f"""
+            SELECT text, 1 - COSINE_DISTANCE(embedding, @question_embedding) AS similarity
+            FROM `{table_ref}`
+            WHERE is_repeat = 'N' AND topic = @topic AND channel = @channel{condicion_modelo}
+            ORDER BY similarity DESC
+            LIMIT @k
+        """
+    if modo == "vector_search":
+        # top_k debe ser una constante dentro de VECTOR_SEARCH; k ya viene validado como int
+        return f"""
+            SELECT base.text AS text, 1 - distance AS similarity
+            FROM VECTOR_SEARCH(
+                (SELECT text, embedding FROM `{table_ref}`
+                 WHERE is_repeat = 'N' AND topic = @topic AND channel = @channel{condicion_modelo}),
+                'embedding',
+                (SELECT @question_embedding AS embedding),
+                top_k => {int(k)},
+                distance_type => 'COSINE'
+            )
+            ORDER BY distance
+        """
+    raise ValueError(f"Modo de ranking en servidor no soportado: '{modo}'")
+
+
+def parametros_top_k(embedding_pregunta, topic: str, channel: str, k: int = 5, modo: str = "bigquery", modelo=None) -> list:
+    parametros = [
+        bigquery.ArrayQueryParameter(
+            "question_embedding", "FLOAT64", [float(v) for v in embedding_pregunta]
+        ),
+        bigquery.ScalarQueryParameter("topic", "STRING", topic.lower().strip()),
+        bigquery.ScalarQueryParameter("channel", "STRING", channel.lower().strip()),
+    ]
+    if modo == "bigquery":
+        parametros.append(bigquery.ScalarQueryParameter("k", "INT64", int(k)))
+    if modelo is not None:
+        parametros.extend(parametros_modelo(modelo))
+    return parametros
+
+
+def buscar_top_k_en_bigquery(client, table_ref, embedding_pregunta, topic, channel, k=5, modo="bigquery", modelo=None):
+    """
+    Ejecuta el ranking en BigQuery y regresa [{"text", "similarity"}] de mayor a menor.
+    `client` es cualquier objeto con la interfaz de bigquery.Client.query.
+    `modelo` (app.modelos.ModeloEmbeddings) deja fuera las filas embebidas con otro modelo o dimensión.
+    """
+    k = int(k)
+    query = construir_consulta_top_k(table_ref, modo, k, filtrar_modelo=modelo is not None)
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=parametros_top_k(embedding_pregunta, topic, channel, k, modo, modelo)
+    )
+    with span(ETAPA_BIGQUERY_CONSULTA):
+        rows = client.query(query, job_config=job_config).result()
+        return [{"text": row["text"], "similarity": row["similarity"]} for row in rows]
@@ -0,0 +1,345 @@
+import os
+import re
+import json
+import time
+import uuid
+import base64
+import logging
+import threading
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from app.cache_resultados import normalizar_consulta, obtener_cache_resultados
+from app.concurrencia import executor_de
+from app.metricas import EVENTOS
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración
+# ==============================
+PRECALCULO_HABILITADO = os.getenv("PRECALCULO_HABILITADO", "true").lower() == "true"
+# Preguntas más frecuentes por (topic, channel) cuyas respuestas se precalculan
+PRECALCULO_MAX_PREGUNTAS = int(os.getenv("PRECALCULO_MAX_PREGUNTAS", 50))
+# Veces que debe repetirse una pregunta dentro de la ventana para entrar al conjunto
+PRECALCULO_MIN_FRECUENCIA = int(os.getenv("PRECALCULO_MIN_FRECUENCIA", 5))
+# Días de tráfico que cuentan para la frecuencia (en Redis hay un contador por día)
+PRECALCULO_VENTANA_DIAS = int(os.getenv("PRECALCULO_VENTANA_DIAS", 7))
+# Cada cuánto se suman a Redis los conteos que junta cada proceso
+PRECALCULO_VOLCADO_SEGUNDOS = float(os.getenv("PRECALCULO_VOLCADO_SEGUNDOS", 10))
+# Cada cuánto revisa un proceso si hay un conjunto más nuevo o si una ingesta dejó obsoleto el suyo
+PRECALCULO_REVISION_SEGUNDOS = float(os.getenv("PRECALCULO_REVISION_SEGUNDOS", 5))
+# Sin ingestas, el conjunto se recalcula con esta antigüedad para seguir al tráfico
+PRECALCULO_RENOVACION_SEGUNDOS = float(os.getenv("PRECALCULO_RENOVACION_SEGUNDOS", 3600))
+# Similitud coseno mínima con una pregunta precalculada para reusar su respuesta (0 = solo la forma canónica)
+PRECALCULO_SIMILITUD_MINIMA = float(os.getenv("PRECALCULO_SIMILITUD_MINIMA", 0.97))
+# Vida máxima del candado de un recálculo (por si la instancia que lo hace muere)
+PRECALCULO_LOCK_TTL_MS = int(os.getenv("PRECALCULO_LOCK_TTL_MS", 120000))
+
+# v2: forma canónica que conserva todas las palabras y su orden
+PREFIJO = "precalculo:v2:"
+SEGUNDOS_POR_DIA = 86400
+
+
+def forma_canonica(pregunta) -> str:
+    """
+    Forma en la que coinciden las redacciones que solo difieren en mayúsculas, acentos, signos o
+    espacios: "¿Requisitos de la Modalidad 40?" y "requisitos de la modalidad 40" dan
+    "requisitos de la modalidad 40". Las palabras y su orden se conservan, porque cambian la
+    pregunta ("pagar la modalidad 40 sin afore" no es "pagar afore sin la modalidad 40");
+    las redacciones más distintas se reconocen por similitud de embeddings.
+    """
+    texto = unicodedata.normalize("NFKD", normalizar_consulta(pregunta))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.findall(r"[a-z0-9]+", texto))
+
+
+def _texto(valor):
+    return valor.decode("utf-8") if isinstance(valor, bytes) else valor
+
+
+def _json(valor):
+    return None if valor is None else json.loads(valor)
+
+
+class ConjuntoPrecalculado:
+    """Respuestas precalculadas de un (topic, channel), tal como se guardaron en Redis."""
+
+    def __init__(self, datos=None):
+        datos = datos or {}
+        self.id = datos.get("id")
+        self.version_datos = datos.get("version_datos")
+        self.modelo = datos.get("modelo")
+        self.calculado_en = datos.get("calculado_en")
+        self.entradas = datos.get("entradas", [])
+        self._por_forma = {entrada["forma"]: entrada for entrada in self.entradas}
+        # Embeddings normalizados de las preguntas, en float32, en el orden de las entradas
+        self._matriz = None
+        if self.entradas:
+            self._matriz = np.frombuffer(base64.b64decode(datos["embeddings"]), dtype=np.float32).reshape(
+                len(self.entradas), -1
+            )
+        # Se fijan en cada revisión: si se puede servir y si hay que recalcularlo
+        self.vigente = False
+        self.renovar = True
+        self.revisado = 0.0
+
+    def por_forma(self, pregunta):
+        return self._por_forma.get(forma_canonica(pregunta))
+
+    def por_similitud(self, embedding, minima=None):
+        """La entrada cuya pregunta es la más parecida a `embedding`, si llega a la similitud mínima."""
+        minima = PRECALCULO_SIMILITUD_MINIMA if minima is None else minima
+        if self._matriz is None or not minima:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norma = np.linalg.norm(vector)
+        if not norma or vector.shape[0] != self._matriz.shape[1]:
+            return None
+        similitudes = self._matriz @ (vector / norma)
+        mejor = int(np.argmax(similitudes))
+        return self.entradas[mejor] if similitudes[mejor] >= minima else None
+
+    def resumen(self):
+        return {
+            "vigente": self.vigente,
+            "version_datos": self.version_datos,
+            "modelo": self.modelo,
+            "calculado_en": self.calculado_en,
+            "preguntas": [
+                {"pregunta": e["pregunta"], "forma": e["forma"], "frecuencia": e["frecuencia"]} for e in self.entradas
+            ],
+        }
+
+
+class RespuestasPrecalculadas:
+    """
+    Top-k precalculado de las preguntas más frecuentes de cada (topic, channel).
+    - Registro: cada /buscar/ semántico suma 1 a la forma canónica de su pregunta; los conteos se
+      juntan en el proceso y se vuelcan a Redis (un sorted set por día) cada PRECALCULO_VOLCADO_SEGUNDOS.
+    - Recálculo: después de cada ingesta se embeben en un lote las preguntas más frecuentes de la
+      ventana y se rankean con el índice; el conjunto se guarda con la versión de datos de la caché
+      de resultados con la que se calculó. Solo una instancia a la vez lo calcula (SET NX).
+    - Consulta: cada proceso tiene una copia que revisa cada PRECALCULO_REVISION_SEGUNDOS; si la
+      versión de datos o el modelo ya no son los actuales, no se sirve hasta recalcularla.
+    Las fallas de Redis nunca rompen una búsqueda: la pregunta simplemente se calcula completa.
+    """
+
+    def __init__(self, cliente, version_datos, max_preguntas=None, min_frecuencia=None, ventana_dias=None):
+        self._cliente = cliente
+        # (topic, channel) -> versión actual de sus datos; cambia con cada ingesta
+        self._version_datos = version_datos
+        self.max_preguntas = max_preguntas or PRECALCULO_MAX_PREGUNTAS
+        self.min_frecuencia = PRECALCULO_MIN_FRECUENCIA if min_frecuencia is None else min_frecuencia
+        self.ventana_dias = ventana_dias or PRECALCULO_VENTANA_DIAS
+        self._pendientes = {}
+        self._ultimo_volcado = time.monotonic()
+        self._volcando = False
+        self._conjuntos = {}
+        self._recalculando = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _par(topic, channel):
+        return normalizar_consulta(topic), normalizar_consulta(channel)
+
+    @staticmethod
+    def _llave(tipo, par, *resto):
+        return ":".join((PREFIJO + tipo,) + par + tuple(str(r) for r in resto))
+
+    # -------------------------
+    # Registro de preguntas
+    # -------------------------
+    def registrar(self, topic, channel, pregunta):
+        """Cuenta la pregunta; no hace I/O salvo programar el volcado cuando ya toca."""
+        forma = forma_canonica(pregunta)
+        if not forma:
+            return
+        par = self._par(topic, channel)
+        with self._lock:
+            conteos, textos = self._pendientes.setdefault(par, (Counter(), {}))
+            conteos[forma] += 1
+            textos.setdefault(forma, pregunta)
+            if self._volcando or time.monotonic() - self._ultimo_volcado < PRECALCULO_VOLCADO_SEGUNDOS:
+                return
+            self._volcando = True
+        executor_de("redis").submit(self._volcar_en_segundo_plano)
+
+    def _volcar_en_segundo_plano(self):
+        try:
+            self.volcar()
+        finally:
+            self._volcando = False
+
+    def volcar(self):
+        """Suma a Redis los conteos juntados en el proceso; si Redis falla, esos conteos se pierden."""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+            self._ultimo_volcado = time.monotonic()
+        dia = int(time.time() // SEGUNDOS_POR_DIA)
+        expira = (self.ventana_dias + 1) * SEGUNDOS_POR_DIA
+        try:
+            for par, (conteos, textos) in pendientes.items():
+                frecuencias = self._llave("frecuencia", par, dia)
+                redacciones = self._llave("textos", par, dia)
+                for forma, veces in conteos.items():
+                    self._cliente.zincrby(frecuencias, veces, forma)
+                    # Se guarda la primera redacción vista de cada forma: es la que se embebe
+                    self._cliente.hsetnx(redacciones, forma, textos[forma])
+                self._cliente.expire(frecuencias, expira)
+                self._cliente.expire(redacciones, expira)
+        except Exception as e:
+            logger.warning(f"No se pudieron volcar las frecuencias de preguntas: {e}")
+
+    def calientes(self, topic, channel):
+        """[(forma, pregunta, frecuencia)] de las preguntas más frecuentes de la ventana, de mayor a menor."""
+        par = self._par(topic, channel)
+        hoy = int(time.time() // SEGUNDOS_POR_DIA)
+        dias = range(hoy - self.ventana_dias + 1, hoy + 1)
+        totales = Counter()
+        for dia in dias:
+            # De cada día se leen más de las necesarias: una pregunta frecuente en la ventana
+            # puede no estar entre las primeras de cada día
+            for forma, veces in self._cliente.zrevrange(
+                self._llave("frecuencia", par, dia), 0, self.max_preguntas * 4 - 1, withscores=True
+            ):
+                totales[_texto(forma)] += veces
+        elegidas = [(f, int(v)) for f, v in totales.most_common(self.max_preguntas) if v >= self.min_frecuencia]
+
+        textos = {}
+        for dia in reversed(dias):
+            faltan = [forma for forma, _ in elegidas if forma not in textos]
+            if not faltan:
+                break
+            for forma, texto in zip(faltan, self._cliente.hmget(self._llave("textos", par, dia), faltan)):
+                if texto is not None:
+                    textos[forma] = _texto(texto)
+        return [(forma, textos[forma], veces) for forma, veces in elegidas if forma in textos]
+
+    # -------------------------
+    # Recálculo
+    # -------------------------
+    def recalcular(self, topic, channel, version_datos, indice, embeber_lote, modelo, k=5):
+        """
+        Calcula y guarda el conjunto del (topic, channel) con `indice`, que refleja `version_datos`.
+        `embeber_lote(preguntas)` regresa un embedding por pregunta y `modelo` es el identificador
+        del modelo con el que se embeben. Regresa cuántas preguntas quedaron precalculadas,
+        o None si otra instancia ya lo está recalculando.
+        """
+        par = self._par(topic, channel)
+        candado = self._llave("candado", par)
+        token = uuid.uuid4().hex
+        if not self._cliente.set(candado, token, px=PRECALCULO_LOCK_TTL_MS, nx=True):
+            return None
+        try:
+            self.volcar()
+            calientes = self.calientes(topic, channel)
+            datos = {
+                "id": token,
+                "version_datos": version_datos,
+                "modelo": modelo,
+                "calculado_en": time.time(),
+                "entradas": [],
+            }
+            if calientes:
+                embeddings = embeber_lote([pregunta for _, pregunta, _ in calientes])
+                tops = indice.buscar_lote(embeddings, k=k, modelo=modelo)
+                datos["entradas"] = [
+                    {
+                        "forma": forma,
+                        "pregunta": pregunta,
+                        "frecuencia": frecuencia,
+                        "response": [indice.textos[posicion] for posicion, _ in top],
+                        "similarities": [float(similitud) for _, similitud in top],
+                    }
+                    for (forma, pregunta, frecuencia), top in zip(calientes, tops)
+                ]
+                matriz = np.asarray(embeddings, dtype=np.float32)
+                matriz /= np.maximum(np.linalg.norm(matriz, axis=1, keepdims=True), 1e-12)
+                datos["embeddings"] = base64.b64encode(matriz.tobytes()).decode("ascii")
+
+            # Primero el conjunto y luego el sello: quien vea el sello nuevo ya encuentra su conjunto
+            self._cliente.set(self._llave("conjunto", par), json.dumps(datos, ensure_ascii=False))
+            self._cliente.set(
+                self._llave("sello", par), json.dumps({"id": token, "version_datos": version_datos})
+            )
+            conjunto = ConjuntoPrecalculado(datos)
+            self._revisado(par, conjunto, version_datos, modelo)
+            EVENTOS.incrementar(evento="precalculo_recalculo")
+            logger.info(
+                f"Respuestas precalculadas de ({topic}, {channel}): {len(calientes)} preguntas, "
+                f"versión de datos {version_datos}"
+            )
+            return len(calientes)
+        finally:
+            # Solo se borra si sigue siendo nuestro (pudo expirar y tomarlo otra instancia)
+            actual = self._cliente.get(candado)
+            if actual is not None and _texto(actual) == token:
+                self._cliente.delete(candado)
+
+    def programar(self, topic, channel, recalcular):
+        """Corre `recalcular(topic, channel)` en segundo plano; uno a la vez por (topic, channel) en el proceso."""
+        par = self._par(topic, channel)
+        with self._lock:
+            if par in self._recalculando:
+                return
+            self._recalculando.add(par)
+
+        def correr():
+            try:
+                recalcular(topic, channel)
+            except Exception:
+                logger.exception(f"No se pudieron recalcular las respuestas precalculadas de ({topic}, {channel})")
+            finally:
+                with self._lock:
+                    self._recalculando.discard(par)
+
+        executor_de("ingesta").submit(correr)
+
+    # -------------------------
+    # Consulta
+    # -------------------------
+    def residente(self, topic, channel):
+        """Copia local si se revisó hace menos de PRECALCULO_REVISION_SEGUNDOS; si no, None (hay que llamar a `obtener`)."""
+        conjunto = self._conjuntos.get(self._par(topic, channel))
+        if conjunto is not None and time.monotonic() - conjunto.revisado < PRECALCULO_REVISION_SEGUNDOS:
+            return conjunto
+        return None
+
+    def obtener(self, topic, channel, modelo):
+        """Revisa en Redis si hay un conjunto más nuevo y si el que se tiene sigue vigente."""
+        par = self._par(topic, channel)
+        version_datos = self._version_datos(topic, channel)
+        sello = _json(self._cliente.get(self._llave("sello", par)))
+        conjunto = self._conjuntos.get(par)
+        if sello is None:
+            conjunto = ConjuntoPrecalculado()
+        elif conjunto is None or conjunto.id != sello["id"]:
+            conjunto = ConjuntoPrecalculado(_json(self._cliente.get(self._llave("conjunto", par))))
+        return self._revisado(par, conjunto, version_datos, modelo)
+
+    def _revisado(self, par, conjunto, version_datos, modelo):
+        conjunto.vigente = (
+            conjunto.id is not None and conjunto.version_datos == version_datos and conjunto.modelo == modelo
+        )
+        conjunto.renovar = not conjunto.vigente or time.time() - conjunto.calculado_en > PRECALCULO_RENOVACION_SEGUNDOS
+        conjunto.revisado = time.monotonic()
+        self._conjuntos[par] = conjunto
+        return conjunto
+
+
+_precalculadas = None
+_precalculadas_lock = threading.Lock()
+
+
+def obtener_respuestas_precalculadas():
+    """Instancia única por proceso sobre el cliente Redis compartido y las versiones de la caché de resultados."""
+    global _precalculadas
+    from app.clientes import obtener_redis
+
+    with _precalculadas_lock:
+        if _precalculadas is None:
+            _precalculadas = RespuestasPrecalculadas(obtener_redis(), obtener_cache_resultados().version)
+    return _precalculadas
@@ -0,0 +1,113 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración
+# ==============================
+# Directorio compartido por los workers del host; vacío = snapshots deshabilitados
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "")
+# Cada cuánto un worker revisa si hay una versión nueva publicada
+SNAPSHOT_REVISION_SEGUNDOS = float(os.getenv("SNAPSHOT_REVISION_SEGUNDOS", 2))
+# Versiones que se conservan en disco (las viejas pueden seguir mapeadas por algún worker)
+SNAPSHOT_VERSIONES_CONSERVADAS = int(os.getenv("SNAPSHOT_VERSIONES_CONSERVADAS", 2))
+
+ARCHIVO_ACTUAL = "CURRENT"
+ARCHIVO_EMBEDDINGS = "embeddings.npy"
+ARCHIVO_TEXTOS = "textos.json"
+
+
+def habilitados():
+    return bool(SNAPSHOT_DIR)
+
+
+def _directorio_llave(topic, channel):
+    # Nombre de directorio seguro para cualquier topic/channel
+    limpio = lambda valor: re.sub(r"[^a-z0-9_-]", "_", valor)
+    return os.path.join(SNAPSHOT_DIR, f"{limpio(topic)}__{limpio(channel)}")
+
+
+def version_actual(topic, channel):
+    """Versión publicada de la llave, o None si no hay snapshot."""
+    try:
+        with open(os.path.join(_directorio_llave(topic, channel), ARCHIVO_ACTUAL)) as archivo:
+            return archivo.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publicar_snapshot(topic, channel, ids, textos, matriz, modelo=None, version_datos=None):
+    """
+    Escribe una versión nueva (matriz .npy ya normalizada + sidecar con ids/textos, el modelo de los
+    vectores y la versión de datos de la caché de resultados con la que se leyeron de BigQuery)
+    y la publica reemplazando CURRENT con os.replace, que es atómico:
+    un worker ve la versión anterior completa o la nueva completa.
+    """
+    directorio = _directorio_llave(topic, channel)
+    version = time.strftime("%Y%m%d%H%M%S") + "_" + uuid.uuid4().hex[:8]
+    temporal = os.path.join(directorio, f".{version}.tmp")
+    os.makedirs(temporal, exist_ok=True)
+
+    np.save(os.path.join(temporal, ARCHIVO_EMBEDDINGS), np.ascontiguousarray(matriz, dtype=np.float32))
+    with open(os.path.join(temporal, ARCHIVO_TEXTOS), "w", encoding="utf-8") as archivo:
+        json.dump(
+            {"ids": list(ids), "textos": list(textos), "modelo": modelo, "version_datos": version_datos},
+            archivo,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+    os.replace(temporal, os.path.join(directorio, version))
+
+    puntero = os.path.join(directorio, f".{ARCHIVO_ACTUAL}.{version}")
+    with open(puntero, "w") as archivo:
+        archivo.write(version)
+    os.replace(puntero, os.path.join(directorio, ARCHIVO_ACTUAL))
+    logger.info(f"Snapshot publicado para ({topic}, {channel}): {version} con {len(ids)} chunks")
+
+    _limpiar_versiones(directorio, version)
+    return version
+
+
+def _limpiar_versiones(directorio, actual):
+    versiones = sorted(
+        nombre for nombre in os.listdir(directorio)
+        if not nombre.startswith(".") and nombre != ARCHIVO_ACTUAL
+    )
+    # En Linux un worker que todavía tenga mapeada una versión borrada la sigue leyendo sin problema
+    for nombre in versiones[:-SNAPSHOT_VERSIONES_CONSERVADAS]:
+        if nombre != actual:
+            shutil.rmtree(os.path.join(directorio, nombre), ignore_errors=True)
+
+
+def leer_snapshot(topic, channel):
+    """
+    Regresa (version, ids, textos, matriz, modelo, version_datos) con la matriz mapeada en memoria en
+    solo lectura, así todos los workers del host comparten las mismas páginas del page cache.
+    `modelo` es el identificador modelo@dimensión y `version_datos` la versión de datos con la que se
+    construyó (None en snapshots anteriores a guardarlos).
+    Regresa None si la llave no tiene snapshot.
+    """
+    version = version_actual(topic, channel)
+    if version is None:
+        return None
+    ruta = os.path.join(_directorio_llave(topic, channel), version)
+    try:
+        with open(os.path.join(ruta, ARCHIVO_TEXTOS), encoding="utf-8") as archivo:
+            sidecar = json.load(archivo)
+        if sidecar["ids"]:
+            matriz = np.load(os.path.join(ruta, ARCHIVO_EMBEDDINGS), mmap_mode="r")
+        else:
+            # Un archivo vacío no se puede mapear
+            matriz = np.zeros((0, 0), dtype=np.float32)
+    except FileNotFoundError:
+        # La versión se limpió entre leer CURRENT y abrirla; la siguiente revisión toma la nueva
+        return None
+    return version, sidecar["ids"], sidecar["textos"], matriz, sidecar.get("modelo"), sidecar.get("version_datos")
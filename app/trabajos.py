@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Configuración
+# ==============================
+TRABAJOS_DB_PATH = os.getenv("TRABAJOS_DB_PATH", ".cache/trabajos.sqlite")
+# Hilos que procesan ingestas en segundo plano; pocos, para no competir con /buscar/
+TRABAJOS_TRABAJADORES = int(os.getenv("TRABAJOS_TRABAJADORES", 1))
+# Trabajos en espera a partir de los cuales se rechazan nuevos envíos (429)
+TRABAJOS_MAX_EN_COLA = int(os.getenv("TRABAJOS_MAX_EN_COLA", 20))
+# Cada cuánto revisa la cola un trabajador sin trabajo (también la ven otros procesos)
+TRABAJOS_SONDEO_SEGUNDOS = float(os.getenv("TRABAJOS_SONDEO_SEGUNDOS", 1))
+# Un trabajo 'procesando' es de su proceso mientras éste renueve el lease (cada tercio de este tiempo);
+# si el proceso muere, al vencer el lease cualquier otro lo regresa a la cola
+TRABAJOS_LEASE_SEGUNDOS = float(os.getenv("TRABAJOS_LEASE_SEGUNDOS", 60))
+
+EN_COLA = "en_cola"
+PROCESANDO = "procesando"
+TERMINADO = "terminado"
+ERROR = "error"
+
+
+class ColaLlena(Exception):
+    """La cola tiene TRABAJOS_MAX_EN_COLA trabajos esperando."""
+
+
+class ColaTrabajos:
+    """
+    Cola persistente en SQLite: los trabajos sobreviven reinicios y la pueden
+    compartir varios procesos del mismo host (la toma de un trabajo es una transacción IMMEDIATE).
+    Cada trabajo en proceso guarda su dueño y un lease que el dueño renueva; solo se reencola
+    cuando el lease vence, así reiniciar un proceso no reencola lo que otros siguen procesando.
+    """
+
+    def __init__(self, ruta, max_en_cola=None, lease_segundos=None):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.max_en_cola = max_en_cola or TRABAJOS_MAX_EN_COLA
+        self.lease_segundos = lease_segundos or TRABAJOS_LEASE_SEGUNDOS
+        # Identifica a este proceso (y a esta instancia de la cola) como dueño de sus trabajos
+        self.duenio = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conexion.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute(
+                """
+                CREATE TABLE IF NOT EXISTS trabajos (
+                    id TEXT PRIMARY KEY,
+                    tipo TEXT NOT NULL,
+                    parametros TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    progreso TEXT NOT NULL DEFAULT '{}',
+                    resultado TEXT,
+                    error TEXT,
+                    creado_en REAL NOT NULL,
+                    iniciado_en REAL,
+                    terminado_en REAL
+                )
+                """
+            )
+            # Columnas agregadas después de la primera versión de la tabla
+            columnas = {fila["name"] for fila in self._conexion.execute("PRAGMA table_info(trabajos)")}
+            for columna in ("duenio TEXT", "vence_en REAL"):
+                if columna.split()[0] not in columnas:
+                    self._conexion.execute(f"ALTER TABLE trabajos ADD COLUMN {columna}")
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS trabajos_estado ON trabajos (estado, creado_en)")
+
+    def encolar(self, tipo, parametros):
+        """Regresa (id, posición en la cola) o lanza ColaLlena."""
+        with self._lock:
+            self._conexion.execute("BEGIN IMMEDIATE")
+            try:
+                (en_cola,) = self._conexion.execute(
+                    "SELECT COUNT(*) FROM trabajos WHERE estado = ?", (EN_COLA,)
+                ).fetchone()
+                if en_cola >= self.max_en_cola:
+                    raise ColaLlena(f"Hay {en_cola} trabajos en cola (máximo {self.max_en_cola})")
+                trabajo_id = uuid.uuid4().hex
+                self._conexion.execute(
+                    "INSERT INTO trabajos (id, tipo, parametros, estado, creado_en) VALUES (?, ?, ?, ?, ?)",
+                    (trabajo_id, tipo, json.dumps(parametros, ensure_ascii=False), EN_COLA, time.time()),
+                )
+                self._conexion.execute("COMMIT")
+            except BaseException:
+                self._conexion.execute("ROLLBACK")
+                raise
+        return trabajo_id, en_cola + 1
+
+    def tomar_siguiente(self):
+        """Marca como procesando (con este proceso como dueño) el trabajo más antiguo en cola y lo regresa (o None)."""
+        with self._lock:
+            self._conexion.execute("BEGIN IMMEDIATE")
+            try:
+                fila = self._conexion.execute(
+                    "SELECT * FROM trabajos WHERE estado = ? ORDER BY creado_en LIMIT 1", (EN_COLA,)
+                ).fetchone()
+                if fila is not None:
+                    ahora = time.time()
+                    self._conexion.execute(
+                        "UPDATE trabajos SET estado = ?, iniciado_en = ?, duenio = ?, vence_en = ? WHERE id = ?",
+                        (PROCESANDO, ahora, self.duenio, ahora + self.lease_segundos, fila["id"]),
+                    )
+                self._conexion.execute("COMMIT")
+            except BaseException:
+                self._conexion.execute("ROLLBACK")
+                raise
+        return None if fila is None else self._a_dict(fila, estado=PROCESANDO)
+
+    def actualizar_progreso(self, trabajo_id, progreso):
+        with self._lock:
+            self._conexion.execute(
+                "UPDATE trabajos SET progreso = ? WHERE id = ?",
+                (json.dumps(progreso, ensure_ascii=False), trabajo_id),
+            )
+
+    def renovar(self, trabajo_ids):
+        """Extiende el lease de los trabajos de este proceso; regresa los que ya no son suyos."""
+        perdidos = []
+        with self._lock:
+            for trabajo_id in trabajo_ids:
+                cursor = self._conexion.execute(
+                    "UPDATE trabajos SET vence_en = ? WHERE id = ? AND estado = ? AND duenio = ?",
+                    (time.time() + self.lease_segundos, trabajo_id, PROCESANDO, self.duenio),
+                )
+                if not cursor.rowcount:
+                    perdidos.append(trabajo_id)
+        return perdidos
+
+    def terminar(self, trabajo_id, resultado=None, error=None):
+        """Regresa False si el trabajo ya no era de este proceso (su lease venció y otro lo tomó)."""
+        with self._lock:
+            cursor = self._conexion.execute(
+                "UPDATE trabajos SET estado = ?, resultado = ?, error = ?, terminado_en = ?, vence_en = NULL "
+                "WHERE id = ? AND estado = ? AND duenio = ?",
+                (
+                    ERROR if error else TERMINADO,
+                    json.dumps(resultado, ensure_ascii=False) if resultado is not None else None,
+                    error,
+                    time.time(),
+                    trabajo_id,
+                    PROCESANDO,
+                    self.duenio,
+                ),
+            )
+        return cursor.rowcount > 0
+
+    def reencolar_vencidos(self):
+        """
+        Regresa a la cola los trabajos 'procesando' cuyo lease venció (su proceso murió o se reinició).
+        Los de versiones sin lease cuentan desde que iniciaron.
+        """
+        with self._lock:
+            cursor = self._conexion.execute(
+                "UPDATE trabajos SET estado = ?, iniciado_en = NULL, duenio = NULL, vence_en = NULL "
+                "WHERE estado = ? AND COALESCE(vence_en, iniciado_en + ?) < ?",
+                (EN_COLA, PROCESANDO, self.lease_segundos, time.time()),
+            )
+        return cursor.rowcount
+
+    def obtener(self, trabajo_id):
+        with self._lock:
+            fila = self._conexion.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+            if fila is None or fila["estado"] != EN_COLA:
+                return None if fila is None else self._a_dict(fila)
+            (adelante,) = self._conexion.execute(
+                "SELECT COUNT(*) FROM trabajos WHERE estado = ? AND creado_en < ?", (EN_COLA, fila["creado_en"])
+            ).fetchone()
+        return {**self._a_dict(fila), "posicion": adelante + 1}
+
+    def listar(self, estado=None, limite=50):
+        with self._lock:
+            if estado:
+                filas = self._conexion.execute(
+                    "SELECT * FROM trabajos WHERE estado = ? ORDER BY creado_en DESC LIMIT ?", (estado, limite)
+                ).fetchall()
+            else:
+                filas = self._conexion.execute(
+                    "SELECT * FROM trabajos ORDER BY creado_en DESC LIMIT ?", (limite,)
+                ).fetchall()
+        return [self._a_dict(fila) for fila in filas]
+
+    def conteos(self):
+        with self._lock:
+            filas = self._conexion.execute("SELECT estado, COUNT(*) FROM trabajos GROUP BY estado").fetchall()
+        return {estado: total for estado, total in filas}
+
+    @staticmethod
+    def _a_dict(fila, estado=None):
+        ahora = time.time()
+        terminado_en = fila["terminado_en"]
+        iniciado_en = fila["iniciado_en"] if estado is None else ahora
+        return {
+            "id": fila["id"],
+            "tipo": fila["tipo"],
+            "estado": estado or fila["estado"],
+            "parametros": json.loads(fila["parametros"]),
+            "progreso": json.loads(fila["progreso"] or "{}"),
+            "resultado": json.loads(fila["resultado"]) if fila["resultado"] else None,
+            "error": fila["error"],
+            "creado_en": fila["creado_en"],
+            "iniciado_en": iniciado_en,
+            "terminado_en": terminado_en,
+            "espera_segundos": round((iniciado_en or ahora) - fila["creado_en"], 3),
+            "duracion_segundos": round((terminado_en or ahora) - iniciado_en, 3) if iniciado_en else None,
+        }
+
+
+class Progreso:
+    """Progreso de un trabajo en curso; cada cambio se persiste para el endpoint de estado."""
+
+    def __init__(self, cola, trabajo_id):
+        self._cola = cola
+        self._trabajo_id = trabajo_id
+        self.datos = {"etapa": None, "tiempos": {}}
+
+    def etapa(self, nombre):
+        """Context manager que registra la etapa actual y cuánto tardó."""
+        return _Etapa(self, nombre)
+
+    def actualizar(self, **valores):
+        self.datos.update(valores)
+        self._cola.actualizar_progreso(self._trabajo_id, self.datos)
+
+
+class _Etapa:
+    def __init__(self, progreso, nombre):
+        self._progreso = progreso
+        self._nombre = nombre
+
+    def __enter__(self):
+        self._inicio = time.time()
+        self._progreso.actualizar(etapa=self._nombre)
+
+    def __exit__(self, *exc):
+        self._progreso.datos["tiempos"][self._nombre] = round(time.time() - self._inicio, 4)
+        self._progreso.actualizar()
+        return False
+
+
+class Trabajadores:
+    """
+    Pool acotado de hilos que consumen la cola. `manejadores` es un dict
+    tipo -> funcion(parametros, progreso) que regresa el resultado (serializable a JSON).
+    """
+
+    def __init__(self, cola, manejadores, total=None):
+        self._cola = cola
+        self._manejadores = manejadores
+        self._total = max(1, total or TRABAJOS_TRABAJADORES)
+        self._detener = threading.Event()
+        self._hilos = []
+        # Trabajos de este proceso en curso, cuyo lease renueva el hilo de latidos
+        self._en_curso = set()
+        self._en_curso_lock = threading.Lock()
+
+    def iniciar(self):
+        self._reencolar_vencidos()
+        self._detener.clear()
+        self._hilos = [
+            threading.Thread(target=self._trabajar, name=f"trabajos-{i}", daemon=True) for i in range(self._total)
+        ]
+        self._hilos.append(threading.Thread(target=self._latir, name="trabajos-latidos", daemon=True))
+        for hilo in self._hilos:
+            hilo.start()
+
+    def detener(self):
+        self._detener.set()
+
+    def _reencolar_vencidos(self):
+        try:
+            reencolados = self._cola.reencolar_vencidos()
+        except sqlite3.OperationalError as e:
+            logger.warning(f"No se pudieron reencolar los trabajos vencidos: {e}")
+            return
+        if reencolados:
+            logger.info(f"{reencolados} trabajos con el lease vencido regresaron a la cola")
+
+    def _latir(self):
+        """Renueva el lease de los trabajos en curso y reencola los vencidos de procesos que murieron."""
+        while not self._detener.wait(self._cola.lease_segundos / 3):
+            with self._en_curso_lock:
+                en_curso = list(self._en_curso)
+            try:
+                for trabajo_id in self._cola.renovar(en_curso):
+                    logger.warning(f"El trabajo {trabajo_id} ya no es de este proceso (su lease venció)")
+            except sqlite3.OperationalError as e:
+                logger.warning(f"No se pudo renovar el lease de los trabajos: {e}")
+            self._reencolar_vencidos()
+
+    def _trabajar(self):
+        while not self._detener.is_set():
+            try:
+                trabajo = self._cola.tomar_siguiente()
+            except sqlite3.OperationalError as e:
+                logger.warning(f"No se pudo leer la cola de trabajos: {e}")
+                trabajo = None
+            if trabajo is None:
+                self._detener.wait(TRABAJOS_SONDEO_SEGUNDOS)
+                continue
+            self._ejecutar(trabajo)
+
+    def _ejecutar(self, trabajo):
+        logger.info(f"Trabajo {trabajo['id']} ({trabajo['tipo']}) iniciado")
+        progreso = Progreso(self._cola, trabajo["id"])
+        with self._en_curso_lock:
+            self._en_curso.add(trabajo["id"])
+        try:
+            try:
+                resultado = self._manejadores[trabajo["tipo"]](trabajo["parametros"], progreso)
+            except Exception as e:
+                logger.exception(f"Trabajo {trabajo['id']} falló en la etapa {progreso.datos.get('etapa')}")
+                terminado = self._cola.terminar(trabajo["id"], error=str(e))
+            else:
+                terminado = self._cola.terminar(trabajo["id"], resultado=resultado)
+                logger.info(f"Trabajo {trabajo['id']} terminado")
+            if not terminado:
+                logger.warning(f"El trabajo {trabajo['id']} ya no era de este proceso; su resultado no se guardó")
+        finally:
+            with self._en_curso_lock:
+                self._en_curso.discard(trabajo["id"])
+
+
+_cola = None
+_cola_lock = threading.Lock()
+
+
+def obtener_cola():
+    """Cola única por proceso sobre TRABAJOS_DB_PATH."""
+    global _cola
+    with _cola_lock:
+        if _cola is None:
+            _cola = ColaTrabajos(TRABAJOS_DB_PATH)
+    return _cola
@@ -0,0 +1,7 @@
+import sys
+
+from bench.escenarios import main
+
+# python -m bench [--escenarios extraccion,insercion,buscar] [--comparar resultados_previos.json]
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,535 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+
+import numpy as np
+
+# El benchmark nunca debe tocar servicios reales ni cachés en disco:
+# se fija la configuración antes de importar app/.
+os.environ.update({
+    "PROJECT_ID": "bench",
+    "DATASET_ID": "bench",
+    "TABLE_ID": "chunks",
+    "TABLE_ID_BETA": "chunks_beta",
+    "BUCKET_NAME": "bench",
+    "EMBEDDING_CACHE_BACKEND": "none",
+    "EXTRACCION_CACHE_BACKEND": "none",
+    "SNAPSHOT_DIR": "",
+    "RESULTADOS_CACHE_HABILITADA": "false",
+    # Solo el escenario precalculadas lo activa, para no mezclarlo con la latencia de buscar
+    "PRECALCULO_HABILITADO": "false",
+    "RANKING_MODE": "local",
+    # La cuota de Vertex no aplica a los sustitutos; la pasarela no debe limitar lo que se mide
+    "EMBEDDINGS_REQUESTS_POR_SEGUNDO": "1000000",
+    "EMBEDDINGS_RAFAGA": "1000000",
+    "EMBEDDING_MODELO": "gemini-embedding-001",
+})
+
+from bench import falsos  # noqa: E402
+from bench.pdf_sintetico import LINEAS_POR_PAGINA, generar_pdf  # noqa: E402
+
+DIRECTORIO_RESULTADOS = os.path.join(os.path.dirname(__file__), "resultados")
+# Ingesta y búsqueda usan el mismo modelo del registro (app/modelos.py)
+MODELO = os.environ["EMBEDDING_MODELO"]
+
+# Columnas de las tablas de chunks, tal como las escribe app/bigquery.py
+ESQUEMAS = {
+    "bench.bench.chunks": (
+        "id", "channel", "name_document", "chunk_id", "text", "topic", "intent",
+        "is_transactional", "embedding", "embedding_model", "embedding_dimension", "is_repeat",
+    ),
+    "bench.bench.chunks_beta": (
+        "id", "channel", "name_document", "chunk_id", "text", "knowledge_domain", "intent",
+        "intent_document", "is_transactional", "embedding", "embedding_model", "embedding_dimension", "is_repeat",
+    ),
+}
+
+
+def _percentiles(segundos):
+    return {
+        "p50_ms": round(float(np.percentile(segundos, 50)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(segundos, 99)) * 1000, 3),
+        "media_ms": round(float(np.mean(segundos)) * 1000, 3),
+    }
+
+
+# =========================================================
+# Escenarios
+# =========================================================
+def escenario_extraccion(latencias, paginas=(10, 50, 200), repeticiones=3):
+    """Throughput de extraer_texto_con_intenciones y de la versión beta sobre PDFs sintéticos."""
+    from app import extractor
+
+    storage = falsos.StorageFalso(latencias)
+    falsos.instalar(storage=storage)
+
+    filas = []
+    for total_paginas in paginas:
+        for nombre, funcion, estilo in (
+            ("extraer_texto_con_intenciones", extractor.extraer_texto_con_intenciones, "camel_case"),
+            ("extraer_texto_con_intenciones_beta", extractor.extraer_texto_con_intenciones_beta, "subtitulo"),
+        ):
+            blob = f"bench/{estilo}_{total_paginas}.pdf"
+            storage.subir("bench", blob, generar_pdf(total_paginas, estilo=estilo))
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                chunks = funcion(blob)
+                tiempos.append(time.perf_counter() - inicio)
+            mejor = min(tiempos)
+            filas.append({
+                "escenario": "extraccion",
+                "caso": f"{nombre}/{total_paginas}p",
+                "paginas": total_paginas,
+                "lineas": total_paginas * LINEAS_POR_PAGINA,
+                "chunks": len(chunks),
+                "segundos": round(mejor, 4),
+                "paginas_por_segundo": round(total_paginas / mejor, 1),
+                **_percentiles(tiempos),
+            })
+    return filas
+
+
+def escenario_reextraccion(latencias, paginas=(10, 50, 200), repeticiones=3):
+    """Re-proceso de un PDF sin cambios: primera extracción (miss) contra las siguientes servidas por la caché."""
+    import tempfile
+    from app import cache_extraccion, extractor
+
+    storage = falsos.StorageFalso(latencias)
+    falsos.instalar(storage=storage)
+
+    filas = []
+    with tempfile.TemporaryDirectory() as directorio:
+        # La caché se activa solo en este escenario y sobre un archivo desechable
+        cache_extraccion.EXTRACCION_CACHE_BACKEND = "sqlite"
+        cache_extraccion._cache = cache_extraccion.CacheExtraccionSQLite(os.path.join(directorio, "extracciones.sqlite"))
+        try:
+            for total_paginas in paginas:
+                blob = f"bench/reextraccion_{total_paginas}.pdf"
+                storage.subir("bench", blob, generar_pdf(total_paginas, estilo="camel_case"))
+                descargas = storage.descargas
+                inicio = time.perf_counter()
+                extractor.extraer_texto_con_intenciones(blob)
+                primera = time.perf_counter() - inicio
+                tiempos = []
+                for _ in range(repeticiones):
+                    inicio = time.perf_counter()
+                    chunks = extractor.extraer_texto_con_intenciones(blob)
+                    tiempos.append(time.perf_counter() - inicio)
+                filas.append({
+                    "escenario": "reextraccion",
+                    "caso": f"extraer_texto_con_intenciones/{total_paginas}p",
+                    "paginas": total_paginas,
+                    "chunks": len(chunks),
+                    "descargas": storage.descargas - descargas,
+                    "segundos_primera": round(primera, 4),
+                    "segundos": round(min(tiempos), 4),
+                    **_percentiles(tiempos),
+                })
+        finally:
+            cache_extraccion.EXTRACCION_CACHE_BACKEND = "none"
+            cache_extraccion._cache = None
+    return filas
+
+
+def escenario_insercion(latencias, parrafos=(100, 1000), dimension=768):
+    """Tiempo total de insertar_chunks_en_bigquery* (embeddings + escritura) por modo de escritura."""
+    from app import bigquery as ingesta
+
+    filas = []
+    for total in parrafos:
+        datos = [
+            {"intent": f"Intencion{i % 50}", "texto": f"Párrafo sintético {i} " + "texto de relleno " * 20}
+            for i in range(total)
+        ]
+        for nombre, funcion in (
+            ("insertar_chunks_en_bigquery", ingesta.insertar_chunks_en_bigquery),
+            ("insertar_chunks_en_bigquery_beta", ingesta.insertar_chunks_en_bigquery_beta),
+        ):
+            for modo in ("streaming", "load"):
+                bq = falsos.BigQueryFalso(latencias, ESQUEMAS)
+                modelo = falsos.ModeloEmbeddingsFalso(dimension, latencias, max_textos=1)
+                falsos.instalar(bigquery=bq, modelos={MODELO: modelo})
+                inicio = time.perf_counter()
+                resultado = funcion(datos, "manual.pdf", "bench", "web", modo_escritura=modo)
+                segundos = time.perf_counter() - inicio
+                filas.append({
+                    "escenario": "insercion",
+                    "caso": f"{nombre}/{modo}/{total}",
+                    "parrafos": total,
+                    "insertados": resultado["total_insertados"],
+                    "segundos": round(segundos, 4),
+                    "llamadas_vertex": modelo.llamadas,
+                    "llamadas_bigquery": dict(bq.llamadas),
+                })
+    return filas
+
+
+def escenario_reingesta(latencias, parrafos=(100, 1000), dimension=768, editados=0.01):
+    """Re-upload de un documento con una fracción de párrafos editados: modo incremental vs load completo."""
+    from app import bigquery as ingesta
+
+    filas = []
+    for total in parrafos:
+        original = [
+            {"intent": f"Intencion{i % 50}", "texto": f"Párrafo sintético {i} " + "texto de relleno " * 20}
+            for i in range(total)
+        ]
+        cada = max(1, int(1 / editados))
+        editado = [
+            {**p, "texto": p["texto"] + " (editado)"} if i % cada == 0 else p for i, p in enumerate(original)
+        ]
+        for nombre, funcion in (
+            ("insertar_chunks_en_bigquery", ingesta.insertar_chunks_en_bigquery),
+            ("insertar_chunks_en_bigquery_beta", ingesta.insertar_chunks_en_bigquery_beta),
+        ):
+            for modo in ("load", "incremental"):
+                bq = falsos.BigQueryFalso(latencias, ESQUEMAS)
+                modelo = falsos.ModeloEmbeddingsFalso(dimension, latencias, max_textos=1)
+                falsos.instalar(bigquery=bq, modelos={MODELO: modelo})
+                # Primera carga sin medir; luego el re-upload del documento editado
+                funcion(original, "manual.pdf", "bench", "web", modo_escritura="incremental")
+                modelo.llamadas = 0
+                inicio = time.perf_counter()
+                resultado = funcion(editado, "manual.pdf", "bench", "web", modo_escritura=modo)
+                segundos = time.perf_counter() - inicio
+                filas.append({
+                    "escenario": "reingesta",
+                    "caso": f"{nombre}/{modo}/{total}",
+                    "parrafos": total,
+                    "editados": sum(1 for a, b in zip(original, editado) if a is not b),
+                    "segundos": round(segundos, 4),
+                    "llamadas_vertex": modelo.llamadas,
+                    "filas_en_tabla": sum(len(t) for t in bq.tablas.values()),
+                    "cambios": resultado.get("cambios"),
+                })
+    return filas
+
+
+def escenario_buscar(latencias, tamanos=(1000, 10000, 100000), consultas=200, dimension=768):
+    """Latencia p50/p99 de /buscar/ (embedding de la pregunta + ranking local) por tamaño del (topic, channel)."""
+    from app import main
+
+    filas = []
+    for tamano in tamanos:
+        bq = falsos.BigQueryFalso(latencias)
+        bq.sembrar(f"{main.PROJECT_ID}.{main.DATASET_ID}.{main.TABLE_ID}", "bench", "web", tamano, dimension)
+        modelo = falsos.ModeloEmbeddingsFalso(dimension, latencias)
+        falsos.instalar(bigquery=bq, modelos={MODELO: modelo})
+        main.indices.invalidar()
+
+        async def correr():
+            carga = None
+            tiempos = []
+            for i in range(consultas + 1):
+                solicitud = main.SearchRequest(question=f"pregunta {i}", intent="", topic="bench", channel="web")
+                inicio = time.perf_counter()
+                respuesta = await main.calcular_busqueda(solicitud)
+                segundos = time.perf_counter() - inicio
+                if "error" in respuesta:
+                    raise RuntimeError(respuesta["error"])
+                # La primera consulta incluye la carga del índice
+                if carga is None:
+                    carga = segundos
+                else:
+                    tiempos.append(segundos)
+            return carga, tiempos
+
+        carga, tiempos = asyncio.run(correr())
+
+        indice, _ = main.indices.obtener("bench", "web")
+        preguntas = [falsos.vector_de_texto(f"pregunta {i}", dimension) for i in range(consultas)]
+        ranking = []
+        for pregunta in preguntas:
+            inicio = time.perf_counter()
+            indice.buscar(pregunta, k=5)
+            ranking.append(time.perf_counter() - inicio)
+
+        filas.append({
+            "escenario": "buscar",
+            "caso": f"local/{tamano}",
+            "chunks": tamano,
+            "consultas": consultas,
+            "primera_consulta_ms": round(carga * 1000, 3),
+            **_percentiles(tiempos),
+            "ranking": _percentiles(ranking),
+        })
+    return filas
+
+
+def escenario_precalculadas(latencias, tamanos=(10000, 100000), consultas=200, dimension=768, calientes=20):
+    """
+    /buscar/ de preguntas frecuentes (redactadas distinto a como se registraron) servidas desde el
+    conjunto precalculado, contra preguntas nuevas que pagan embedding y ranking.
+    """
+    from app import main
+    from app.respuestas_precalculadas import PRECALCULO_MIN_FRECUENCIA, obtener_respuestas_precalculadas
+
+    precalculadas = obtener_respuestas_precalculadas()
+    filas = []
+    for tamano in tamanos:
+        bq = falsos.BigQueryFalso(latencias)
+        bq.sembrar(f"{main.PROJECT_ID}.{main.DATASET_ID}.{main.TABLE_ID}", "bench", "web", tamano, dimension)
+        modelo = falsos.ModeloEmbeddingsFalso(dimension, latencias)
+        falsos.instalar(bigquery=bq, modelos={MODELO: modelo})
+        main.indices.invalidar()
+        # Equivale a una ingesta: el conjunto del tamaño anterior queda obsoleto
+        main.obtener_cache_resultados().invalidar("bench", "web")
+
+        for i in range(calientes):
+            for _ in range(PRECALCULO_MIN_FRECUENCIA):
+                precalculadas.registrar("bench", "web", f"requisitos de la modalidad {i}")
+        inicio = time.perf_counter()
+        precalculadas_total = main.recalcular_precalculadas("bench", "web")
+        recalculo = time.perf_counter() - inicio
+
+        async def correr(preguntas):
+            tiempos = []
+            origenes = set()
+            llamadas = modelo.llamadas
+            for pregunta in preguntas:
+                solicitud = main.SearchRequest(question=pregunta, intent="", topic="bench", channel="web")
+                inicio = time.perf_counter()
+                respuesta = await main.calcular_busqueda(solicitud)
+                tiempos.append(time.perf_counter() - inicio)
+                if "error" in respuesta:
+                    raise RuntimeError(respuesta["error"])
+                origenes.add(respuesta["precomputed"])
+            return tiempos, origenes, modelo.llamadas - llamadas
+
+        main.PRECALCULO_HABILITADO = True
+        try:
+            casos = {
+                "fria": [f"pregunta nueva {i}" for i in range(consultas)],
+                "caliente": [f"¿Requisitos de la Modalidad {i % calientes}?" for i in range(consultas)],
+            }
+            for caso, preguntas in casos.items():
+                tiempos, origenes, llamadas = asyncio.run(correr(preguntas))
+                filas.append({
+                    "escenario": "precalculadas",
+                    "caso": f"{caso}/{tamano}",
+                    "chunks": tamano,
+                    "consultas": consultas,
+                    "preguntas_precalculadas": precalculadas_total,
+                    "recalculo_ms": round(recalculo * 1000, 3),
+                    "llamadas_vertex": llamadas,
+                    "origenes": sorted(str(o) for o in origenes),
+                    **_percentiles(tiempos),
+                })
+        finally:
+            main.PRECALCULO_HABILITADO = False
+    return filas
+
+
+def _leer_json_o_jsonl(ruta):
+    with open(ruta, encoding="utf-8") as archivo:
+        contenido = archivo.read()
+    if contenido.lstrip().startswith("["):
+        return json.loads(contenido)
+    return [json.loads(linea) for linea in contenido.splitlines() if linea.strip()]
+
+
+def _datos_sinteticos(tamano, consultas, dimension, semilla=0):
+    """
+    Vectores con varianza decreciente por componente, como los de un modelo Matryoshka
+    (las primeras dimensiones cargan más información). Cada pregunta es un chunk con ruido
+    y ese chunk es su único relevante.
+    """
+    rng = np.random.default_rng(semilla)
+    escalas = (1.0 / np.sqrt(1.0 + np.arange(dimension) / 8.0)).astype(np.float32)
+    chunks = rng.standard_normal((tamano, dimension), dtype=np.float32) * escalas
+    objetivos = rng.integers(0, tamano, consultas)
+    preguntas = chunks[objetivos] + 3.0 * rng.standard_normal((consultas, dimension), dtype=np.float32) * escalas
+    ids = [f"sintetico_{i}" for i in range(tamano)]
+    return ids, chunks, preguntas, [[ids[i]] for i in objetivos]
+
+
+def _datos_propios(ruta_chunks, ruta_preguntas):
+    """
+    chunks: JSON o JSONL con {"id", "embedding"} a dimensión completa, p. ej. la salida de
+        bq query --format=json 'SELECT id, embedding FROM `...` WHERE topic = ... AND channel = ...'
+    preguntas: JSONL con {"embedding"} o {"pregunta"} (se embebe con EMBEDDING_MODELO a dimensión
+        completa; requiere credenciales de Vertex) y opcionalmente {"relevantes": [ids]}.
+    """
+    from app.modelos import EMBEDDING_MODELO, ModeloEmbeddings
+
+    filas = _leer_json_o_jsonl(ruta_chunks)
+    ids = [str(fila["id"]) for fila in filas]
+    chunks = np.asarray([fila["embedding"] for fila in filas], dtype=np.float32)
+    registros = _leer_json_o_jsonl(ruta_preguntas)
+    sin_embedding = [r["pregunta"] for r in registros if "embedding" not in r]
+    if sin_embedding:
+        modelo = ModeloEmbeddings(EMBEDDING_MODELO)
+        embebidas = iter(e.values for e in modelo.get_embeddings(sin_embedding))
+    preguntas = np.asarray(
+        [r["embedding"] if "embedding" in r else next(embebidas) for r in registros], dtype=np.float32
+    )
+    return ids, chunks, preguntas, [r.get("relevantes") for r in registros]
+
+
+def escenario_calidad_dimension(latencias, dimensiones=(3072, 1536, 768, 256, 128), chunks=None, preguntas=None,
+                                tamano=10000, consultas=200, k=5):
+    """
+    Calidad de recuperación contra costo al reducir la dimensión de los embeddings
+    (truncar y renormalizar, que es lo que hace app/modelos.py con EMBEDDING_DIMENSION).
+    Con --chunks y --preguntas mide sobre datos propios; sin ellos usa datos sintéticos, que
+    solo ilustran la forma de la curva. Por dimensión reporta:
+    - aciertos_k: fracción de preguntas con algún relevante en el top-k (si hay etiquetas)
+    - acuerdo_k: traslape promedio del top-k con el top-k a dimensión completa
+    - MB de la matriz del índice y p50/p99 del ranking local
+    """
+    from app.indice import IndiceEmbeddings
+
+    if chunks and preguntas:
+        origen = "propios"
+        ids, matriz, consultas_matriz, relevantes = _datos_propios(chunks, preguntas)
+    else:
+        origen = "sinteticos"
+        ids, matriz, consultas_matriz, relevantes = _datos_sinteticos(tamano, consultas, max(dimensiones))
+    completa = matriz.shape[1]
+
+    def rankear(dimension):
+        indice = IndiceEmbeddings(ids, ids, matriz[:, :dimension])
+        tops, tiempos = [], []
+        for pregunta in consultas_matriz[:, :dimension]:
+            inicio = time.perf_counter()
+            tops.append([ids[i] for i, _ in indice.buscar(pregunta, k=k)])
+            tiempos.append(time.perf_counter() - inicio)
+        return tops, tiempos
+
+    referencia, _ = rankear(completa)
+    filas = []
+    for dimension in sorted({d for d in dimensiones if d <= completa} | {completa}, reverse=True):
+        tops, tiempos = rankear(dimension)
+        etiquetadas = [(top, r) for top, r in zip(tops, relevantes) if r]
+        filas.append({
+            "escenario": "calidad_dimension",
+            "caso": f"{origen}/{dimension}",
+            "dimension": dimension,
+            "chunks": len(ids),
+            "consultas": len(tops),
+            f"aciertos_{k}": (
+                round(sum(bool(set(top) & set(r)) for top, r in etiquetadas) / len(etiquetadas), 4)
+                if etiquetadas else None
+            ),
+            f"acuerdo_{k}": round(float(np.mean([len(set(a) & set(b)) / k for a, b in zip(tops, referencia)])), 4),
+            "matriz_mb": round(len(ids) * dimension * 4 / 2**20, 2),
+            **_percentiles(tiempos),
+        })
+    return filas
+
+
+ESCENARIOS = {
+    "extraccion": escenario_extraccion,
+    "reextraccion": escenario_reextraccion,
+    "insercion": escenario_insercion,
+    "reingesta": escenario_reingesta,
+    "buscar": escenario_buscar,
+    "calidad_dimension": escenario_calidad_dimension,
+    "precalculadas": escenario_precalculadas,
+}
+
+
+# =========================================================
+# Resultados
+# =========================================================
+def _commit_actual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "sin-git"
+
+
+def comparar(anterior, actual):
+    """Tabla de cambio relativo para las métricas de tiempo de los casos presentes en ambas corridas."""
+    previos = {(f["escenario"], f["caso"]): f for f in anterior["resultados"]}
+    lineas = []
+    for fila in actual["resultados"]:
+        previa = previos.get((fila["escenario"], fila["caso"]))
+        if previa is None:
+            continue
+        for metrica in ("segundos", "p50_ms", "p99_ms"):
+            if metrica in fila and previa.get(metrica):
+                cambio = (fila[metrica] - previa[metrica]) / previa[metrica] * 100
+                lineas.append(
+                    f"{fila['escenario']:<11} {fila['caso']:<48} {metrica:<9} "
+                    f"{previa[metrica]:>12.3f} -> {fila[metrica]:>12.3f} ({cambio:+.1f}%)"
+                )
+    return "\n".join(lineas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de extracción, inserción y búsqueda con servicios simulados")
+    parser.add_argument("--escenarios", default=",".join(ESCENARIOS), help="Lista separada por comas")
+    parser.add_argument("--paginas", default="10,50,200")
+    parser.add_argument("--parrafos", default="100,1000")
+    parser.add_argument("--tamanos", default="1000,10000,100000", help="Chunks por (topic, channel) para buscar")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=768, help="Dimensión de los embeddings simulados")
+    parser.add_argument("--dimensiones", default="3072,1536,768,256,128", help="Dimensiones para calidad_dimension")
+    parser.add_argument("--chunks", help="calidad_dimension: JSON/JSONL con id y embedding de datos propios")
+    parser.add_argument("--preguntas", help="calidad_dimension: JSONL con embedding o pregunta, y relevantes")
+    parser.add_argument("--latencia-gcs-ms", type=float, default=0.0)
+    parser.add_argument("--latencia-vertex-ms", type=float, default=0.0)
+    parser.add_argument("--latencia-bigquery-ms", type=float, default=0.0)
+    parser.add_argument("--salida", help="Archivo JSON; default bench/resultados/<fecha>_<commit>.json")
+    parser.add_argument("--comparar", help="Resultados previos (JSON) contra los cuales comparar")
+    args = parser.parse_args(argv)
+
+    enteros = lambda valor: tuple(int(v) for v in valor.split(",") if v)
+    latencias = falsos.Latencias(
+        gcs_ms=args.latencia_gcs_ms,
+        vertex_ms=args.latencia_vertex_ms,
+        bigquery_ms=args.latencia_bigquery_ms,
+    )
+    parametros = {
+        "extraccion": {"paginas": enteros(args.paginas)},
+        "reextraccion": {"paginas": enteros(args.paginas)},
+        "insercion": {"parrafos": enteros(args.parrafos), "dimension": args.dimension},
+        "reingesta": {"parrafos": enteros(args.parrafos), "dimension": args.dimension},
+        "buscar": {"tamanos": enteros(args.tamanos), "consultas": args.consultas, "dimension": args.dimension},
+        "precalculadas": {"tamanos": enteros(args.tamanos), "consultas": args.consultas, "dimension": args.dimension},
+        "calidad_dimension": {
+            "dimensiones": enteros(args.dimensiones),
+            "chunks": args.chunks,
+            "preguntas": args.preguntas,
+            "consultas": args.consultas,
+        },
+    }
+    # Los sustitutos de Vertex regresan vectores de --dimension; el registro se configura igual
+    os.environ["EMBEDDING_DIMENSION"] = str(args.dimension)
+
+    resultados = []
+    for nombre in filter(None, args.escenarios.split(",")):
+        if nombre not in ESCENARIOS:
+            parser.error(f"Escenario desconocido: '{nombre}' (disponibles: {', '.join(ESCENARIOS)})")
+        print(f"Corriendo escenario {nombre}...", file=sys.stderr)
+        resultados.extend(ESCENARIOS[nombre](latencias, **parametros[nombre]))
+
+    commit = _commit_actual()
+    salida = {
+        "commit": commit,
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "latencias": latencias.a_dict(),
+        "resultados": resultados,
+    }
+    ruta = args.salida or os.path.join(DIRECTORIO_RESULTADOS, f"{time.strftime('%Y%m%d_%H%M%S')}_{commit}.json")
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    with open(ruta, "w", encoding="utf-8") as archivo:
+        json.dump(salida, archivo, ensure_ascii=False, indent=2)
+    print(json.dumps(resultados, ensure_ascii=False, indent=2))
+    print(f"Resultados guardados en {ruta}", file=sys.stderr)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as archivo:
+            print(comparar(json.load(archivo), salida))
+    return 0
@@ -0,0 +1,329 @@
+import re
+import io
+import json
+import time
+import zlib
+import hashlib
+import threading
+
+import numpy as np
+
+# =========================================================
+# Sustitutos locales de GCS, Vertex y BigQuery
+# =========================================================
+# Implementan solo la parte de la interfaz que usa app/ y duermen una latencia
+# configurable por llamada (y por elemento) para simular la red.
+
+
+def _dormir(milisegundos):
+    if milisegundos > 0:
+        time.sleep(milisegundos / 1000)
+
+
+class Latencias:
+    """Latencias simuladas en milisegundos."""
+
+    def __init__(self, gcs_ms=0.0, gcs_ms_por_mb=0.0, vertex_ms=0.0, vertex_ms_por_texto=0.0,
+                 bigquery_ms=0.0, bigquery_ms_por_fila=0.0):
+        self.gcs_ms = gcs_ms
+        self.gcs_ms_por_mb = gcs_ms_por_mb
+        self.vertex_ms = vertex_ms
+        self.vertex_ms_por_texto = vertex_ms_por_texto
+        self.bigquery_ms = bigquery_ms
+        self.bigquery_ms_por_fila = bigquery_ms_por_fila
+
+    def a_dict(self):
+        return dict(vars(self))
+
+
+# ---------------------------------------------------------
+# Cloud Storage
+# ---------------------------------------------------------
+class BlobFalso:
+    def __init__(self, cliente, bucket, nombre):
+        self._cliente = cliente
+        self.bucket = bucket
+        self.name = nombre
+        self.generation = None
+        self.md5_hash = None
+        self.size = None
+
+    def reload(self):
+        """Solo metadatos: cuesta la latencia fija de GCS, no la del contenido."""
+        datos = self._cliente.blobs[(self.bucket, self.name)]
+        _dormir(self._cliente.latencias.gcs_ms)
+        self.generation = self._cliente.generaciones[(self.bucket, self.name)]
+        self.md5_hash = hashlib.md5(datos).hexdigest()
+        self.size = len(datos)
+
+    def _descargar(self, if_generation_match=None):
+        llave = (self.bucket, self.name)
+        if if_generation_match is not None and self._cliente.generaciones[llave] != if_generation_match:
+            raise RuntimeError(f"412 Precondition Failed: {self.name}")
+        datos = self._cliente.blobs[llave]
+        latencias = self._cliente.latencias
+        _dormir(latencias.gcs_ms + latencias.gcs_ms_por_mb * len(datos) / 2**20)
+        self._cliente.descargas += 1
+        return datos
+
+    def download_as_bytes(self, **kwargs):
+        return self._descargar(**kwargs)
+
+    def download_to_filename(self, ruta, **kwargs):
+        with open(ruta, "wb") as archivo:
+            archivo.write(self._descargar(**kwargs))
+
+
+class BucketFalso:
+    def __init__(self, cliente, nombre):
+        self._cliente = cliente
+        self.name = nombre
+
+    def blob(self, nombre):
+        return BlobFalso(self._cliente, self.name, nombre)
+
+
+class StorageFalso:
+    """storage.Client con los blobs en un dict {(bucket, nombre): bytes}; cada subida es una generation nueva."""
+
+    def __init__(self, latencias=None):
+        self.latencias = latencias or Latencias()
+        self.blobs = {}
+        self.generaciones = {}
+        self.descargas = 0
+        self._generacion = 0
+
+    def subir(self, bucket, nombre, datos):
+        self._generacion += 1
+        self.blobs[(bucket, nombre)] = datos
+        self.generaciones[(bucket, nombre)] = self._generacion
+
+    def bucket(self, nombre):
+        return BucketFalso(self, nombre)
+
+    def list_blobs(self, bucket, prefix=""):
+        return [
+            BlobFalso(self, b, nombre)
+            for (b, nombre) in sorted(self.blobs)
+            if b == bucket and nombre.startswith(prefix or "")
+        ]
+
+
+# ---------------------------------------------------------
+# Vertex TextEmbeddingModel
+# ---------------------------------------------------------
+class _Embedding:
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values
+
+
+def vector_de_texto(texto, dimension):
+    """Vector determinista por texto: el mismo texto siempre da el mismo embedding."""
+    rng = np.random.default_rng(zlib.crc32(texto.encode("utf-8")))
+    return rng.standard_normal(dimension).astype(np.float32)
+
+
+class ModeloEmbeddingsFalso:
+    """TextEmbeddingModel determinista; cuenta llamadas y textos para verificar el empaquetado."""
+
+    def __init__(self, dimension=768, latencias=None, max_textos=None):
+        self.dimension = dimension
+        self.latencias = latencias or Latencias()
+        self.max_textos = max_textos
+        self.llamadas = 0
+        self.textos = 0
+        self._lock = threading.Lock()
+
+    def get_embeddings(self, textos, **kwargs):
+        if self.max_textos and len(textos) > self.max_textos:
+            raise ValueError(f"El modelo acepta a lo más {self.max_textos} textos por request")
+        with self._lock:
+            self.llamadas += 1
+            self.textos += len(textos)
+        _dormir(self.latencias.vertex_ms + self.latencias.vertex_ms_por_texto * len(textos))
+        return [_Embedding(vector_de_texto(texto, self.dimension).tolist()) for texto in textos]
+
+
+# ---------------------------------------------------------
+# BigQuery
+# ---------------------------------------------------------
+class _Trabajo:
+    def __init__(self, filas=None, afectadas=0, salida=0):
+        self._filas = filas or []
+        self.num_dml_affected_rows = afectadas
+        self.output_rows = salida
+        self.errors = None
+
+    def result(self):
+        return self._filas
+
+
+class _Tabla:
+    def __init__(self, columnas=()):
+        from google.cloud.bigquery import SchemaField
+
+        # Solo importan los nombres de las columnas; el tipo no se valida
+        self.schema = [SchemaField(c, "STRING") for c in columnas]
+
+
+class BigQueryFalso:
+    """
+    bigquery.Client en memoria: tablas como listas de dicts.
+    Entiende las consultas que hace app/ (índice, intenciones, DELETE, el reemplazo
+    con staging y la re-ingesta incremental); cualquier otra consulta regresa cero filas.
+    """
+
+    def __init__(self, latencias=None, esquemas=None):
+        self.latencias = latencias or Latencias()
+        self.tablas = {}
+        # table_ref -> columnas, para tablas que todavía no tienen filas
+        self.esquemas = dict(esquemas or {})
+        self.llamadas = {"query": 0, "insert_rows_json": 0, "load_table_from_file": 0}
+        self._lock = threading.Lock()
+
+    def filas(self, table_ref):
+        return self.tablas.setdefault(table_ref, [])
+
+    def _esperar(self, filas):
+        _dormir(self.latencias.bigquery_ms + self.latencias.bigquery_ms_por_fila * filas)
+
+    def insert_rows_json(self, table_ref, rows):
+        with self._lock:
+            self.llamadas["insert_rows_json"] += 1
+            self.filas(table_ref).extend(dict(r) for r in rows)
+        self._esperar(len(rows))
+        return []
+
+    def load_table_from_file(self, archivo, table_ref, job_config=None):
+        rows = [json.loads(linea) for linea in io.TextIOWrapper(archivo, encoding="utf-8") if linea.strip()]
+        with self._lock:
+            self.llamadas["load_table_from_file"] += 1
+            if getattr(job_config, "write_disposition", None) == "WRITE_TRUNCATE":
+                self.tablas[table_ref] = []
+            self.filas(table_ref).extend(rows)
+        self._esperar(len(rows))
+        return _Trabajo(salida=len(rows))
+
+    def get_table(self, table_ref):
+        # El esquema es el declarado o, si no hay, el que se infiere de las filas guardadas
+        filas = self.filas(table_ref)
+        return _Tabla(self.esquemas.get(table_ref) or (filas[0].keys() if filas else ()))
+
+    def delete_table(self, table_ref, not_found_ok=False):
+        with self._lock:
+            self.tablas.pop(table_ref, None)
+
+    def query(self, sql, job_config=None):
+        parametros = {
+            p.name: getattr(p, "value", getattr(p, "values", None))
+            for p in getattr(job_config, "query_parameters", None) or []
+        }
+        tablas = re.findall(r"FROM `([^`]+)`", sql)
+        with self._lock:
+            self.llamadas["query"] += 1
+            trabajo = self._ejecutar(sql, tablas, parametros)
+        self._esperar(len(trabajo.result()))
+        return trabajo
+
+    @staticmethod
+    def _coincide(fila, parametros):
+        topic = fila.get("topic", fila.get("knowledge_domain"))
+        return (
+            ("topic" not in parametros or (topic or "").lower() == parametros["topic"])
+            and ("channel" not in parametros or (fila.get("channel") or "").lower() == parametros["channel"])
+        )
+
+    def _ejecutar(self, sql, tablas, parametros):
+        if "UNNEST(@eliminados)" in sql or "operacion_incremental" in sql:
+            destinos = re.findall(r"(?:DELETE FROM|UPDATE|INSERT INTO) `([^`]+)`", sql)
+            return self._aplicar_incremental(destinos[:1] + tablas, parametros)
+        if "BEGIN TRANSACTION" in sql:
+            destino, staging = tablas[0], tablas[-1]
+            filas = self.filas(destino)
+            restantes = [f for f in filas if not self._coincide(f, parametros)]
+            self.tablas[destino] = restantes + [dict(f) for f in self.filas(staging)]
+            return _Trabajo(afectadas=len(filas) - len(restantes))
+        if sql.lstrip().upper().startswith("DELETE"):
+            filas = self.filas(tablas[0])
+            restantes = [f for f in filas if not self._coincide(f, parametros)]
+            self.tablas[tablas[0]] = restantes
+            return _Trabajo(afectadas=len(filas) - len(restantes))
+        if "SELECT id, intent, chunk_id, text" in sql:
+            filtros = {c: v for c, v in parametros.items() if c != "modelo_legado"}
+            return _Trabajo([
+                f for f in self.filas(tablas[0]) if all(f.get(c) == v for c, v in filtros.items())
+            ])
+        if "SELECT id, text, embedding" in sql:
+            return _Trabajo([
+                f for f in self.filas(tablas[0]) if f.get("is_repeat") == "N" and self._coincide(f, parametros)
+            ])
+        if "SELECT intent, text" in sql:
+            filas = [f for f in self.filas(tablas[0]) if self._coincide(f, parametros)]
+            return _Trabajo(sorted(filas, key=lambda f: int(f.get("chunk_id", 0))))
+        return _Trabajo()
+
+    def _aplicar_incremental(self, tablas, parametros):
+        """DELETE por ids + UPDATE/INSERT desde staging del modo incremental (según operacion_incremental)."""
+        destino = tablas[0]
+        eliminados = set(parametros.get("eliminados") or [])
+        actualizaciones = {}
+        insertadas = []
+        # El UPDATE y el INSERT leen la misma tabla staging
+        for tabla in dict.fromkeys(tablas):
+            if "_staging_" not in tabla:
+                continue
+            for f in self.filas(tabla):
+                fila = {c: v for c, v in f.items() if c != "operacion_incremental"}
+                if f.get("operacion_incremental") == "actualizar":
+                    # Como el UPDATE ... FROM real: cada fila guardada toma la de staging con su id
+                    actualizaciones[fila["id"]] = fila
+                else:
+                    insertadas.append(fila)
+        filas = []
+        for fila in self.filas(destino):
+            if fila["id"] in eliminados:
+                continue
+            cambio = actualizaciones.get(fila["id"])
+            if cambio is not None:
+                fila = {**fila, **cambio, "embedding": cambio["embedding"] or fila["embedding"]}
+            filas.append(fila)
+        filas += insertadas
+        afectadas = len(eliminados) + len(actualizaciones) + len(insertadas)
+        self.tablas[destino] = filas
+        return _Trabajo(afectadas=afectadas)
+
+    def sembrar(self, table_ref, topic, channel, total, dimension=768, semilla=0):
+        """Llena la tabla con `total` chunks sintéticos (embeddings float32) para un (topic, channel)."""
+        rng = np.random.default_rng(semilla)
+        embeddings = rng.standard_normal((total, dimension), dtype=np.float32)
+        self.filas(table_ref).extend(
+            {
+                "id": f"{topic}_sintetico_chunk_{i}",
+                "topic": topic,
+                "channel": channel,
+                "chunk_id": i,
+                "intent": f"intencion{i}",
+                "text": f"Texto sintético del chunk {i}",
+                "is_repeat": "N",
+                "embedding": embeddings[i],
+            }
+            for i in range(total)
+        )
+
+
+def instalar(storage=None, bigquery=None, modelos=None):
+    """
+    Registra los sustitutos como los clientes compartidos de app.clientes,
+    así todo el código de app/ los usa sin cambios.
+    `modelos` es un dict nombre -> ModeloEmbeddingsFalso.
+    """
+    from app import clientes
+
+    if storage is not None:
+        clientes._instancias["storage"] = storage
+    if bigquery is not None:
+        clientes._instancias["bigquery"] = bigquery
+    for nombre, modelo in (modelos or {}).items():
+        clientes._instancias[f"modelo:{nombre}"] = modelo
@@ -0,0 +1,109 @@
+import random
+
+# =========================================================
+# PDFs sintéticos con los estilos de título que reconocen los extractores
+# =========================================================
+# Se escribe el PDF a mano (sin incrustar fuentes) para que PyMuPDF reporte
+# exactamente la fuente "Calibri-Bold" con flags == 16 en los títulos.
+
+LINEAS_POR_PAGINA = 26
+
+_PALABRAS = (
+    "aportaciones patronales cuenta individual modalidad cuarenta pension retiro semanas cotizadas "
+    "salario base requisitos pago inscripcion beneficios trabajador afore saldo ahorro voluntario "
+    "vivienda cesantia vejez tramite documento identificacion comprobante domicilio plazo"
+).split()
+
+
+def _fuentes():
+    anchos = " ".join(["500"] * 95)
+    descriptor_negrita = (
+        b"<< /Type /FontDescriptor /FontName /Calibri-Bold /Flags 262176 /FontBBox [0 0 1000 1000] "
+        b"/ItalicAngle 0 /Ascent 750 /Descent -250 /CapHeight 700 /StemV 120 /FontWeight 700 >>"
+    )
+    descriptor_normal = (
+        b"<< /Type /FontDescriptor /FontName /Calibri /Flags 32 /FontBBox [0 0 1000 1000] "
+        b"/ItalicAngle 0 /Ascent 750 /Descent -250 /CapHeight 700 /StemV 80 >>"
+    )
+
+    def fuente(nombre, descriptor):
+        return (
+            f"<< /Type /Font /Subtype /TrueType /BaseFont /{nombre} /FirstChar 32 /LastChar 126 "
+            f"/Widths [{anchos}] /FontDescriptor {descriptor} 0 R /Encoding /WinAnsiEncoding >>"
+        ).encode()
+
+    return descriptor_negrita, descriptor_normal, fuente
+
+
+def pdf_desde_lineas(paginas):
+    """`paginas`: lista de páginas, cada una lista de (es_titulo, texto). Regresa los bytes del PDF."""
+    objetos = []
+
+    def agregar(objeto):
+        objetos.append(objeto)
+        return len(objetos)
+
+    descriptor_negrita, descriptor_normal, fuente = _fuentes()
+    negrita = agregar(fuente("Calibri-Bold", agregar(descriptor_negrita)))
+    normal = agregar(fuente("Calibri", agregar(descriptor_normal)))
+
+    pendientes = []
+    for lineas in paginas:
+        contenido = []
+        y = 800
+        for es_titulo, texto in lineas:
+            texto = texto.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            contenido.append(f"BT /{'FB' if es_titulo else 'FR'} 11 Tf 50 {y} Td ({texto}) Tj ET")
+            y -= 30
+        flujo = "\n".join(contenido).encode("latin-1")
+        id_contenido = agregar(b"<< /Length %d >>\nstream\n" % len(flujo) + flujo + b"\nendstream")
+        pendientes.append((agregar(None), id_contenido))
+
+    id_paginas = agregar(None)
+    for id_pagina, id_contenido in pendientes:
+        objetos[id_pagina - 1] = (
+            f"<< /Type /Page /Parent {id_paginas} 0 R /MediaBox [0 0 612 842] /Contents {id_contenido} 0 R "
+            f"/Resources << /Font << /FB {negrita} 0 R /FR {normal} 0 R >> >> >>"
+        ).encode()
+    hijos = " ".join(f"{id_pagina} 0 R" for id_pagina, _ in pendientes)
+    objetos[id_paginas - 1] = f"<< /Type /Pages /Kids [{hijos}] /Count {len(pendientes)} >>".encode()
+    catalogo = agregar(f"<< /Type /Catalog /Pages {id_paginas} 0 R >>".encode())
+
+    salida = bytearray(b"%PDF-1.4\n")
+    posiciones = []
+    for numero, objeto in enumerate(objetos, 1):
+        posiciones.append(len(salida))
+        salida += b"%d 0 obj\n" % numero + objeto + b"\nendobj\n"
+    inicio_xref = len(salida)
+    salida += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    salida += b"".join(b"%010d 00000 n \n" % posicion for posicion in posiciones)
+    salida += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, catalogo, inicio_xref)
+    return bytes(salida)
+
+
+def _titulo_camel_case(rng):
+    return "".join(rng.choice(_PALABRAS).capitalize() for _ in range(rng.randint(2, 4)))
+
+
+def generar_pdf(paginas, estilo="camel_case", lineas_por_titulo=6, semilla=0):
+    """
+    PDF de `paginas` páginas con un título cada `lineas_por_titulo` líneas.
+    estilo "camel_case": títulos CamelCase (extraer_texto_con_intenciones).
+    estilo "subtitulo": títulos CamelCase_subtitulo (extraer_texto_con_intenciones_beta);
+    los títulos se repiten para ejercitar el agrupamiento por intent_document.
+    """
+    rng = random.Random(semilla)
+    titulos = [_titulo_camel_case(rng) for _ in range(max(4, paginas))]
+    contenido = []
+    for pagina in range(paginas):
+        lineas = []
+        for numero in range(LINEAS_POR_PAGINA):
+            if numero % lineas_por_titulo == 0:
+                titulo = rng.choice(titulos)
+                if estilo == "subtitulo":
+                    titulo = f"{titulo}_{rng.choice(_PALABRAS)}"
+                lineas.append((True, titulo))
+            else:
+                lineas.append((False, " ".join(rng.choice(_PALABRAS) for _ in range(rng.randint(6, 12)))))
+        contenido.append(lineas)
+    return pdf_desde_lineas(contenido)
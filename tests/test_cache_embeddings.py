@@ -0,0 +1,25 @@
+"""Backend Redis de la caché de embeddings sobre el cliente compartido de app/clientes.py."""
+from app import cache_embeddings, clientes
+from app.cache_embeddings import CacheEmbeddingsRedis, llave_cache
+from app.cache_resultados import RedisEnMemoria
+
+
+def test_redis_sin_url_usa_el_cliente_compartido(monkeypatch):
+    compartido = RedisEnMemoria()
+    monkeypatch.setitem(clientes._instancias, "redis", compartido)
+    monkeypatch.setattr(cache_embeddings, "EMBEDDING_CACHE_BACKEND", "redis")
+    monkeypatch.setattr(cache_embeddings, "EMBEDDING_CACHE_REDIS_URL", None)
+    monkeypatch.setattr(cache_embeddings, "_cache", None)
+
+    cache = cache_embeddings.obtener_cache_embeddings()
+    assert isinstance(cache, CacheEmbeddingsRedis)
+    assert cache._cliente is compartido
+
+
+def test_guardar_y_obtener_varios_en_redis_en_memoria():
+    cache = CacheEmbeddingsRedis(RedisEnMemoria())
+    uno, dos = llave_cache("modelo", None, "uno"), llave_cache("modelo", 256, "dos")
+    cache.guardar_varios({uno: [0.5, -1.0], dos: [0.25]})
+
+    assert cache.obtener_varios([uno, "ausente", dos, uno]) == {uno: [0.5, -1.0], dos: [0.25]}
+    assert cache.obtener_varios([]) == {}
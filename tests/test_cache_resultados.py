@@ -0,0 +1,187 @@
+"""CacheResultados.obtener_o_calcular sobre RedisEnMemoria: aciertos, coalescencia, versiones y candado."""
+import asyncio
+
+import pytest
+
+from app import cache_resultados
+from app.cache_resultados import CacheResultados, RedisEnMemoria
+
+
+class Calculo:
+    """Corrutina `calcular(version)` que cuenta llamadas y puede tardar o fallar."""
+
+    def __init__(self, respuesta=None, espera=0, error=None):
+        self.respuesta = respuesta
+        self.espera = espera
+        self.error = error
+        self.versiones = []
+
+    async def __call__(self, version):
+        self.versiones.append(version)
+        await asyncio.sleep(self.espera)
+        if self.error is not None:
+            raise self.error
+        return self.respuesta if self.respuesta is not None else {"version": version}
+
+
+class RedisCaido:
+    def __getattr__(self, nombre):
+        def fallar(*args, **kwargs):
+            raise ConnectionError("redis caído")
+
+        return fallar
+
+
+def _candado(cache, version, topic="Pensiones", channel="web", partes=("pregunta",)):
+    return f"{cache.llave(version, topic, channel, partes)}:lock"
+
+
+def test_miss_y_luego_hit():
+    cache = CacheResultados(RedisEnMemoria())
+    calcular = Calculo({"respuesta": "texto", "similitud": 0.75})
+
+    async def escenario():
+        primero = await cache.obtener_o_calcular("Pensiones", "web", ["pregunta"], calcular)
+        segundo = await cache.obtener_o_calcular("pensiones ", "WEB", ["pregunta"], calcular)
+        return primero, segundo
+
+    primero, segundo = asyncio.run(escenario())
+    assert primero == ({"respuesta": "texto", "similitud": 0.75}, "miss")
+    assert segundo == ({"respuesta": "texto", "similitud": 0.75}, "hit")
+    assert calcular.versiones == [0]
+
+
+def test_partes_distinguen_mayusculas():
+    cache = CacheResultados(RedisEnMemoria())
+    calcular = Calculo()
+
+    async def escenario():
+        await cache.obtener_o_calcular("t", "c", ["Intent"], calcular)
+        return await cache.obtener_o_calcular("t", "c", ["intent"], calcular)
+
+    assert asyncio.run(escenario())[1] == "miss"
+    assert len(calcular.versiones) == 2
+
+
+def test_consultas_en_vuelo_del_mismo_proceso_se_coalescen():
+    cache = CacheResultados(RedisEnMemoria())
+    calcular = Calculo(espera=0.05)
+
+    async def escenario():
+        return await asyncio.gather(*(cache.obtener_o_calcular("t", "c", ["p"], calcular) for _ in range(5)))
+
+    resultados = asyncio.run(escenario())
+    assert sorted(origen for _, origen in resultados) == ["coalesced"] * 4 + ["miss"]
+    assert all(respuesta == {"version": 0} for respuesta, _ in resultados)
+    assert calcular.versiones == [0]
+    assert cache._en_vuelo == {}
+
+
+def test_otra_instancia_espera_el_resultado_del_candado():
+    # Dos instancias con el mismo Redis: la segunda no calcula, lee lo que guardó la primera
+    redis = RedisEnMemoria()
+    primera, segunda = CacheResultados(redis), CacheResultados(redis)
+    lento, rapido = Calculo({"de": "primera"}, espera=0.2), Calculo({"de": "segunda"})
+
+    async def escenario():
+        tarea = asyncio.ensure_future(primera.obtener_o_calcular("t", "c", ["p"], lento))
+        await asyncio.sleep(0.05)
+        return await asyncio.gather(tarea, segunda.obtener_o_calcular("t", "c", ["p"], rapido))
+
+    (respuesta_1, origen_1), (respuesta_2, origen_2) = asyncio.run(escenario())
+    assert (respuesta_1, origen_1) == ({"de": "primera"}, "miss")
+    assert (respuesta_2, origen_2) == ({"de": "primera"}, "coalesced")
+    assert rapido.versiones == []
+
+
+def test_candado_huerfano_se_espera_y_luego_se_calcula(monkeypatch):
+    # La instancia dueña del candado murió sin guardar: se espera a lo más RESULTADOS_ESPERA_SEGUNDOS
+    monkeypatch.setattr(cache_resultados, "RESULTADOS_ESPERA_SEGUNDOS", 0.2)
+    redis = RedisEnMemoria()
+    cache = CacheResultados(redis)
+    redis.set(_candado(cache, 0, "t", "c", ["p"]), "otra-instancia", px=60000, nx=True)
+    calcular = Calculo()
+
+    assert asyncio.run(cache.obtener_o_calcular("t", "c", ["p"], calcular)) == ({"version": 0}, "miss")
+    assert calcular.versiones == [0]
+
+
+def test_invalidar_sube_la_version_y_deja_de_leer_lo_anterior():
+    redis = RedisEnMemoria()
+    cache = CacheResultados(redis)
+    calcular = Calculo()
+
+    async def escenario():
+        antes = await cache.obtener_o_calcular("Pensiones", "web", ["p"], calcular)
+        version = cache.invalidar("pensiones", "Web")
+        despues = await cache.obtener_o_calcular("Pensiones", "web", ["p"], calcular)
+        otra_llave = await cache.obtener_o_calcular("Otro", "web", ["p"], calcular)
+        return antes, version, despues, otra_llave
+
+    antes, version, despues, otra_llave = asyncio.run(escenario())
+    assert antes == ({"version": 0}, "miss")
+    assert version == 1
+    assert despues == ({"version": 1}, "miss")
+    assert otra_llave == ({"version": 0}, "miss")
+    assert calcular.versiones == [0, 1, 0]
+    assert cache.version("pensiones", "web") == 1
+
+
+def test_candado_se_suelta_despues_de_calcular():
+    redis = RedisEnMemoria()
+    cache = CacheResultados(redis)
+
+    asyncio.run(cache.obtener_o_calcular("Pensiones", "web", ["pregunta"], Calculo()))
+    assert redis.get(_candado(cache, 0)) is None
+
+
+def test_candado_se_suelta_si_el_calculo_falla():
+    redis = RedisEnMemoria()
+    cache = CacheResultados(redis)
+    falla = Calculo(error=RuntimeError("vertex"))
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(cache.obtener_o_calcular("Pensiones", "web", ["pregunta"], falla))
+    assert redis.get(_candado(cache, 0)) is None
+    assert cache._en_vuelo == {}
+
+    # El siguiente intento calcula de nuevo en vez de esperar un candado huérfano
+    calcular = Calculo()
+    assert asyncio.run(cache.obtener_o_calcular("Pensiones", "web", ["pregunta"], calcular))[1] == "miss"
+    assert calcular.versiones == [0]
+
+
+def test_no_se_suelta_un_candado_ajeno():
+    # El candado expiró durante el cálculo y lo tomó otra instancia: no se le borra
+    redis = RedisEnMemoria()
+    cache = CacheResultados(redis)
+    candado = _candado(cache, 0)
+
+    async def calcular(version):
+        redis.delete(candado)
+        redis.set(candado, "otra-instancia", px=60000, nx=True)
+        return {"version": version}
+
+    asyncio.run(cache.obtener_o_calcular("Pensiones", "web", ["pregunta"], calcular))
+    assert redis.get(candado) == b"otra-instancia"
+
+
+def test_respuestas_no_cacheables_no_se_guardan():
+    cache = CacheResultados(RedisEnMemoria())
+    calcular = Calculo({"resultados": []})
+    no_vacia = lambda respuesta: bool(respuesta["resultados"])
+
+    async def escenario():
+        await cache.obtener_o_calcular("t", "c", ["p"], calcular, cacheable=no_vacia)
+        return await cache.obtener_o_calcular("t", "c", ["p"], calcular, cacheable=no_vacia)
+
+    assert asyncio.run(escenario())[1] == "miss"
+    assert calcular.versiones == [0, 0]
+
+
+def test_sin_redis_se_calcula_sin_version():
+    cache = CacheResultados(RedisCaido())
+    calcular = Calculo()
+
+    assert asyncio.run(cache.obtener_o_calcular("t", "c", ["p"], calcular)) == ({"version": None}, "miss")
+    assert calcular.versiones == [None]
@@ -0,0 +1,44 @@
+"""
+Paridad del motor de extracción con los extractores originales.
+
+tests/datos/extractor_paridad.json guarda la salida de las funciones anteriores a
+extraer_secciones (extraer_texto_con_intenciones y extraer_texto_con_intenciones_beta
+del commit base) sobre PDFs de bench/pdf_sintetico.py. Si un cambio en el motor o en
+los detectores altera la salida, hay que subir VERSION_EXTRACTOR y regenerar el golden.
+"""
+import json
+import os
+
+import pytest
+
+from app import extraccion_paginas, extractor
+from bench.pdf_sintetico import generar_pdf
+
+with open(os.path.join(os.path.dirname(__file__), "datos", "extractor_paridad.json"), encoding="utf-8") as archivo:
+    CASOS = json.load(archivo)
+
+
+@pytest.mark.parametrize("caso", CASOS, ids=[caso["nombre"] for caso in CASOS])
+def test_misma_salida_que_el_extractor_original(caso):
+    detector = getattr(extractor, caso["detector"])()
+    secciones = extractor.lineas_y_secciones(generar_pdf(**caso["pdf"]), detector)
+    assert secciones == caso["esperado"]
+
+
+@pytest.mark.parametrize("caso", CASOS[:1] + CASOS[2:3], ids=lambda caso: caso["nombre"])
+def test_misma_salida_con_extraccion_paralela(caso, monkeypatch):
+    # Rangos de páginas en procesos separados; el orden de las líneas no debe cambiar
+    monkeypatch.setattr(extraccion_paginas, "EXTRACCION_PARALELA_MIN_PAGINAS", 1)
+    monkeypatch.setattr(extraccion_paginas, "EXTRACCION_PROCESOS", 2)
+    detector = getattr(extractor, caso["detector"])()
+    secciones = extractor.lineas_y_secciones(generar_pdf(**caso["pdf"]), detector)
+    assert secciones == caso["esperado"]
+
+
+def test_pdf_desde_archivo_igual_que_desde_bytes(tmp_path):
+    # Los PDFs grandes se descargan a disco y el motor recibe la ruta
+    caso = CASOS[0]
+    ruta = tmp_path / "documento.pdf"
+    ruta.write_bytes(generar_pdf(**caso["pdf"]))
+    secciones = extractor.lineas_y_secciones(str(ruta), extractor.DetectorCalibriCamelCase())
+    assert secciones == caso["esperado"]
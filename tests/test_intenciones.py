@@ -0,0 +1,47 @@
+"""Mapa intent -> texto de CacheIntenciones, con y sin fragmentación."""
+import pytest
+
+from app import indice
+from app.fragmentacion import fragmentar_texto
+from app.indice import CacheIntenciones
+
+SECCION = " ".join(f"Oración número {i} de la sección de requisitos." for i in range(40))
+
+
+def _filas(textos, intent="requisitos", documento="manual.pdf", inicio=0):
+    return [
+        {"intent": intent, "text": texto, "name_document": documento, "chunk_id": str(inicio + i)}
+        for i, texto in enumerate(textos)
+    ]
+
+
+def _mapa(filas):
+    return CacheIntenciones(lambda topic, channel: filas).obtener("t", "c")[0]
+
+
+def test_con_fragmentacion_se_reconstruye_la_seccion(monkeypatch):
+    monkeypatch.setattr(indice, "FRAGMENTOS_HABILITADOS", True)
+    fragmentos = fragmentar_texto(SECCION, max_caracteres=300, solapamiento=60)
+    assert len(fragmentos) > 1
+
+    filas = _filas(fragmentos) + _filas(["Otra sección con el mismo título."], documento="otro.pdf")
+    assert _mapa(filas) == {"requisitos": SECCION}
+
+
+def test_sin_fragmentacion_no_se_unen_secciones_con_el_mismo_titulo(monkeypatch):
+    # Dos secciones seguidas bajo el mismo título: se responde con la primera, como siempre
+    monkeypatch.setattr(indice, "FRAGMENTOS_HABILITADOS", False)
+    filas = _filas(["Primera sección.", "Segunda sección con el mismo título."])
+    assert _mapa(filas) == {"requisitos": "Primera sección."}
+
+
+@pytest.mark.parametrize("habilitados", [True, False])
+def test_fragmentos_de_otro_documento_o_no_consecutivos_no_se_unen(monkeypatch, habilitados):
+    monkeypatch.setattr(indice, "FRAGMENTOS_HABILITADOS", habilitados)
+    filas = (
+        _filas(["Primera."])
+        + _filas(["Otro documento."], documento="otro.pdf", inicio=1)
+        + _filas(["No consecutivo."], inicio=5)
+        + _filas(["Pago."], intent="pago", inicio=6)
+    )
+    assert _mapa(filas) == {"requisitos": "Primera.", "pago": "Pago."}
@@ -0,0 +1,72 @@
+"""Las columnas del modelo se agregan con la migración, nunca durante la ingesta."""
+import pytest
+
+from app import bigquery as ingesta
+from app import clientes, migraciones
+from app.modelos import EMBEDDING_MODELO
+from bench import falsos
+
+TABLA = "prueba.prueba.chunks"
+SIN_MODELO = ("id", "channel", "name_document", "chunk_id", "text", "topic", "intent",
+              "is_transactional", "embedding", "is_repeat")
+
+
+class BigQueryConConsultas(falsos.BigQueryFalso):
+    """Además guarda el SQL de cada consulta."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sql = []
+
+    def query(self, sql, job_config=None):
+        self.sql.append(sql)
+        return super().query(sql, job_config)
+
+
+@pytest.fixture
+def preparar(monkeypatch):
+    def preparar(columnas):
+        bq = BigQueryConConsultas(esquemas={TABLA: columnas})
+        monkeypatch.setattr(ingesta, "PROJECT_ID", "prueba")
+        monkeypatch.setattr(ingesta, "DATASET_ID", "prueba")
+        monkeypatch.setattr(ingesta, "TABLE_ID", "chunks")
+        monkeypatch.setattr(ingesta, "obtener_cache_embeddings", lambda: None)
+        monkeypatch.setattr(ingesta, "_tablas_con_columnas_modelo", set())
+        monkeypatch.setitem(clientes._instancias, "bigquery", bq)
+        monkeypatch.setitem(clientes._instancias, f"modelo:{EMBEDDING_MODELO}", falsos.ModeloEmbeddingsFalso(max_textos=1))
+        return bq
+
+    return preparar
+
+
+def test_migracion_agrega_solo_las_columnas_que_faltan(preparar):
+    bq = preparar(SIN_MODELO + ("embedding_model",))
+    assert migraciones.agregar_columnas_modelo(TABLA) == ["embedding_dimension"]
+    assert len(bq.sql) == 1
+    assert "ADD COLUMN IF NOT EXISTS embedding_dimension INT64" in bq.sql[0]
+    assert "embedding_model" not in bq.sql[0]
+
+
+def test_migracion_sin_cambios_no_consulta(preparar):
+    bq = preparar(SIN_MODELO + tuple(migraciones.COLUMNAS_MODELO))
+    assert migraciones.agregar_columnas_modelo(TABLA) == []
+    assert bq.sql == []
+
+
+@pytest.mark.parametrize("modo", ["streaming", "load", "incremental"])
+def test_ingesta_sin_migrar_falla_sin_alterar_ni_escribir(preparar, modo):
+    bq = preparar(SIN_MODELO)
+    with pytest.raises(Exception, match="app.migraciones"):
+        ingesta.insertar_chunks_en_bigquery(
+            [{"intent": "Requisitos", "texto": "texto"}], "manual.pdf", "t", "c", modo_escritura=modo
+        )
+    assert not any("ALTER TABLE" in sql for sql in bq.sql)
+    assert bq.filas(TABLA) == []
+
+
+def test_ingesta_con_columnas_no_altera_la_tabla(preparar):
+    bq = preparar(SIN_MODELO + tuple(migraciones.COLUMNAS_MODELO))
+    ingesta.insertar_chunks_en_bigquery([{"intent": "Requisitos", "texto": "texto"}], "manual.pdf", "t", "c",
+                                        modo_escritura="streaming")
+    assert not any("ALTER TABLE" in sql for sql in bq.sql)
+    assert len(bq.filas(TABLA)) == 1
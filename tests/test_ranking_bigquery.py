@@ -0,0 +1,124 @@
+"""SQL y parámetros del ranking en servidor, con un cliente falso en lugar de bigquery.Client."""
+import pytest
+from google.cloud import bigquery
+
+from app.modelos import CONDICION_MODELO_SQL, EMBEDDING_MODELO_LEGADO, ModeloEmbeddings
+from app.ranking_bigquery import buscar_top_k_en_bigquery, construir_consulta_top_k
+
+TABLA = "proyecto.dataset.embeddings"
+
+
+class _Trabajo:
+    def __init__(self, filas):
+        self._filas = filas
+
+    def result(self):
+        return iter(self._filas)
+
+
+class ClienteFalso:
+    """Guarda cada consulta con su job_config y regresa filas fijas."""
+
+    def __init__(self, filas=()):
+        self.filas = list(filas)
+        self.consultas = []
+
+    def query(self, query, job_config=None):
+        self.consultas.append((query, job_config))
+        return _Trabajo(self.filas)
+
+
+def _parametros(job_config):
+    """{nombre: (tipo, valor)} de los parámetros de la consulta."""
+    parametros = {}
+    for parametro in job_config.query_parameters:
+        if isinstance(parametro, bigquery.ArrayQueryParameter):
+            parametros[parametro.name] = (parametro.array_type, parametro.values)
+        else:
+            parametros[parametro.name] = (parametro.type_, parametro.value)
+    return parametros
+
+
+def _normalizar_sql(query):
+    return " ".join(query.split())
+
+
+def test_cosine_distance_sql_y_parametros():
+    cliente = ClienteFalso([
+        {"text": "primero", "similarity": 0.9},
+        {"text": "segundo", "similarity": 0.5},
+    ])
+    resultado = buscar_top_k_en_bigquery(cliente, TABLA, [1, 0.5, 0], " Pensiones ", "WhatsApp ", k="3")
+
+    assert resultado == [{"text": "primero", "similarity": 0.9}, {"text": "segundo", "similarity": 0.5}]
+    assert len(cliente.consultas) == 1
+    query, job_config = cliente.consultas[0]
+    sql = _normalizar_sql(query)
+    assert "SELECT text, 1 - COSINE_DISTANCE(embedding, @question_embedding) AS similarity" in sql
+    assert f"FROM `{TABLA}`" in sql
+    assert "WHERE is_repeat = 'N' AND topic = @topic AND channel = @channel ORDER BY similarity DESC LIMIT @k" in sql
+    assert "VECTOR_SEARCH" not in sql
+    assert _parametros(job_config) == {
+        "question_embedding": ("FLOAT64", [1.0, 0.5, 0.0]),
+        "topic": ("STRING", "pensiones"),
+        "channel": ("STRING", "whatsapp"),
+        "k": ("INT64", 3),
+    }
+
+
+def test_vector_search_sql_y_parametros():
+    cliente = ClienteFalso([{"text": "uno", "similarity": 0.8}])
+    resultado = buscar_top_k_en_bigquery(cliente, TABLA, [0.25, 0.75], "topic", "canal", k=7, modo="vector_search")
+
+    assert resultado == [{"text": "uno", "similarity": 0.8}]
+    query, job_config = cliente.consultas[0]
+    sql = _normalizar_sql(query)
+    assert "SELECT base.text AS text, 1 - distance AS similarity FROM VECTOR_SEARCH(" in sql
+    assert (
+        f"(SELECT text, embedding FROM `{TABLA}` WHERE is_repeat = 'N' AND topic = @topic AND channel = @channel)"
+        in sql
+    )
+    assert "'embedding', (SELECT @question_embedding AS embedding), top_k => 7, distance_type => 'COSINE' )" in sql
+    assert sql.endswith("ORDER BY distance")
+    # top_k va como constante en el SQL, no como parámetro
+    assert "@k" not in sql
+    assert _parametros(job_config) == {
+        "question_embedding": ("FLOAT64", [0.25, 0.75]),
+        "topic": ("STRING", "topic"),
+        "channel": ("STRING", "canal"),
+    }
+
+
+@pytest.mark.parametrize("modo", ["bigquery", "vector_search"])
+def test_filtro_de_modelo(modo):
+    cliente = ClienteFalso()
+    modelo = ModeloEmbeddings("text-embedding-005", 256)
+    buscar_top_k_en_bigquery(cliente, TABLA, [0.0] * 256, "topic", "canal", k=5, modo=modo, modelo=modelo)
+
+    query, job_config = cliente.consultas[0]
+    sql = _normalizar_sql(query)
+    assert f"topic = @topic AND channel = @channel AND {CONDICION_MODELO_SQL}" in sql
+    parametros = _parametros(job_config)
+    assert parametros["embedding_model"] == ("STRING", "text-embedding-005")
+    assert parametros["embedding_dimension"] == ("INT64", 256)
+    assert parametros["modelo_legado"] == ("STRING", EMBEDDING_MODELO_LEGADO)
+
+
+@pytest.mark.parametrize("modo", ["bigquery", "vector_search"])
+def test_valores_del_usuario_solo_como_parametros(modo):
+    cliente = ClienteFalso()
+    topic = "x' OR '1'='1"
+    buscar_top_k_en_bigquery(cliente, TABLA, [1.0], topic, "canal", modo=modo)
+
+    query, job_config = cliente.consultas[0]
+    assert "OR '1'='1" not in query
+    assert _parametros(job_config)["topic"] == ("STRING", topic.lower())
+
+
+def test_modo_no_soportado():
+    with pytest.raises(ValueError):
+        construir_consulta_top_k(TABLA, modo="local")
+    cliente = ClienteFalso()
+    with pytest.raises(ValueError):
+        buscar_top_k_en_bigquery(cliente, TABLA, [1.0], "topic", "canal", modo="otro")
+    assert cliente.consultas == []
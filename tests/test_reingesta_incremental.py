@@ -0,0 +1,79 @@
+"""Re-ingesta incremental contra el BigQuery en memoria de bench/falsos.py."""
+import pytest
+
+from app import bigquery as ingesta
+from app import clientes
+from app.modelos import EMBEDDING_MODELO
+from bench import falsos
+
+COLUMNAS = ("id", "channel", "name_document", "chunk_id", "text", "intent",
+            "is_transactional", "embedding", "embedding_model", "embedding_dimension", "is_repeat")
+TABLAS = {
+    "insertar_chunks_en_bigquery": ("prueba.prueba.chunks", COLUMNAS + ("topic",)),
+    "insertar_chunks_en_bigquery_beta": ("prueba.prueba.chunks_beta", COLUMNAS + ("knowledge_domain", "intent_document")),
+}
+
+
+def _parrafo(intent, texto):
+    return {"intent": intent, "texto": f"{texto}: texto de la sección {texto} con su contenido"}
+
+
+A, B, C, D, N = (_parrafo(intent, texto) for intent, texto in
+                 (("Requisitos", "a"), ("Requisitos", "b"), ("Pago", "c"), ("Pago", "d"), ("Requisitos", "n")))
+
+EDICIONES = {
+    # Un párrafo nuevo al inicio, con el mismo intent que el que era el primero
+    "insertado_al_inicio_mismo_intent": ([A, B, C], [N, A, B, C]),
+    # Un párrafo nuevo al inicio, con otro intent: los demás solo se recorren
+    "insertado_al_inicio_otro_intent": ([C, A, B], [N, C, A, B]),
+    # Se borra la primera sección: los chunks recorridos conservan su id y los nuevos no deben chocar con él
+    "primera_seccion_borrada": ([A, C, D], [C, D, _parrafo("Pago", "e")]),
+}
+
+
+@pytest.fixture
+def bq(monkeypatch):
+    bq = falsos.BigQueryFalso(esquemas={tabla: columnas for tabla, columnas in TABLAS.values()})
+    monkeypatch.setattr(ingesta, "PROJECT_ID", "prueba")
+    monkeypatch.setattr(ingesta, "DATASET_ID", "prueba")
+    monkeypatch.setattr(ingesta, "TABLE_ID", "chunks")
+    monkeypatch.setattr(ingesta, "TABLE_ID_BETA", "chunks_beta")
+    monkeypatch.setattr(ingesta, "obtener_cache_embeddings", lambda: None)
+    monkeypatch.setitem(clientes._instancias, "bigquery", bq)
+    monkeypatch.setitem(clientes._instancias, f"modelo:{EMBEDDING_MODELO}", falsos.ModeloEmbeddingsFalso(max_textos=1))
+    return bq
+
+
+@pytest.mark.parametrize("funcion", list(TABLAS))
+@pytest.mark.parametrize("edicion", list(EDICIONES))
+def test_reingesta_sin_ids_duplicados(bq, funcion, edicion):
+    original, editado = EDICIONES[edicion]
+    insertar = getattr(ingesta, funcion)
+    tabla = TABLAS[funcion][0]
+
+    insertar(original, "manual.pdf", "Pensiones", "web", modo_escritura="incremental")
+    resultado = insertar(editado, "manual.pdf", "Pensiones", "web", modo_escritura="incremental")
+
+    filas = bq.filas(tabla)
+    ids = [fila["id"] for fila in filas]
+    assert len(ids) == len(set(ids))
+    assert sorted((int(fila["chunk_id"]), fila["text"]) for fila in filas) == [
+        (i, parrafo["texto"]) for i, parrafo in enumerate(editado)
+    ]
+    # Todos los embeddings completos: el índice no puede cargar vectores de distinto tamaño
+    assert {len(fila["embedding"]) for fila in filas} == {len(filas[0]["embedding"])}
+    assert all(len(fila["embedding"]) for fila in filas)
+    assert resultado["cambios"]["sin_cambios"] + resultado["total_insertados"] + resultado["cambios"]["movidos"] == len(editado)
+
+
+@pytest.mark.parametrize("funcion", list(TABLAS))
+def test_reingesta_sin_cambios_no_escribe(bq, funcion):
+    insertar = getattr(ingesta, funcion)
+    insertar([A, B, C], "manual.pdf", "Pensiones", "web", modo_escritura="incremental")
+    antes = [dict(fila) for fila in bq.filas(TABLAS[funcion][0])]
+
+    resultado = insertar([A, B, C], "manual.pdf", "Pensiones", "web", modo_escritura="incremental")
+
+    assert resultado["total_insertados"] == 0
+    assert resultado["cambios"]["sin_cambios"] == 3
+    assert bq.filas(TABLAS[funcion][0]) == antes